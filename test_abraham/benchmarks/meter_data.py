@@ -0,0 +1,54 @@
+import numpy as np
+from frappe.utils import add_months, get_first_day, getdate, nowdate
+
+
+INTERVAL_SECONDS = 15 * 60
+READINGS_PER_HOUR = 3600 // INTERVAL_SECONDS
+
+
+def generate_readings(months, start=None, base_kw=1.5, seed=None):
+    """
+    Generates synthetic meter data for one customer: a KW reading every 15 minutes and
+    the KWH of each hour on the reading at the full hour (zero on the others).
+
+    The load follows a daily shape (night base load, a morning and a larger evening
+    peak, lower on weekends) scaled by a seasonal curve peaking mid-year, with
+    multiplicative noise, so the tariff bands and monthly averages differ like real data.
+
+    Args:
+        months (int): Number of whole months to generate.
+        start (str, optional): First month, defaults to `months` months before the current one
+            so every reading lies in a closed month.
+        base_kw (float, optional): Average night load of the customer.
+        seed (int, optional): Seed for reproducible data.
+
+    Returns:
+        tuple: `dates` (datetime64[s]), `kw` and `kwh` (float64) arrays of equal length.
+    """
+    first = getdate(get_first_day(start or add_months(nowdate(), -months)))
+    end = getdate(add_months(first, months))
+    dates = np.arange(
+        np.datetime64(first, "s"), np.datetime64(end, "s"), np.timedelta64(INTERVAL_SECONDS, "s")
+    )
+    rng = np.random.default_rng(seed)
+
+    hours = (dates - dates.astype("datetime64[D]")).astype(np.int64) / 3600
+    daily = (
+        1
+        + 0.8 * np.exp(-0.5 * ((hours - 7.5) / 1.2) ** 2)
+        + 1.6 * np.exp(-0.5 * ((hours - 19.5) / 2.0) ** 2)
+    )
+    # 1970-01-01 was a Thursday, so shifting by 3 numbers the weekdays from Monday = 0
+    weekday = (dates.astype("datetime64[D]").astype(np.int64) + 3) % 7
+    daily *= np.where(weekday >= 5, 0.85, 1.0)
+
+    day_of_year = (dates - dates.astype("datetime64[Y]")).astype("timedelta64[D]").astype(np.int64)
+    seasonal = 1 + 0.25 * np.cos(2 * np.pi * (day_of_year - 182) / 365.25)
+
+    kw = np.round(base_kw * daily * seasonal * rng.lognormal(0, 0.15, len(dates)), 3)
+
+    # Energy of each hour, booked on the reading that starts it
+    hourly = kw.reshape(-1, READINGS_PER_HOUR).mean(axis=1)
+    kwh = np.zeros(len(dates))
+    kwh[::READINGS_PER_HOUR] = np.round(hourly, 3)
+    return dates, kw, kwh
@@ -0,0 +1,363 @@
+import json
+import subprocess
+import time
+from datetime import timedelta
+
+import frappe
+import numpy as np
+from frappe.utils import add_months, get_first_day, getdate, now, now_datetime
+
+from test_abraham.benchmarks.meter_data import generate_readings
+from test_abraham.solar_cell_company.doctype.power_consumption.power_consumption import (
+    DEFAULT_METER_CHANNEL,
+    get_series_key,
+    make_reading_key,
+)
+from test_abraham.solar_cell_company.doctype.solar_cell_settings.solar_cell_settings import get_settings
+from test_abraham.solar_cell_company.report.customer_average_consumption_report.customer_average_consumption_report import (
+    execute as execute_report,
+)
+from test_abraham.utils.bulk_import import CHUNK_SIZE, insert_readings
+from test_abraham.utils.consumption_aggregates import AGGREGATE_DOCTYPES
+from test_abraham.utils.consumption_blocks import delete_block_file
+from test_abraham.utils.consumption_timeseries import get_consumption_timeseries
+from test_abraham.utils.full_rebuild import rebuild_roi_calculations
+from test_abraham.utils.instrumentation import count_queries
+from test_abraham.utils.recalculation import refresh_consumption_summaries
+from test_abraham.utils.solar_simulator import DEFAULT_BATTERY_SIZES, DEFAULT_PANEL_SIZES, simulate_solar
+from test_abraham.utils.summary_cache import get_customer_summary
+
+
+RESULTS_VERSION = 1
+BENCHMARK_EMAIL = "benchmark-customer-{0}@example.com"
+BENCHMARK_CHANNEL = "benchmark"
+
+# Metrics compared against a baseline, and whether a higher value is a regression
+COMPARED_METRICS = {
+    "p50_ms": True,
+    "p95_ms": True,
+    "p99_ms": True,
+    "queries": True,
+    "rows_per_second": False,
+}
+
+
+def run_benchmarks(customers=5, months=3, samples=100, report_runs=5, workers=None, seed=0, keep=False,
+        progress=None):
+    """
+    Seeds synthetic meter data and times the hot paths of the app against it.
+
+    Meant for a dedicated benchmark site: the rebuild step recomputes every customer in the
+    generated range. The generated customers and their records are deleted afterwards
+    unless `keep` is set.
+
+    Args:
+        customers (int, optional): Number of generated customers.
+        months (int, optional): Closed months of 15-minute readings per customer.
+        samples (int, optional): Readings submitted and cancelled one by one.
+        report_runs (int, optional): Executions of the Customer Average Consumption Report.
+        workers (int, optional): Worker processes of the rebuild, see `rebuild_roi_calculations`.
+        seed (int, optional): Seed of the generated data.
+        keep (bool, optional): Keep the generated data.
+        progress (callable, optional): Called with a message before each step.
+
+    Returns:
+        dict: JSON-serializable results with the run parameters, the current commit and
+        per-operation latency percentiles, query counts and throughput.
+    """
+    progress = progress or (lambda message: None)
+    first_month = get_first_day(add_months(now_datetime(), -months))
+    last_day = getdate(add_months(first_month, months)) - timedelta(days=1)
+    settings = get_settings()
+
+    results = {
+        "version": RESULTS_VERSION,
+        "commit": get_commit(),
+        "started": now(),
+        "parameters": {
+            "customers": customers,
+            "months": months,
+            "samples": samples,
+            "report_runs": report_runs,
+            "workers": workers,
+            "seed": seed,
+            "defer_roi_recalculation": settings.defer_roi_recalculation,
+            "consumption_storage": settings.consumption_storage,
+        },
+        "results": {},
+    }
+
+    names = []
+    try:
+        progress(f"Seeding {customers} customers with {months} months of readings")
+        names = make_customers(customers)
+        started = time.monotonic()
+        readings = seed_readings(names, months, first_month, seed)
+        results["results"]["seed"] = throughput(readings, time.monotonic() - started)
+
+        progress(f"Submitting and cancelling {samples} readings")
+        submit, cancel = measure_submit_and_cancel(names[0], samples)
+        results["results"]["submit"] = submit
+        results["results"]["cancel"] = cancel
+
+        progress(f"Running the report {report_runs} times")
+        # Ends at midday so the monthly, daily and raw-reading paths all run
+        filters = frappe._dict(from_date=str(first_month), to_date=f"{last_day} 12:00:00")
+        results["results"]["report"] = measure(lambda: execute_report(filters), report_runs)
+
+        progress(f"Loading the consumption chart {report_runs} times")
+        results["results"]["timeseries"] = measure(
+            lambda: get_consumption_timeseries(names[0], str(first_month), f"{last_day} 23:59:59", resolution="1h"),
+            report_runs,
+        )
+
+        progress(f"Reading the cached customer summary {samples} times")
+        get_customer_summary(names[0])
+        results["results"]["summary_cache"] = measure(lambda: get_customer_summary(names[0]), samples)
+
+        progress(f"Simulating {len(DEFAULT_PANEL_SIZES) * len(DEFAULT_BATTERY_SIZES)} solar configurations")
+        results["results"]["solar_simulation"] = measure(lambda: simulate_solar(names[0]), report_runs)
+
+        progress("Rebuilding ROI Calculations")
+        summary = rebuild_roi_calculations(from_date=first_month, to_date=last_day, workers=workers)
+        results["results"]["rebuild"] = throughput(summary.readings, summary.seconds)
+    finally:
+        if not keep:
+            progress("Deleting the generated data")
+            delete_benchmark_data(names)
+
+    return results
+
+
+def make_customers(count):
+    """Creates (or reuses) the portal users and Customers the benchmark runs against."""
+    names = []
+    for index in range(count):
+        email = BENCHMARK_EMAIL.format(index)
+        if not frappe.db.exists("User", email):
+            frappe.get_doc({
+                "doctype": "User",
+                "email": email,
+                "first_name": "Benchmark",
+                "send_welcome_email": 0,
+                "roles": [{"role": "Customer"}],
+            }).insert(ignore_permissions=True)
+
+        name = frappe.db.get_value("Customer", {"email": email}, "name") or frappe.get_doc({
+            "doctype": "Customer",
+            "first_name": "Benchmark",
+            "last_name": f"Customer {index}",
+            "email": email,
+            "country": "Nigeria",
+            "phone_number": "+2348000000000",
+        }).insert(ignore_permissions=True).name
+        names.append(name)
+
+    frappe.db.commit()
+    return names
+
+
+def seed_readings(customers, months, start, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Inserts generated readings for each customer through the bulk import path and
+    refreshes the summaries of every touched month once.
+
+    Returns:
+        int: Number of inserted readings.
+    """
+    full_names = dict(frappe.db.sql(
+        "SELECT name, full_name FROM `tabCustomer` WHERE name IN %s", (tuple(customers),)
+    ))
+    touched_months, inserted = set(), 0
+
+    for index, customer in enumerate(customers):
+        dates, kw, kwh = generate_readings(months, start, base_kw=1 + index % 4 * 0.5, seed=seed + index)
+        dates = dates.astype(object)
+        for offset in range(0, len(dates), chunk_size):
+            readings = [
+                frappe._dict(
+                    customer=customer,
+                    customer_name=full_names.get(customer),
+                    date=date,
+                    kwh=float(kw_value),
+                    kwh__=float(kwh_value),
+                    meter_channel=DEFAULT_METER_CHANNEL,
+                    reading_key=make_reading_key(customer, date),
+                )
+                for date, kw_value, kwh_value in zip(
+                    dates[offset:offset + chunk_size], kw[offset:offset + chunk_size], kwh[offset:offset + chunk_size]
+                )
+            ]
+            insert_readings(readings)
+            frappe.db.commit()
+            inserted += len(readings)
+
+        touched_months.update((customer, date.year, date.month) for date in dates[::96])
+
+    refresh_consumption_summaries(touched_months)
+    frappe.db.commit()
+    return inserted
+
+
+def measure_submit_and_cancel(customer, samples):
+    """
+    Inserts and submits `samples` readings of the current month one at a time, each in its
+    own transaction, then cancels them again.
+
+    Returns:
+        tuple: Submit and cancel statistics, see `summarize`.
+    """
+    start = now_datetime().replace(second=0, microsecond=0)
+    docs, submit_times, submit_queries = [], [], []
+    for index in range(samples):
+        with count_queries() as counter:
+            started = time.perf_counter()
+            doc = frappe.get_doc({
+                "doctype": "Power Consumption",
+                "customer": customer,
+                "date": start - timedelta(minutes=index + 1),
+                "meter_channel": BENCHMARK_CHANNEL,
+                "kwh": 2.5,
+                "kwh__": 2.4,
+            }).insert(ignore_permissions=True)
+            doc.submit()
+            frappe.db.commit()
+            submit_times.append(time.perf_counter() - started)
+        submit_queries.append(counter.count)
+        docs.append(doc)
+
+    cancel_times, cancel_queries = [], []
+    for doc in docs:
+        with count_queries() as counter:
+            started = time.perf_counter()
+            doc.cancel()
+            frappe.db.commit()
+            cancel_times.append(time.perf_counter() - started)
+        cancel_queries.append(counter.count)
+
+    return summarize(submit_times, submit_queries), summarize(cancel_times, cancel_queries)
+
+
+def measure(function, runs):
+    """Calls `function` `runs` times and summarizes the latencies and query counts."""
+    times, queries = [], []
+    for _ in range(runs):
+        with count_queries() as counter:
+            started = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - started)
+        queries.append(counter.count)
+    return summarize(times, queries)
+
+
+def summarize(seconds, queries):
+    """Latency percentiles in milliseconds and the mean number of queries per operation."""
+    milliseconds = np.asarray(seconds) * 1000
+    if not len(milliseconds):
+        return {"count": 0}
+
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {
+        "count": len(milliseconds),
+        "mean_ms": round(float(milliseconds.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(milliseconds.max()), 3),
+        "queries": round(float(np.mean(queries)), 2),
+        "max_queries": int(max(queries)),
+    }
+
+
+def throughput(rows, seconds):
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds) if seconds else rows,
+    }
+
+
+def get_commit():
+    """The commit of the app's checkout, if it is a git repository."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=frappe.get_app_path("test_abraham", ".."),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    """
+    Compares two benchmark results.
+
+    Args:
+        baseline (dict): Results of an earlier run.
+        current (dict): Results of this run.
+        tolerance (float, optional): Relative change that is not reported.
+
+    Returns:
+        list: `{operation, metric, baseline, current, change}` for each metric that got worse
+        by more than the tolerance.
+    """
+    regressions = []
+    for operation, metrics in current["results"].items():
+        previous = baseline.get("results", {}).get(operation, {})
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            if not previous.get(metric) or metric not in metrics:
+                continue
+
+            change = (metrics[metric] - previous[metric]) / previous[metric]
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append({
+                    "operation": operation,
+                    "metric": metric,
+                    "baseline": previous[metric],
+                    "current": metrics[metric],
+                    "change": round(change, 3),
+                })
+    return regressions
+
+
+def write_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def delete_benchmark_data(customers):
+    """Deletes the generated customers with their users, readings, rollups, ROIs and blocks."""
+    if not customers:
+        return
+
+    customers = tuple(customers)
+    rois = frappe.db.sql_list("SELECT name FROM `tabROI Calculation` WHERE customer IN %s", (customers,))
+    if rois:
+        frappe.db.sql("DELETE FROM `tabROI Tariff Band` WHERE parent IN %s", (tuple(rois),))
+
+    blocks = frappe.db.sql("SELECT name, file_path FROM `tabConsumption Block` WHERE customer IN %s", (customers,))
+    for _, file_path in blocks:
+        delete_block_file(file_path)
+    if blocks:
+        frappe.db.sql(
+            "DELETE FROM `tabConsumption Block Day` WHERE parent IN %s", (tuple(name for name, _ in blocks),)
+        )
+
+    for doctype in ("Power Consumption", "ROI Calculation", "Consumption Block", *AGGREGATE_DOCTYPES.values()):
+        frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE customer IN %s", (customers,))
+
+    frappe.db.sql(
+        "DELETE FROM `tabSeries` WHERE name IN %s", (tuple(get_series_key(customer) for customer in customers),)
+    )
+    emails = frappe.db.sql_list("SELECT email FROM `tabCustomer` WHERE name IN %s", (customers,))
+    frappe.db.sql("DELETE FROM `tabCustomer` WHERE name IN %s", (customers,))
+    if emails:
+        frappe.db.sql("DELETE FROM `tabUser Permission` WHERE user IN %s", (tuple(emails),))
+    for email in emails:
+        frappe.delete_doc("User", email, force=True, ignore_permissions=True)
+    frappe.db.commit()
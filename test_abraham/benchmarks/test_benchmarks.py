@@ -0,0 +1,30 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.benchmarks.meter_data import generate_readings
+from test_abraham.benchmarks.suite import compare_results
+
+
+class TestBenchmarks(FrappeTestCase):
+
+    def test_meter_data(self):
+        """Generated meter data has a KW reading every 15 minutes and the hour's KWH on the full hour"""
+        dates, kw, kwh = generate_readings(1, "2024-02-01", seed=1)
+        self.assertEqual(len(dates), 29 * 96)
+        self.assertEqual(str(dates[0]), "2024-02-01T00:00:00")
+        self.assertEqual(str(dates[-1]), "2024-02-29T23:45:00")
+        self.assertTrue((kw > 0).all())
+        self.assertTrue((kwh[1::4] == 0).all())
+        self.assertAlmostEqual(kwh[:4].sum(), kw[:4].mean(), places=3)
+        self.assertTrue((generate_readings(1, "2024-02-01", seed=1)[1] == kw).all())
+
+    def test_compare_results(self):
+        """Only metrics that got worse beyond the tolerance are reported as regressions"""
+        baseline = {"results": {"submit": {"p95_ms": 10, "queries": 20}, "rebuild": {"rows_per_second": 1000}}}
+        current = {"results": {"submit": {"p95_ms": 10.5, "queries": 25}, "rebuild": {"rows_per_second": 800}}}
+        self.assertEqual(
+            [(r["operation"], r["metric"]) for r in compare_results(baseline, current)],
+            [("submit", "queries"), ("rebuild", "rows_per_second")],
+        )
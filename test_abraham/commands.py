@@ -0,0 +1,176 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("import-power-consumption")
+@click.argument("file_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--customer", help="Customer for files without a customer column")
+@click.option("--chunk-size", default=1000, type=int, help="Rows validated and inserted per batch")
+@pass_context
+def import_power_consumption(context, file_path, customer=None, chunk_size=1000):
+	"""Stream a CSV/XLSX meter export into Power Consumption."""
+	import frappe
+
+	from test_abraham.utils.bulk_import import import_power_consumption_file
+
+	def progress(summary):
+		click.echo(f"Processed {summary.processed} rows, inserted {summary.inserted}, skipped {summary.skipped}")
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		summary = import_power_consumption_file(file_path, customer=customer, chunk_size=chunk_size, progress=progress)
+	finally:
+		frappe.destroy()
+
+	for error in summary.errors:
+		click.secho(f"Row {error['row']}: {error['message']}", fg="yellow")
+	click.secho(f"Imported {summary.inserted} of {summary.processed} rows", fg="green")
+
+
+@click.command("export-power-consumption")
+@click.argument("file_path", type=click.Path(dir_okay=False))
+@click.option("--customer", help="Only export this customer")
+@click.option("--from", "from_date", help="First reading time to export (YYYY-MM-DD HH:MM:SS)")
+@click.option("--to", "to_date", help="Last reading time to export (YYYY-MM-DD HH:MM:SS)")
+@click.option("--format", "file_format", default="csv", type=click.Choice(["csv", "parquet"]), help="File format")
+@pass_context
+def export_power_consumption(context, file_path, customer=None, from_date=None, to_date=None, file_format="csv"):
+	"""Stream submitted readings, packed months included, into a CSV or Parquet file ordered by customer and date."""
+	import frappe
+
+	from test_abraham.utils.consumption_export import export_readings, get_export_customers
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		exported = export_readings(
+			file_path, get_export_customers(customer), file_format=file_format, from_date=from_date, to_date=to_date
+		)
+	finally:
+		frappe.destroy()
+
+	click.secho(f"Exported {exported} readings to {file_path}", fg="green")
+
+
+@click.command("backfill-consumption-rollups")
+@click.option("--customer", help="Only rebuild this customer")
+@click.option("--from", "from_date", help="First month to rebuild (YYYY-MM-DD)")
+@click.option("--to", "to_date", help="Last month to rebuild (YYYY-MM-DD)")
+@pass_context
+def backfill_consumption_rollups(context, customer=None, from_date=None, to_date=None):
+	"""Rebuild the daily and monthly consumption rollups from submitted Power Consumption records."""
+	import frappe
+
+	from test_abraham.utils.consumption_aggregates import backfill_aggregates
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		rebuilt = backfill_aggregates(customer=customer, from_date=from_date, to_date=to_date)
+	finally:
+		frappe.destroy()
+
+	click.secho(f"Rebuilt rollups for {rebuilt} customer-months", fg="green")
+
+
+@click.command("rebuild-roi-calculations")
+@click.option("--customer", help="Only rebuild this customer")
+@click.option("--from", "from_date", help="First month to rebuild (YYYY-MM-DD)")
+@click.option("--to", "to_date", help="Last month to rebuild (YYYY-MM-DD)")
+@click.option("--workers", type=int, help="Worker processes, defaults to the number of CPUs")
+@click.option("--dry-run", is_flag=True, default=False, help="Only report what would change")
+@pass_context
+def rebuild_roi_calculations(context, customer=None, from_date=None, to_date=None, workers=None, dry_run=False):
+	"""Rebuild rollups, ROI Calculations and customer averages from submitted Power Consumption records."""
+	import frappe
+
+	from test_abraham.utils.full_rebuild import rebuild_roi_calculations as rebuild
+
+	def progress(summary):
+		click.echo(f"Processed {summary.customers} customers, {summary.months} months, {summary.readings} readings")
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		summary = rebuild(
+			customer=customer, from_date=from_date, to_date=to_date, workers=workers, dry_run=dry_run,
+			progress=progress,
+		)
+	finally:
+		frappe.destroy()
+
+	for difference in summary.differences:
+		changes = ", ".join(f"{field}: {old} -> {new}" for field, (old, new) in difference["changes"].items())
+		click.echo(
+			f"{difference['action']} {difference['customer']} {difference['year']}-{difference['month']:02d}"
+			+ (f" ({changes})" if changes else "")
+		)
+
+	verb = "Would change" if dry_run else "Changed"
+	click.secho(
+		f"{verb} {summary.created} created, {summary.updated} updated, {summary.removed} removed ROI Calculations, "
+		f"{summary.reclassified} reading tariffs and {summary.averages_updated} customer averages",
+		fg="green",
+	)
+	click.secho(f"Read {summary.readings} readings in {summary.seconds}s ({summary.rows_per_second} rows/s)")
+
+
+@click.command("run-benchmarks")
+@click.option("--customers", default=5, type=int, help="Generated customers")
+@click.option("--months", default=3, type=int, help="Months of 15-minute readings per customer")
+@click.option("--samples", default=100, type=int, help="Readings submitted and cancelled one by one")
+@click.option("--report-runs", default=5, type=int, help="Executions of the Customer Average Consumption Report")
+@click.option("--workers", type=int, help="Worker processes of the rebuild, defaults to the number of CPUs")
+@click.option("--seed", default=0, type=int, help="Seed of the generated meter data")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the results as JSON to this file")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="Results of an earlier run to compare with")
+@click.option("--tolerance", default=0.1, type=float, help="Relative slowdown reported as a regression")
+@click.option("--keep", is_flag=True, default=False, help="Keep the generated data")
+@pass_context
+def run_benchmarks(context, customers=5, months=3, samples=100, report_runs=5, workers=None, seed=0, output=None,
+		baseline=None, tolerance=0.1, keep=False):
+	"""Benchmark submit, cancel, the report and the full rebuild against synthetic meter data."""
+	import json
+	import sys
+
+	import frappe
+
+	from test_abraham.benchmarks.suite import compare_results, read_results, run_benchmarks as run, write_results
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		results = run(
+			customers=customers, months=months, samples=samples, report_runs=report_runs, workers=workers,
+			seed=seed, keep=keep, progress=click.echo,
+		)
+	finally:
+		frappe.destroy()
+
+	if output:
+		write_results(results, output)
+		click.secho(f"Wrote results to {output}", fg="green")
+	else:
+		click.echo(json.dumps(results, indent=1, sort_keys=True))
+
+	if baseline:
+		regressions = compare_results(read_results(baseline), results, tolerance)
+		for regression in regressions:
+			click.secho(
+				f"{regression['operation']} {regression['metric']}: {regression['baseline']} -> "
+				f"{regression['current']} ({regression['change']:+.0%})",
+				fg="red",
+			)
+		if regressions:
+			sys.exit(1)
+		click.secho("No regressions against the baseline", fg="green")
+
+
+commands = [
+	import_power_consumption,
+	export_power_consumption,
+	backfill_consumption_rollups,
+	rebuild_roi_calculations,
+	run_benchmarks,
+]
@@ -117,9 +117,16 @@ app_license = "mit"
 # -----------
 # Permissions evaluated in scripted ways
 
-# permission_query_conditions = {
-# 	"Event": "frappe.desk.doctype.event.event.get_permission_query_conditions",
-# }
+permission_query_conditions = {
+	"Customer": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+	"Power Consumption": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+	"ROI Calculation": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+	"Daily Consumption Aggregate": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+	"Monthly Consumption Aggregate": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+	"Consumption Block": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+	"Consumption Quality Summary": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+	"Meter Reading Batch": "test_abraham.utils.helper_functions.get_customer_permission_query_conditions",
+}
 #
 # has_permission = {
 # 	"Event": "frappe.desk.doctype.event.event.has_permission",
@@ -137,13 +144,16 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+	"User": {
+		"on_update": "test_abraham.solar_cell_company.doctype.customer.customer.update_customer_role_cache",
+		"on_trash": "test_abraham.solar_cell_company.doctype.customer.customer.update_customer_role_cache"
+	},
+	"Has Role": {
+		"on_update": "test_abraham.solar_cell_company.doctype.customer.customer.clear_customer_role_cache",
+		"on_trash": "test_abraham.solar_cell_company.doctype.customer.customer.clear_customer_role_cache"
+	}
+}
 
 # Scheduled Tasks
 # ---------------
@@ -166,6 +176,22 @@ app_license = "mit"
 # 	],
 # }
 
+scheduler_events = {
+	"all": [
+		"test_abraham.utils.recalculation.process_dirty_months"
+	],
+	"hourly": [
+		"test_abraham.utils.instrumentation.flush_metrics"
+	],
+	"daily_long": [
+		"test_abraham.utils.consumption_blocks.pack_closed_months",
+		"test_abraham.utils.recalculation.reconcile_all_customer_totals"
+	],
+	"weekly_long": [
+		"test_abraham.utils.data_quality.scan_all_customers"
+	],
+}
+
 # Testing
 # -------
 
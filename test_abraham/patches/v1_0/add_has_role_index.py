@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+    """Lets the Customer user link query find the users of a role without scanning `tabHas Role`."""
+    frappe.db.add_index("Has Role", ["role", "parent"])
@@ -0,0 +1,6 @@
+from test_abraham.utils.consumption_aggregates import rebuild_all_aggregates
+
+
+def execute():
+    """Builds the daily rollups and the monthly minimum/maximum columns from the submitted records."""
+    rebuild_all_aggregates()
@@ -0,0 +1,34 @@
+import frappe
+
+
+def execute():
+    """
+    Seeds the Monthly Consumption Aggregate store from existing submitted records.
+
+    Older records were submitted before the tariff was persisted, so it is
+    assigned first using the original LOW (23:00-05:59) / HIGH rule.
+    """
+    frappe.db.sql(
+        """
+        UPDATE `tabPower Consumption`
+        SET tarriff = CASE WHEN HOUR(date) >= 23 OR HOUR(date) < 6 THEN 'Low' ELSE 'High' END
+        WHERE IFNULL(tarriff, '') = '' AND date IS NOT NULL
+        """
+    )
+
+    frappe.db.sql("DELETE FROM `tabMonthly Consumption Aggregate`")
+    frappe.db.sql(
+        """
+        INSERT INTO `tabMonthly Consumption Aggregate`
+            (name, customer, period, tariff, reading_count, kw_sum, kwh_sum,
+            creation, modified, owner, modified_by, docstatus)
+        SELECT
+            CONCAT(customer, '-', DATE_FORMAT(date, '%%Y-%%m'), '-', IFNULL(tarriff, '')),
+            customer, DATE_FORMAT(date, '%%Y-%%m-01'), IFNULL(tarriff, ''), COUNT(*), SUM(kwh), SUM(kwh__),
+            NOW(6), NOW(6), 'Administrator', 'Administrator', 0
+        FROM `tabPower Consumption`
+        WHERE docstatus = 1 AND date IS NOT NULL
+        GROUP BY customer, DATE_FORMAT(date, '%%Y-%%m'), IFNULL(tarriff, '')
+        """,
+        (),
+    )
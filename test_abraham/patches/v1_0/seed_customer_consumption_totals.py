@@ -0,0 +1,6 @@
+from test_abraham.utils.recalculation import reconcile_all_customer_totals
+
+
+def execute():
+    """Fills the new running totals of every Customer from its submitted Power Consumption records."""
+    reconcile_all_customer_totals(log_mismatches=False)
@@ -0,0 +1,22 @@
+import frappe
+
+
+def execute():
+    """
+    Seeds the per-customer naming series used by Power Consumption and ROI Calculation
+    with the highest instance count already in use, so new names never collide with
+    names generated by the previous count-based autoname.
+    """
+    for doctype in ("Power Consumption", "ROI Calculation"):
+        frappe.db.sql(
+            f"""
+            INSERT INTO `tabSeries` (`name`, `current`)
+            SELECT
+                CONCAT(%(doctype)s, '::', customer),
+                GREATEST(COUNT(*), MAX(CAST(SUBSTRING_INDEX(name, '-', -1) AS UNSIGNED)))
+            FROM `tab{doctype}`
+            GROUP BY customer
+            ON DUPLICATE KEY UPDATE `current` = GREATEST(`current`, VALUES(`current`))
+            """,
+            {"doctype": doctype},
+        )
@@ -0,0 +1,29 @@
+import frappe
+
+from test_abraham.utils.consumption_blocks import get_month_demand, read_block_file, summarize_days
+
+
+def execute():
+    """
+    Stores the per-day and tariff totals and the demand figures of the Consumption Blocks
+    packed before they were kept on the block, reading each block file once.
+    """
+    blocks = frappe.db.sql(
+        """
+        SELECT block.name, block.file_path
+        FROM `tabConsumption Block` block
+        WHERE IFNULL(block.file_path, '') != '' AND NOT EXISTS (
+            SELECT 1 FROM `tabConsumption Block Day` day
+            WHERE day.parent = block.name AND day.parenttype = 'Consumption Block'
+        )
+        """,
+        as_dict=True,
+    )
+
+    for block in blocks:
+        data = read_block_file(block.file_path)
+        doc = frappe.get_doc("Consumption Block", block.name)
+        doc.update(get_month_demand(data))
+        doc.set("days", summarize_days(data))
+        doc.save(ignore_permissions=True)
+        frappe.db.commit()
@@ -0,0 +1,21 @@
+import frappe
+
+
+def execute():
+    """
+    Fills `reading_key` for existing records with the MD5 computed by `make_reading_key`.
+
+    Submitted records claim their key first, then drafts. `UPDATE IGNORE` leaves the key
+    empty on legacy duplicates instead of failing on the unique index.
+    """
+    frappe.db.sql("UPDATE `tabPower Consumption` SET meter_channel = 'main' WHERE IFNULL(meter_channel, '') = ''")
+
+    for docstatus in (1, 0):
+        frappe.db.sql(
+            """
+            UPDATE IGNORE `tabPower Consumption`
+            SET reading_key = MD5(CONCAT(customer, '|', DATE_FORMAT(date, '%%Y-%%m-%%d %%H:%%i:%%s'), '|', meter_channel))
+            WHERE docstatus = %s AND reading_key IS NULL AND date IS NOT NULL
+            """,
+            (docstatus,),
+        )
@@ -0,0 +1,22 @@
+import frappe
+
+from test_abraham.base.constants import month_dict
+
+
+def execute():
+    """
+    Fills `roi_key` (`customer|year|month number`) for existing ROI Calculations.
+
+    Submitted calculations claim their key first, then drafts. `UPDATE IGNORE` leaves the
+    key empty on legacy duplicates instead of failing on the unique index.
+    """
+    months = [month_dict[str(number)] for number in range(1, 13)]
+    for docstatus in (1, 0):
+        frappe.db.sql(
+            f"""
+            UPDATE IGNORE `tabROI Calculation`
+            SET roi_key = CONCAT(customer, '|', year, '|', FIELD(month, {", ".join(["%s"] * len(months))}))
+            WHERE docstatus = %s AND roi_key IS NULL AND FIELD(month, {", ".join(["%s"] * len(months))}) > 0
+            """,
+            (*months, docstatus, *months),
+        )
@@ -0,0 +1,24 @@
+import frappe
+
+from test_abraham.solar_cell_company.doctype.roi_calculation.roi_calculation import MONTH_NUMBERS
+from test_abraham.utils.consumption_series import ConsumptionSeries
+
+
+def execute():
+    """
+    Fills peak KW, peak time, load factor and 95th percentile KW of the submitted ROI
+    Calculations. Each customer's readings are loaded once and all its months are
+    evaluated in one pass.
+    """
+    rois = {}
+    for name, customer, month, year in frappe.db.sql(
+        "SELECT name, customer, month, year FROM `tabROI Calculation` WHERE docstatus = 1"
+    ):
+        rois.setdefault(customer, {})[(year, MONTH_NUMBERS.get(month))] = name
+
+    for customer, names in rois.items():
+        demand = ConsumptionSeries.load(customer).month_demand()
+        for key, name in names.items():
+            if key in demand:
+                frappe.db.set_value("ROI Calculation", name, demand[key], update_modified=False)
+        frappe.db.commit()
@@ -0,0 +1,27 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from test_abraham.utils.consumption_blocks import delete_block_file, get_block_name
+
+
+class ConsumptionBlock(Document):
+	"""
+	Index row of a customer-month of readings packed into a compressed NPZ file under the
+	site's private files, with the month's demand figures and daily totals. The readings
+	themselves are read with `test_abraham.utils.consumption_blocks.read_block`; months
+	packed with *Keep Summaries Only* have no file.
+	"""
+
+	def autoname(self):
+		"""Names the block `customer-YYYY-MM`, one block per customer-month."""
+		self.name = get_block_name(self.customer, self.period)
+
+	def on_trash(self):
+		delete_block_file(self.file_path)
+
+
+def on_doctype_update():
+	frappe.db.add_index("Consumption Block", ["customer", "period"])
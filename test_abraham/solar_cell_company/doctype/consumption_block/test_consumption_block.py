@@ -0,0 +1,100 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+	make_power_consumption,
+	make_test_customer,
+)
+from test_abraham.solar_cell_company.doctype.roi_calculation.roi_calculation import get_demand_values
+from test_abraham.solar_cell_company.report.customer_average_consumption_report.customer_average_consumption_report import (
+	execute,
+)
+from test_abraham.utils.consumption_aggregates import get_month_totals, get_range_totals, rebuild_month
+from test_abraham.utils.consumption_blocks import pack_month, read_block, read_readings
+from test_abraham.utils.consumption_timeseries import get_consumption_timeseries
+from test_abraham.utils.full_rebuild import rebuild_roi_calculations
+
+
+class TestConsumptionBlock(FrappeTestCase):
+
+	def setUp(self):
+		self.customer = make_test_customer()
+		self.readings = [
+			("2024-05-01 08:00:00", 1, 4),
+			("2024-05-02 09:00:00", 2, 8),
+			("2024-05-02 23:30:00", 4, 16),
+		]
+		for date, kw, kwh in self.readings:
+			make_power_consumption(self.customer, date, kw, kwh)
+		make_power_consumption(self.customer, "2024-06-03 10:00:00", 3, 12)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_pack_month(self):
+		"""Packing moves a month's readings into a block without changing any totals"""
+		totals = get_month_totals(self.customer, 2024, 5)
+		pack_month(self.customer, 2024, 5)
+
+		self.assertFalse(frappe.db.exists(
+			"Power Consumption", {"customer": self.customer, "date": ("between", ["2024-05-01", "2024-05-31 23:59:59"])}
+		))
+		block = read_block(self.customer, 2024, 5)
+		self.assertEqual(block.kw.tolist(), [1, 2, 4])
+		self.assertEqual(block.tariff.tolist(), ["High", "High", "Low"])
+
+		rebuild_month(self.customer, 2024, 5)
+		self.assertEqual(get_month_totals(self.customer, 2024, 5), totals)
+
+		edge = get_range_totals("2024-05-02 12:00:00", "2024-06-03 10:00:00", self.customer)[self.customer]
+		self.assertEqual((edge.reading_count, edge.kw_sum), (2, 7))
+
+		readings = read_readings(self.customer, "2024-05-02 00:00:00")
+		self.assertEqual(readings.kwh.tolist(), [8, 16, 12])
+
+	def test_packed_month_is_read_only(self):
+		"""New readings can not be added to a packed month"""
+		pack_month(self.customer, 2024, 5)
+		self.assertRaises(
+			frappe.ValidationError, make_power_consumption, self.customer, "2024-05-20 10:00:00", 1, 4
+		)
+
+	def test_pack_month_summaries_only(self):
+		"""A month packed without a file is rebuilt from its summaries with the same totals and demand"""
+		totals = get_month_totals(self.customer, 2024, 5)
+		name = pack_month(self.customer, 2024, 5, keep_file=False)
+
+		self.assertFalse(frappe.db.get_value("Consumption Block", name, "file_path"))
+		self.assertIsNone(read_block(self.customer, 2024, 5))
+		self.assertEqual(frappe.db.count("Consumption Block Day", {"parent": name}), 3)
+
+		rebuild_month(self.customer, 2024, 5)
+		self.assertEqual(get_month_totals(self.customer, 2024, 5), totals)
+		demand = get_demand_values(self.customer, 2024, 5)
+		self.assertEqual(demand.peak_kw, 4)
+		self.assertEqual(str(demand.peak_time), "2024-05-02 23:30:00")
+		self.assertAlmostEqual(demand.p95_kw, 3.8)
+
+		whole_days = get_range_totals("2024-05-02 00:00:00", "2024-06-03 10:00:00", self.customer)[self.customer]
+		self.assertEqual((whole_days.reading_count, whole_days.kw_sum), (3, 9))
+		summary = rebuild_roi_calculations(customer=self.customer, workers=1, dry_run=True)
+		self.assertEqual((summary.created, summary.updated, summary.removed), (0, 0, 0))
+
+	def test_partial_days_of_summaries_only_month(self):
+		"""Partial days of a month archived without its readings are counted whole and flagged"""
+		pack_month(self.customer, 2024, 5, keep_file=False)
+		filters = frappe._dict(from_date="2024-05-02 12:00:00", to_date="2024-05-02 20:00:00")
+
+		_, data, message = execute(filters)
+		row = next(row for row in data if row["customer"] == self.customer)
+		self.assertEqual((row["average_kw"], row["average_kwh"]), (3, 12))
+		self.assertIn(self.customer, message)
+
+		self.assertRaises(
+			frappe.ValidationError, get_consumption_timeseries, self.customer, **filters, resolution="1h"
+		)
+		chart = get_consumption_timeseries(self.customer, **filters)
+		self.assertEqual((chart["resolution"], chart["widened"], chart["reading_count"]), ("1d", 1, [2]))
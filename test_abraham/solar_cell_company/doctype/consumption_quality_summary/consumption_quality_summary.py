@@ -0,0 +1,22 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from test_abraham.utils.data_quality import get_summary_name
+
+
+class ConsumptionQualitySummary(Document):
+	"""
+	Data quality of a customer-month of readings on one meter channel, written by the
+	scanner in `test_abraham.utils.data_quality`. Rescanning a customer replaces its summaries.
+	"""
+
+	def autoname(self):
+		"""Names the summary `customer-YYYY-MM-channel`, one summary per customer-month and channel."""
+		self.name = get_summary_name(self.customer, self.period, self.meter_channel)
+
+
+def on_doctype_update():
+	frappe.db.add_index("Consumption Quality Summary", ["customer", "period"])
@@ -0,0 +1,86 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import frappe
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import make_test_customer
+from test_abraham.utils.consumption_series import ConsumptionSeries
+from test_abraham.utils.data_quality import interpolate_missing, scan_customer, scan_series
+
+
+def make_reading(customer, date, kw, kwh, meter_channel=None):
+	return frappe.get_doc({
+		"doctype": "Power Consumption",
+		"customer": customer,
+		"date": date,
+		"kwh": kw,
+		"kwh__": kwh,
+		"meter_channel": meter_channel,
+	}).insert(ignore_permissions=True).submit()
+
+
+class TestConsumptionQualitySummary(FrappeTestCase):
+
+	def setUp(self):
+		self.customer = make_test_customer()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_scan_series(self):
+		"""Gaps, skipped and repeated hours, duplicates and bad values are counted per month"""
+		# 2024-03-31 is the spring DST shift in Europe/Berlin
+		dates = np.arange(
+			np.datetime64("2024-03-31T00:00:00"), np.datetime64("2024-04-01T00:00:00"), np.timedelta64(15, "m")
+		)
+		kw = np.full(len(dates), 2.0)
+		kwh = np.where(np.arange(len(dates)) % 4 == 0, 2.0, 0.0)
+		keep = np.ones(len(dates), bool)
+		keep[10:14] = False  # 02:30 - 03:15, a skipped hour
+		keep[40:42] = False
+		kw[60], kw[70], kwh[80] = 40, -5, 9
+		repeated = slice(20, 24)  # 05:00 - 05:45 recorded twice
+
+		series = ConsumptionSeries.from_columns(
+			np.r_[dates[keep], dates[repeated]], np.r_[kw[keep], kw[repeated]], np.r_[kwh[keep], kwh[repeated]],
+			["High"] * (keep.sum() + 4),
+		)
+		summary = scan_series(series, "Europe/Berlin")[(2024, 3)]
+		self.assertEqual(summary.expected_slots, 96)
+		self.assertEqual(summary.missing_slots, 6)
+		self.assertEqual(summary.longest_gap, 4)
+		self.assertEqual(summary.duplicate_timestamps, 4)
+		self.assertEqual(summary.dst_suspects, 2)
+		self.assertEqual(summary.negative_readings, 1)
+		self.assertEqual(summary.inconsistent_kwh, 1)
+		self.assertEqual(summary.outliers, 2)
+
+		# Without a DST shift on that date the missing and doubled hours are plain gaps and duplicates
+		self.assertEqual(scan_series(series, "Asia/Kolkata")[(2024, 3)].dst_suspects, 0)
+
+		fill = interpolate_missing(series)
+		self.assertEqual([str(date) for date in fill.dates[:4]], [
+			"2024-03-31T02:30:00", "2024-03-31T02:45:00", "2024-03-31T03:00:00", "2024-03-31T03:15:00",
+		])
+		self.assertEqual(fill.kwh[2], 2)
+
+	def test_scan_customer(self):
+		"""Scanning writes one summary per customer-month and meter channel from the submitted readings"""
+		make_reading(self.customer, "2024-09-01 00:00:00", 1, 1)
+		make_reading(self.customer, "2024-09-01 00:15:00", 1, 0)
+		make_reading(self.customer, "2024-09-01 00:15:00", 1, 0, meter_channel="export")
+		make_reading(self.customer, "2024-09-01 01:00:00", 1, 1)
+
+		scan_customer(self.customer)
+		summary = frappe.get_doc("Consumption Quality Summary", f"{self.customer}-2024-09-main")
+		self.assertEqual(summary.meter_channel, "main")
+		self.assertEqual(summary.reading_count, 3)
+		self.assertEqual(summary.expected_slots, 5)
+		self.assertEqual(summary.missing_slots, 2)
+		self.assertEqual(summary.duplicate_timestamps, 0)
+
+		summary = frappe.get_doc("Consumption Quality Summary", f"{self.customer}-2024-09-export")
+		self.assertEqual(summary.reading_count, 1)
+		self.assertEqual(summary.expected_slots, 1)
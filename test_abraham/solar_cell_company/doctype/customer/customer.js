@@ -25,7 +25,7 @@ frappe.ui.form.on("Customer", {
         validate_user(frm); // Revalidate the user when email is changed
     },
     setup: function(frm) {
-        frm.set_query("user", function() {
+        frm.set_query("email", function() {
             return {
                 query: "test_abraham.solar_cell_company.doctype.customer.customer.get_customer_users"
             };
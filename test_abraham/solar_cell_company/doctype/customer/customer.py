@@ -3,6 +3,14 @@
 
 import frappe
 from frappe.model.document import Document
+from frappe.utils import flt
+
+from test_abraham.utils.summary_cache import invalidate_summaries
+
+# Redis hash of portal user -> linked Customer ("" for users without one)
+CUSTOMER_BY_USER_KEY = "test_abraham:customer_by_user"
+# Redis set of the users holding the 'Customer' role
+CUSTOMER_USERS_KEY = "test_abraham:customer_role_users"
 
 
 class Customer(Document):
@@ -10,6 +18,14 @@ class Customer(Document):
 	def after_insert(self):
 		self.create_user_permission()
 
+	def on_update(self):
+		clear_customer_scope_cache()
+		invalidate_summaries(self.name)
+
+	def on_trash(self):
+		clear_customer_scope_cache()
+		invalidate_summaries(self.name)
+
 
 	def create_user_permission(self):
 		frappe.get_doc(**dict(
@@ -22,18 +38,227 @@ class Customer(Document):
 		).insert()
 
 
+def get_user_customer(user):
+	"""
+	Returns the Customer linked to a user through its `email`, or "" if there is none.
+	The mapping is cached in a Redis hash, so scoping a request normally costs no query.
+	"""
+	return frappe.cache.hget(
+		CUSTOMER_BY_USER_KEY,
+		user,
+		generator=lambda: frappe.db.get_value("Customer", {"email": user}, "name") or "",
+	)
+
+
+def clear_customer_scope_cache():
+	"""Drops the cached user -> Customer mapping after a Customer is created, changed or deleted."""
+	frappe.cache.delete_value(CUSTOMER_BY_USER_KEY)
+
+
 @frappe.whitelist()
 def check_user_role(email):
 	"""Check if a user has the 'Customer' role."""
-	return dict(dict(exists=bool(frappe.db.exists("Has Role", {"parent": email, "role": "Customer", "parenttype": "User"}))))
+	return dict(exists=is_customer_user(email))
+
+
+@frappe.whitelist()
+def check_user_roles(emails):
+	"""
+	Checks several users for the 'Customer' role at once.
+
+	Args:
+		emails (list or str): User emails, as a list or a JSON array.
+
+	Returns:
+		dict: email -> True if the user has the 'Customer' role.
+	"""
+	emails = frappe.parse_json(emails) if isinstance(emails, str) else emails
+	ensure_customer_users_cached()
+
+	pipeline = frappe.cache.pipeline()
+	for email in emails:
+		pipeline.sismember(frappe.cache.make_key(CUSTOMER_USERS_KEY), email)
+	return dict(zip(emails, (bool(member) for member in pipeline.execute())))
 
 
 @frappe.whitelist()
-def get_customer_users():
-    """Fetch users who have the 'Customer' role."""
-    return frappe.db.sql("""
-        SELECT DISTINCT parent AS name 
-        FROM `tabHas Role` 
-        WHERE role = 'Customer' 
-        AND parenttype = 'User'
-    """, as_dict=True)
\ No newline at end of file
+@frappe.validate_and_sanitize_search_inputs
+def get_customer_users(doctype=None, txt="", searchfield=None, start=0, page_len=20, filters=None):
+	"""
+	Link query listing the enabled users who have the 'Customer' role, one page at a time,
+	matching `txt` against the email and full name.
+	"""
+	return frappe.db.sql(
+		"""
+		SELECT u.name, u.full_name
+		FROM `tabHas Role` hr
+		JOIN `tabUser` u ON u.name = hr.parent
+		WHERE hr.role = 'Customer' AND hr.parenttype = 'User' AND u.enabled = 1
+		AND (u.name LIKE %(txt)s OR u.full_name LIKE %(txt)s)
+		ORDER BY u.name
+		LIMIT %(page_len)s OFFSET %(start)s
+		""",
+		{"txt": f"%{txt or ''}%", "start": int(start or 0), "page_len": int(page_len or 20)},
+	)
+
+
+def is_customer_user(email):
+	"""Checks the cached 'Customer' role membership, without querying `tabHas Role`."""
+	ensure_customer_users_cached()
+	return bool(frappe.cache.sismember(CUSTOMER_USERS_KEY, email))
+
+
+def ensure_customer_users_cached():
+	"""
+	Loads every user with the 'Customer' role into a Redis set when it is missing. The set
+	always holds an empty marker member, so it exists even when there are no such users.
+	"""
+	if frappe.cache.exists(CUSTOMER_USERS_KEY):
+		return
+
+	users = frappe.db.sql_list(
+		"SELECT DISTINCT parent FROM `tabHas Role` WHERE role = 'Customer' AND parenttype = 'User'"
+	)
+	frappe.cache.sadd(CUSTOMER_USERS_KEY, "", *users)
+
+
+def update_customer_role_cache(doc, method=None):
+	"""
+	`User` doc event keeping the cached 'Customer' role membership in step with the roles
+	saved with the user.
+	"""
+	if not frappe.cache.exists(CUSTOMER_USERS_KEY):
+		return
+
+	if method != "on_trash" and any(row.role == "Customer" for row in doc.get("roles", [])):
+		frappe.cache.sadd(CUSTOMER_USERS_KEY, doc.name)
+	else:
+		frappe.cache.srem(CUSTOMER_USERS_KEY, doc.name)
+
+
+def clear_customer_role_cache(doc, method=None):
+	"""`Has Role` doc event dropping the cached membership when a 'Customer' row is written on its own."""
+	if doc.role == "Customer":
+		frappe.cache.delete_value(CUSTOMER_USERS_KEY)
+
+
+def apply_customer_reading(customer, kw, kwh, sign=1):
+	"""
+	Adds (sign=1) or removes (sign=-1) one reading from the customer's running totals and
+	re-derives `average_kw` and `average_kwh` from them.
+	"""
+	apply_customer_totals(customer, sign, sign * (kw or 0), sign * (kwh or 0))
+
+
+def apply_customer_totals(customer, reading_count, kw_sum, kwh_sum):
+	"""
+	Adds a change of reading count and sums, e.g. one month's aggregate before and after a
+	rebuild, to the customer's running totals and re-derives `average_kw` and `average_kwh`
+	from them, in a single atomic statement. Assignments run left to right, so the averages
+	see the updated totals.
+	"""
+	frappe.db.sql(
+		"""
+		UPDATE `tabCustomer`
+		SET
+			reading_count = IFNULL(reading_count, 0) + %(reading_count)s,
+			kw_sum = IFNULL(kw_sum, 0) + %(kw)s,
+			kwh_sum = IFNULL(kwh_sum, 0) + %(kwh)s,
+			average_kw = IF(reading_count > 0, kw_sum / reading_count, 0),
+			average_kwh = IF(reading_count > 0, kwh_sum / reading_count, 0)
+		WHERE name = %(customer)s
+		""",
+		{"customer": customer, "reading_count": reading_count, "kw": kw_sum or 0, "kwh": kwh_sum or 0},
+	)
+	invalidate_summaries(customer)
+
+
+def get_customer_totals(customers):
+	"""
+	Counts and sums the submitted readings of several customers, including those packed
+	into Consumption Blocks, with one grouped query.
+
+	Returns:
+		dict: customer -> `frappe._dict` of `reading_count`, `kw_sum` and `kwh_sum`.
+	"""
+	totals = {customer: frappe._dict(reading_count=0, kw_sum=0.0, kwh_sum=0.0) for customer in customers}
+	if not customers:
+		return totals
+
+	for row in frappe.db.sql(
+		"""
+		SELECT customer, SUM(reading_count) AS reading_count, SUM(kw_sum) AS kw_sum, SUM(kwh_sum) AS kwh_sum
+		FROM (
+			SELECT customer, COUNT(*) AS reading_count, SUM(kwh) AS kw_sum, SUM(kwh__) AS kwh_sum
+			FROM `tabPower Consumption`
+			WHERE docstatus = 1 AND customer IN %(customers)s
+			GROUP BY customer
+			UNION ALL
+			SELECT customer, SUM(reading_count), SUM(kw_sum), SUM(kwh_sum)
+			FROM `tabConsumption Block`
+			WHERE customer IN %(customers)s
+			GROUP BY customer
+		) readings
+		GROUP BY customer
+		""",
+		{"customers": tuple(customers)},
+		as_dict=True,
+	):
+		totals[row.customer] = frappe._dict(
+			reading_count=int(row.reading_count or 0), kw_sum=row.kw_sum or 0.0, kwh_sum=row.kwh_sum or 0.0
+		)
+
+	return totals
+
+
+def reconcile_customer_totals(customers, repair=True):
+	"""
+	Compares the running totals and averages stored on customers with their submitted
+	readings and, unless `repair` is False, overwrites the ones that drifted.
+
+	When repairing, the customer rows are locked before the readings are counted, so a
+	submit that moves the totals meanwhile waits for the repair instead of being lost;
+	callers start a fresh transaction so the count sees every committed reading.
+	Customers with months still queued for the recalculation job are skipped: the job
+	moves their totals by those months' readings, which a repair would count twice.
+
+	Returns:
+		list: `{customer, stored, expected}` for each customer whose values differed.
+	"""
+	from test_abraham.utils.recalculation import get_dirty_customers
+
+	stored_totals = frappe.db.sql(
+		f"""
+		SELECT name, reading_count, kw_sum, kwh_sum, average_kw, average_kwh
+		FROM `tabCustomer`
+		WHERE name IN %(customers)s
+		ORDER BY name
+		{"FOR UPDATE" if repair else ""}
+		""",
+		{"customers": tuple(customers) or ("",)},
+		as_dict=True,
+	)
+	expected_totals = get_customer_totals(customers)
+	# Read after counting: a counted reading was queued as soon as its submit committed
+	dirty_customers = get_dirty_customers()
+
+	mismatches = []
+	for stored in stored_totals:
+		if stored.name in dirty_customers:
+			continue
+
+		expected = expected_totals[stored.name]
+		count = expected.reading_count
+		expected.average_kw = expected.kw_sum / count if count else 0.0
+		expected.average_kwh = expected.kwh_sum / count if count else 0.0
+
+		if all(flt(stored[field], 6) == flt(expected[field], 6) for field in expected):
+			continue
+
+		mismatches.append({"customer": stored.name, "stored": stored, "expected": expected})
+		if repair:
+			frappe.db.set_value("Customer", stored.name, expected, update_modified=False)
+			invalidate_summaries(stored.name)
+
+	return mismatches
+
@@ -4,6 +4,19 @@
 import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from test_abraham.solar_cell_company.doctype.customer.customer import check_user_roles, get_customer_users
+
+
+def make_portal_user(email, roles=("Customer",)):
+    user = frappe.get_doc({
+        "doctype": "User",
+        "email": email,
+        "first_name": "Portal",
+        "send_welcome_email": 0,
+        "roles": [{"role": role} for role in roles],
+    }).insert(ignore_permissions=True)
+    return user
+
 
 class TestCustomer(FrappeTestCase):
 
@@ -49,3 +62,30 @@ class TestCustomer(FrappeTestCase):
             email=self.test_email
         )
         self.assertTrue(response.get("exists"))
+
+    def test_check_user_roles(self):
+        """Batch role check reflects role changes saved on the user without extra queries"""
+        portal = make_portal_user("portal_role_customer@example.com")
+        staff = make_portal_user("portal_role_staff@example.com", roles=("Sales User",))
+        self.addCleanup(frappe.delete_doc, "User", portal.name, force=True)
+        self.addCleanup(frappe.delete_doc, "User", staff.name, force=True)
+
+        check_user_roles([portal.name])
+        with self.assertQueryCount(0):
+            self.assertEqual(
+                check_user_roles([portal.name, staff.name]), {portal.name: True, staff.name: False}
+            )
+
+        staff.add_roles("Customer")
+        portal.remove_roles("Customer")
+        self.assertEqual(check_user_roles(f'["{portal.name}", "{staff.name}"]'), {portal.name: False, staff.name: True})
+
+    def test_get_customer_users_paging(self):
+        """The user link query searches and pages through Customer users"""
+        emails = [f"portal_page_{index}@example.com" for index in range(3)]
+        for email in emails:
+            self.addCleanup(frappe.delete_doc, "User", make_portal_user(email).name, force=True)
+
+        first_page = get_customer_users("User", "portal_page_", "name", 0, 2)
+        second_page = get_customer_users("User", "portal_page_", "name", 2, 2)
+        self.assertEqual([row[0] for row in first_page + second_page], emails)
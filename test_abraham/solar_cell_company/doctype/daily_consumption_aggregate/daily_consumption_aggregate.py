@@ -0,0 +1,27 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from test_abraham.utils.consumption_aggregates import get_aggregate_name
+
+
+class DailyConsumptionAggregate(Document):
+	"""
+	Running totals and extremes of submitted Power Consumption records for one customer,
+	day and tariff. Whole days of a report range are read from these rows instead of
+	the raw readings.
+	"""
+
+	def autoname(self):
+		"""
+		Names the aggregate deterministically as `customer-YYYY-MM-DD-tariff`
+		so the primary key doubles as the upsert key.
+		"""
+		self.name = get_aggregate_name(self.customer, self.period, self.tariff, "Day")
+
+
+def on_doctype_update():
+	frappe.db.add_index("Daily Consumption Aggregate", ["customer", "period"])
+	frappe.db.add_index("Daily Consumption Aggregate", ["period"])
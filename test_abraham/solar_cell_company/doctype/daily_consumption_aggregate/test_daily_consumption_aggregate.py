@@ -0,0 +1,61 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+	make_power_consumption,
+	make_test_customer,
+)
+from test_abraham.solar_cell_company.report.customer_average_consumption_report.customer_average_consumption_report import (
+	execute,
+)
+from test_abraham.utils.consumption_aggregates import get_aggregate_name
+
+
+class TestDailyConsumptionAggregate(FrappeTestCase):
+
+	def setUp(self):
+		self.customer = make_test_customer()
+		self.readings = [
+			("2024-05-01 08:00:00", 1, 4),
+			("2024-05-02 09:00:00", 2, 8),
+			("2024-05-02 13:00:00", 4, 16),
+			("2024-06-10 07:00:00", 3, 12),
+			("2024-07-01 22:00:00", 5, 20),
+		]
+		for date, kw, kwh in self.readings:
+			make_power_consumption(self.customer, date, kw, kwh)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_extremes_after_cancel(self):
+		"""Cancelling the day's maximum narrows the daily extremes again"""
+		name = get_aggregate_name(self.customer, "2024-05-02", "High", "Day")
+		self.assertEqual(frappe.db.get_value("Daily Consumption Aggregate", name, "kw_max"), 4)
+
+		peak = frappe.get_doc("Power Consumption", {"customer": self.customer, "date": "2024-05-02 13:00:00"})
+		peak.cancel()
+
+		row = frappe.db.get_value("Daily Consumption Aggregate", name, ["reading_count", "kw_min", "kw_max"], as_dict=True)
+		self.assertEqual((row.reading_count, row.kw_min, row.kw_max), (1, 2, 2))
+
+	def test_report_matches_raw_readings(self):
+		"""Rollup-backed report totals equal the raw averages for ranges with partial edge days"""
+		for from_date, to_date in (
+			(None, None),
+			("2024-05-01 12:00:00", "2024-07-01 23:00:00"),
+			("2024-05-02 00:00:00", "2024-06-30 23:59:59"),
+			("2024-05-02 10:00:00", "2024-05-02 14:00:00"),
+		):
+			_, data, _ = execute(frappe._dict(from_date=from_date, to_date=to_date))
+			row = next(row for row in data if row["customer"] == self.customer)
+
+			expected = [
+				(kw, kwh) for date, kw, kwh in self.readings
+				if (not from_date or date >= from_date) and (not to_date or date <= to_date)
+			]
+			self.assertAlmostEqual(row["average_kw"], sum(kw for kw, _ in expected) / len(expected))
+			self.assertAlmostEqual(row["average_kwh"], sum(kwh for _, kwh in expected) / len(expected))
@@ -0,0 +1,13 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class MeterReadingBatch(Document):
+	"""
+	Receipt of a batch of readings posted by a meter gateway, written in the same
+	transaction as the readings by `test_abraham.utils.meter_ingestion`. Its name is the
+	gateway's batch id, so a retried batch is recognised and not inserted again.
+	"""
+	pass
@@ -0,0 +1,63 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import base64
+from datetime import timedelta
+
+import frappe
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from test_abraham.solar_cell_company.doctype.customer.customer import reconcile_customer_totals
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import make_test_customer
+from test_abraham.utils.meter_ingestion import ingest_readings
+
+
+def pack(values, dtype="<f4"):
+	return base64.b64encode(np.asarray(values, dtype=dtype).tobytes()).decode()
+
+
+class TestMeterReadingBatch(FrappeTestCase):
+
+	def setUp(self):
+		self.customer = make_test_customer()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def count_readings(self):
+		return frappe.db.count("Power Consumption", {
+			"customer": self.customer,
+			"date": ("between", ["2024-06-01 00:00:00", "2024-06-01 01:00:00"]),
+			"docstatus": 1,
+		})
+
+	def test_ingest_readings(self):
+		"""A batch is inserted once, retries replay its receipt and known readings are skipped"""
+		kw, kwh = [1.5, None, 2.25, 3.0], [1.5, None, 0, 0]
+		receipt = ingest_readings("test-batch-1", self.customer, "2024-06-01 00:00:00", kw, kwh)
+		self.assertEqual((receipt.reading_count, receipt.inserted, receipt.gaps), (4, 3, 1))
+		self.assertFalse(receipt.replayed)
+		self.assertEqual(self.count_readings(), 3)
+
+		self.assertTrue(ingest_readings("test-batch-1", self.customer, "2024-06-01 00:00:00", kw, kwh).replayed)
+		self.assertEqual(self.count_readings(), 3)
+		self.assertRaises(
+			frappe.DuplicateEntryError, ingest_readings, "test-batch-1", self.customer, "2024-06-01 00:00:00", kw, [0] * 4
+		)
+
+		receipt = ingest_readings(
+			"test-batch-2", self.customer, "2024-06-01 00:45:00", pack([2, 2]), pack([0, 0]), encoding="float32"
+		)
+		self.assertEqual((receipt.inserted, receipt.duplicates), (1, 1))
+		self.assertEqual(self.count_readings(), 4)
+		self.assertEqual(frappe.db.get_value("Meter Reading Batch", "test-batch-2", "customer"), self.customer)
+		self.assertEqual(frappe.db.get_value("Customer", self.customer, "reading_count"), 4)
+		self.assertEqual(reconcile_customer_totals([self.customer]), [])
+
+	def test_future_readings(self):
+		"""A batch reaching into the future is rejected as a whole"""
+		start = now_datetime() - timedelta(minutes=15)
+		self.assertRaises(frappe.ValidationError, ingest_readings, "test-batch-3", self.customer, start, [1] * 4, [0] * 4)
+		self.assertFalse(frappe.db.exists("Meter Reading Batch", "test-batch-3"))
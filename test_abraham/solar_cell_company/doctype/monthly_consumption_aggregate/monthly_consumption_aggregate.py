@@ -0,0 +1,27 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from test_abraham.utils.consumption_aggregates import get_aggregate_name
+
+
+class MonthlyConsumptionAggregate(Document):
+	"""
+	Running totals of submitted Power Consumption records for one customer, month and tariff.
+	Rows are maintained with atomic upserts from the Power Consumption lifecycle hooks,
+	so ROI figures can be derived without rescanning the month.
+	"""
+
+	def autoname(self):
+		"""
+		Names the aggregate deterministically as `customer-YYYY-MM-tariff`
+		so the primary key doubles as the upsert key.
+		"""
+		self.name = get_aggregate_name(self.customer, self.period, self.tariff)
+
+
+def on_doctype_update():
+	frappe.db.add_index("Monthly Consumption Aggregate", ["customer", "period"])
+	frappe.db.add_index("Monthly Consumption Aggregate", ["period"])
@@ -0,0 +1,36 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+	make_power_consumption,
+	make_test_customer,
+)
+from test_abraham.utils.consumption_aggregates import get_month_totals, rebuild_month
+
+
+class TestMonthlyConsumptionAggregate(FrappeTestCase):
+
+	def setUp(self):
+		self.customer = make_test_customer()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_rebuild_matches_incremental_totals(self):
+		"""Rebuilding a month from raw records gives the same counters as the incremental upserts"""
+		make_power_consumption(self.customer, "2024-02-01 00:00:00", 1.25, 5)
+		make_power_consumption(self.customer, "2024-02-14 09:30:00", 2.5, 10)
+		make_power_consumption(self.customer, "2024-02-29 23:45:00", 0.75, 3)
+
+		incremental = get_month_totals(self.customer, 2024, 2)
+		rebuild_month(self.customer, 2024, 2)
+		rebuilt = get_month_totals(self.customer, 2024, 2)
+
+		self.assertEqual(incremental.reading_count, 3)
+		self.assertEqual(rebuilt.reading_count, incremental.reading_count)
+		self.assertAlmostEqual(rebuilt.kw_sum, incremental.kw_sum)
+		self.assertAlmostEqual(rebuilt.kwh_sum, incremental.kwh_sum)
+		self.assertEqual(set(rebuilt.tariffs), set(incremental.tariffs))
@@ -0,0 +1,12 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class PerformanceMetricLog(Document):
+	"""
+	Wall time, SQL query and rows examined statistics of an instrumented hook over one
+	flush period, written by `test_abraham.utils.instrumentation.flush_metrics`.
+	"""
+	pass
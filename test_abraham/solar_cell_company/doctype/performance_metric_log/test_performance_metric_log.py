@@ -0,0 +1,61 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+	make_power_consumption,
+	make_test_customer,
+)
+from test_abraham.utils.instrumentation import flush_metrics, get_metric_names, get_metrics, measure, read_histogram
+
+
+class TestPerformanceMetricLog(FrappeTestCase):
+
+	def setUp(self):
+		self.customer = make_test_customer()
+		for metric in get_metric_names():
+			read_histogram(metric, reset=True)
+
+	def tearDown(self):
+		frappe.db.rollback()
+		frappe.clear_document_cache("Solar Cell Settings", "Solar Cell Settings")
+
+	def test_disabled_instrumentation_records_nothing(self):
+		make_power_consumption(self.customer, "2024-07-01 10:00:00", 1, 4)
+		self.assertEqual(get_metrics(), [])
+
+	def test_hooks_are_recorded_and_flushed(self):
+		"""Enabled instrumentation records every hook into cache histograms, flushed into logs"""
+		settings = frappe.get_single("Solar Cell Settings")
+		settings.enable_instrumentation = 1
+		settings.save()
+
+		make_power_consumption(self.customer, "2024-07-01 10:00:00", 1, 4)
+		make_power_consumption(self.customer, "2024-07-01 11:00:00", 2, 8).cancel()
+
+		metrics = {metric.metric: metric for metric in get_metrics()}
+		self.assertEqual(metrics["Power Consumption.set_tarriff"].count, 2)
+		self.assertEqual(metrics["Power Consumption.calculate_average_tariffs_for_month"].count, 2)
+		self.assertEqual(metrics["Power Consumption.recalculate_roi_after_deletion"].count, 1)
+		self.assertGreater(metrics["Power Consumption.calculate_average_tariffs_for_month"].average_queries, 0)
+
+		flush_metrics()
+		self.assertEqual(get_metrics(), [])
+		log = frappe.get_last_doc("Performance Metric Log", {"metric": "Power Consumption.set_tarriff"})
+		self.assertEqual(log.count, 2)
+		self.assertEqual(sum(json.loads(log.histogram).values()), 2)
+		self.assertLessEqual(log.p50_ms, log.p99_ms)
+
+	def test_nested_measurements(self):
+		"""An enclosing measurement leaves out the counter reads of the measurements inside it"""
+		with measure("Test.outer"):
+			with measure("Test.inner"):
+				frappe.db.sql("SELECT 1")
+
+		metrics = {metric.metric: metric for metric in get_metrics()}
+		self.assertEqual(metrics["Test.inner"].average_queries, 1)
+		self.assertEqual(metrics["Test.outer"].average_queries, 1)
@@ -1,13 +1,24 @@
 # Copyright (c) 2025, NoBoneZ and contributors
 # For license information, please see license.txt
-from calendar import monthrange
+import hashlib
 from datetime import datetime
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import now_datetime
+from frappe.utils import get_datetime, now_datetime
+
+from test_abraham.solar_cell_company.doctype.customer.customer import apply_customer_reading
+from test_abraham.solar_cell_company.doctype.roi_calculation.roi_calculation import update_roi_calculation
+from test_abraham.utils.consumption_aggregates import apply_reading, lock_customer_month
+from test_abraham.utils.consumption_blocks import validate_not_packed
+from test_abraham.utils.helper_functions import reserve_series
+from test_abraham.utils.instrumentation import instrument
+from test_abraham.utils.recalculation import defer_recalculation, mark_month_stale
+from test_abraham.utils.summary_cache import invalidate_summaries
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+DEFAULT_METER_CHANNEL = "main"
 
-from test_abraham.base.constants import month_dict, TarriffChoices
 
 class PowerConsumption(Document):
 	"""
@@ -20,82 +31,64 @@ class PowerConsumption(Document):
 		Automatically generates a unique name for the Power Consumption document.
 		Naming format: `customer-year-instance_count`
 		
-		- Counts existing power consumption records for the customer.
+		- Reserves the next number of the customer's naming series in one atomic upsert,
+		  so parallel inserts never collide and deleted records never free a number.
 		- Extracts the year from the provided date.
-		- Appends an incremental count to maintain uniqueness.
 		"""
-		customer_count = frappe.db.sql(
-			"""
-			SELECT COUNT(*) as customer_count 
-			FROM `tabPower Consumption` 
-			WHERE customer = %s 
-			""",
-			(self.customer,),
-			as_dict=True
-		)[0].get("customer_count", 0)
+		instance_count = reserve_series(get_series_key(self.customer))
 
 		# Convert date string to datetime object if necessary
 		date = datetime.strptime(self.date, "%Y-%m-%d %H:%M:%S") if isinstance(self.date, str) else self.date
 
 		# Assign a unique name
-		self.name = f"{self.customer}-{date.year}-{customer_count + 1}"
+		self.name = f"{self.customer}-{date.year}-{instance_count}"
 
 	def validate(self):
 		"""
 		Validates the document before saving.
-		Ensures that there are no duplicate power consumption records for the same customer and date.
+		Ensures that there are no duplicate power consumption records for the same customer, date
+		and meter channel, that the month was not packed into a Consumption Block, and assigns
+		the tariff so it is stored together with the record.
 		"""
+		self.set_reading_key()
 		self.validate_unique()
 		self.validate_future_dates()
+		validate_not_packed(self.customer, self.date)
+		self.set_tarriff()
 
 	def validate_future_dates(self):
 		formatted_date = datetime.strptime(self.date, "%Y-%m-%d %H:%M:%S") if isinstance(self.date, str) else self.date
 		if formatted_date > now_datetime():
 			frappe.throw("Power consumption can not be recorded for future dates")
 
+	def set_reading_key(self):
+		"""Derives the hashed natural key (customer + timestamp + meter channel) of the reading."""
+		self.meter_channel = self.meter_channel or DEFAULT_METER_CHANNEL
+		self.reading_key = make_reading_key(self.customer, self.date, self.meter_channel)
+
 	def validate_unique(self):
 		"""
-		Checks for duplicate power consumption entries for the same customer and date.
-		Prevents duplicate kWh values from being stored.
+		Checks for duplicate power consumption entries for the same customer, date and meter channel.
+		The lookup is a seek on the unique `reading_key` index, which also rejects
+		duplicates inserted concurrently.
 		"""
-		if self.is_new() and frappe.db.exists(
-			"Power Consumption", 
-			{"date": self.date, "customer": self.customer, "kwh": self.kwh, "kwh__": self.kwh__, "docstatus": "1"}
-		):
-			frappe.throw("A record for this date with the same KWH and KW already exists.")
+		if self.is_new() and frappe.db.exists("Power Consumption", {"reading_key": self.reading_key}):
+			frappe.throw("A record for this date and meter channel already exists.")
 
 
-	def update_customer_consumption(self):
+	@instrument("Power Consumption.update_customer_consumption")
+	def update_customer_consumption(self, sign=1):
 		"""
 		Updates the average power consumption values for the associated customer.
 
-		This function calculates the average power consumption (`kwh` and `kwh__`)
-		for a given customer by querying the `Power Consumption` table. The computed
-		values are then updated in the corresponding `Customer` document.
-
-		Steps:
-		1. Query the database to calculate the average `kwh` and `kwh__` values for the customer.
-		2. Update the `average_kw` and `average_kwh` fields in the `Customer` doctype.
+		The reading is added to (or, with sign=-1, removed from) the customer's running
+		totals and the averages are derived from them, so the cost does not grow with the
+		customer's history. A nightly job reconciles the totals with the readings.
 
 		Returns:
 			None
 		"""
-
-		# SQL query to fetch the average power consumption values for the customer
-		query_avg = """ 
-			SELECT AVG(kwh) AS average_kw, AVG(kwh__) AS average_kwh 
-			FROM `tabPower Consumption` 
-			WHERE customer = %s AND docstatus = 1
-		"""
-
-		# Execute the query and fetch the result
-		result_avg = frappe.db.sql(query_avg, (self.customer,), as_dict=True)
-
-		# Update the Customer document with the calculated average values
-		frappe.db.set_value('Customer', self.customer, {
-			'average_kw': result_avg[0]["average_kw"] if result_avg else 0,
-			'average_kwh': result_avg[0]["average_kwh"] if result_avg else 0
-		})
+		apply_customer_reading(self.customer, self.kwh, self.kwh__, sign)
 
 
 	def on_submit(self):
@@ -106,16 +99,23 @@ class PowerConsumption(Document):
 		of a `Power Consumption` record.
 
 		Actions performed:
-		1. Determine the tariff type based on the time of consumption (`set_tarriff`).
-		2. Compute and update the average monthly tariffs (`calculate_average_tariffs_for_month`).
-		3. Update the customer's average power consumption data (`update_customer_consumption`).
+		1. Add the reading to the customer's monthly aggregates and refresh the ROI (`calculate_average_tariffs_for_month`).
+		2. Update the customer's average power consumption data (`update_customer_consumption`).
+
+		The peak KW only grows on insert and is widened in place; load factor and p95 KW
+		need the whole month and are left to the recalculation job, with the month marked
+		stale until it runs.
+
+		The tariff itself is assigned in `validate` so it is persisted with the record.
+		When ROI recalculation is deferred in Solar Cell Settings, the month is only marked
+		stale and a background job performs both steps.
 
 		Returns:
 			None
 		"""
-
-		# Set the tariff type for the record
-		self.set_tarriff()
+		self.invalidate_cached_summaries()
+		if defer_recalculation(self.customer, self.date, kw=self.kwh or 0):
+			return
 
 		# Calculate and update average tariffs for the customer's monthly consumption
 		self.calculate_average_tariffs_for_month()
@@ -124,210 +124,117 @@ class PowerConsumption(Document):
 		self.update_customer_consumption()
 
 
+	@instrument("Power Consumption.set_tarriff")
 	def set_tarriff(self):
 		"""
-		Determines the tariff category (LOW or HIGH) based on the consumption time.
-
-		- "LOW" tariff applies between 11 PM and 6 AM.
-		- "HIGH" tariff applies between 6 AM and 11 PM.
+		Determines the tariff band based on the consumption time, using the
+		Tariff Schedule in effect on the record's date.
 		"""
 		formatted_date = datetime.strptime(self.date, "%Y-%m-%d %H:%M:%S") if isinstance(self.date, str) else self.date
-		self.tarriff = TarriffChoices.LOW if 23 <= formatted_date.hour or formatted_date.hour < 6 else TarriffChoices.HIGH
+		self.tarriff = get_tarriff(formatted_date)
 
+	@instrument("Power Consumption.calculate_average_tariffs_for_month")
 	def calculate_average_tariffs_for_month(self):
 		"""
 		Calculates and updates the average power consumption tariffs for a given month.
 
 		**Process:**
-		1. Fetch all power consumption records for the customer within the current month.
-		2. Compute the overall average of `kwh` and `kwh__` values.
-		3. Calculate tariff-specific averages for LOW and HIGH tariff time periods.
-		4. Update or create an entry in the "ROI Calculation" document.
+		1. Add this record to the customer's Monthly Consumption Aggregate in one atomic upsert.
+		2. Derive the average `kwh`, `kwh__` and the LOW/HIGH tariffs from the aggregate counters.
+		3. Update or create an entry in the "ROI Calculation" document.
+		4. Widen its peak KW in place and queue the month for the demand recalculation.
 
 		Returns:
 			None
 		"""
-
-		# Extract year and month from the date field
 		formatted_date = datetime.strptime(self.date, "%Y-%m-%d %H:%M:%S") if isinstance(self.date, str) else self.date
-		year = formatted_date.year
-		month = formatted_date.month
-		last_day = monthrange(year, month)[1]  # Get the last day of the month
-
-		start_date = f"{year}-{str(month).zfill(2)}-01"
-		end_date = f"{year}-{str(month).zfill(2)}-{last_day}"
-
-		# Fetch all power consumption records for the customer in the given month
-		query_raw = """
-			SELECT kwh, kwh__, date
-			FROM `tabPower Consumption`
-			WHERE customer = %s
-			AND date BETWEEN %s AND %s AND docstatus = 1
-		"""
-		current_records = frappe.db.sql(query_raw, (self.customer, start_date, end_date), as_dict=True)
-
-		if not current_records:
-			return None  # Exit if no records exist
-
-		# Compute average kwh and kwh__
-		query_avg = """
-			SELECT AVG(kwh) as average_kw, AVG(kwh__) as average_kwh
-			FROM `tabPower Consumption`
-			WHERE customer = %s
-			AND docstatus = 1
-			AND date BETWEEN %s AND %s
-		"""
-		avg_result = frappe.db.sql(query_avg, (self.customer, start_date, end_date), as_dict=True)
-		average_kw = avg_result[0]["average_kw"] if avg_result else 0
-		average_kwh = avg_result[0]["average_kwh"] if avg_result else 0
-
-		# Compute average tariffs based on time periods
-		query_tarriff = """
-			SELECT 
-				AVG(CASE WHEN tarriff = 'High' THEN kwh__ ELSE NULL END) AS average_kwh_high,
-				AVG(CASE WHEN tarriff = 'Low' THEN kwh__ ELSE NULL END) AS average_kwh_low
-			FROM `tabPower Consumption`
-			WHERE customer = %s
-			AND docstatus = 1
-			AND date BETWEEN %s AND %s
-		"""
-		tariff_result = frappe.db.sql(query_tarriff, (self.customer, start_date, end_date), as_dict=True)
-
-		# Extract tariff values
-		average_low = tariff_result[0]["average_kwh_low"] if tariff_result else 0
-		average_high = tariff_result[0]["average_kwh_high"] if tariff_result else 0
-
-		low_tariff = 0.1 * average_low if average_low else 0
-		high_tariff = 0.3 * average_high if average_high else 0
-
-		# Map numeric month to its string equivalent
-		month_equivalent = month_dict.get(str(month), "").capitalize()
-
-		# Check if an ROI Calculation already exists for this month & customer
-		existing_roi = frappe.db.get_value(
-			"ROI Calculation",
-			{"customer": self.customer, "month": month_equivalent, "year": year},
-			"name",
-			as_dict=True
-		)
-
-		if existing_roi:
-			# Update the existing ROI Calculation record
-			frappe.db.set_value("ROI Calculation", existing_roi["name"], {
-				"average_kw": average_kw,
-				"average_kwh": average_kwh,
-				"low_tariff": low_tariff,
-				"high_tarriff": high_tariff
-			})
-		else:
-			# Create a new ROI Calculation record
-			roi_entry = frappe.get_doc({
-				"doctype": "ROI Calculation",
-				"customer": self.customer,
-				"month": month_equivalent,
-				"year": year,
-				"average_kw": average_kw,
-				"average_kwh": average_kwh,
-				"low_tariff": low_tariff,
-				"high_tarriff": high_tariff,
-			})
-			roi_entry.insert()
-			
-			roi_entry.submit()
-			
-
-		frappe.db.commit()
-		return
+
+		lock_customer_month(self.customer, formatted_date)
+		apply_reading(self.customer, formatted_date, self.tarriff, self.kwh, self.kwh__)
+		update_roi_calculation(self.customer, formatted_date.year, formatted_date.month, demand=False)
+		mark_month_stale(self.customer, formatted_date, kw=self.kwh or 0)
 
 	
 	def on_cancel(self):
+		# Release the natural key so the reading can be amended or recorded again
+		self.db_set("reading_key", None, update_modified=False)
+		self.invalidate_cached_summaries()
 		self.recalculate_roi_after_deletion()
 
+	def invalidate_cached_summaries(self):
+		"""Invalidates the cached summaries of the customer and of the reading's month."""
+		date = get_datetime(self.date)
+		invalidate_summaries(self.customer, date.year, date.month)
+
 
+	@instrument("Power Consumption.recalculate_roi_after_deletion")
 	def recalculate_roi_after_deletion(self):
 		"""
 		Recalculates and updates the ROI Calculation entry for a customer 
 		if a Power Consumption record is deleted.
 
 		**Process:**
-		1. Recalculate the average `kw` and `kwh` for the remaining records in that month.
-		2. Recalculate the `low_tariff` and `high_tariff` values.
+		1. Remove this record from the customer's Monthly Consumption Aggregate.
+		2. Recompute the averages and `low_tariff`/`high_tariff` values from the remaining counters.
 		3. Update the existing ROI Calculation if data remains.
 		4. Delete the ROI Calculation if no records exist.
+		5. Remove the record from the customer's running totals and averages.
+		6. Mark the month stale so the recalculation job recomputes its peak, load factor and p95 KW.
 
-		Args:
-			customer (str): The customer ID whose power consumption record was deleted.
-			date (str or datetime): The date of the deleted record.
+		When ROI recalculation is deferred, the month is only marked stale instead.
 
 		Returns:
 			None
 		"""
+		if defer_recalculation(self.customer, self.date):
+			return
 
-		# Extract year and month from the date field
 		formatted_date = datetime.strptime(self.date, "%Y-%m-%d %H:%M:%S") if isinstance(self.date, str) else self.date
-		year = formatted_date.year
-		month = formatted_date.month
-		last_day = monthrange(year, month)[1]
-
-		start_date = f"{year}-{str(month).zfill(2)}-01"
-		end_date = f"{year}-{str(month).zfill(2)}-{last_day}"
-
-		# Fetch remaining power consumption records for the customer in that month
-		query_count = """
-			SELECT COUNT(*) as record_count
-			FROM `tabPower Consumption`
-			WHERE customer = %s AND date BETWEEN %s AND %s AND DOCSTATUS = 1
-		"""
-		record_count = frappe.db.sql(query_count, (self.customer, start_date, end_date), as_dict=True)[0]["record_count"]
-
-		if record_count == 0:
-			# If no records remain, delete the ROI Calculation entry
-			existing_roi = frappe.db.get_value(
-				"ROI Calculation",
-				{"customer": self.customer, "month": month_dict.get(str(month), "").capitalize(), "year": year},
-				"name"
-			)
-			if existing_roi:
-				frappe.delete_doc("ROI Calculation", existing_roi)
-				frappe.db.commit()
-			return
 
-		# Compute new average kwh and kwh__
-		query_avg = """
-			SELECT AVG(kwh) as average_kw, AVG(kwh__) as average_kwh
-			FROM `tabPower Consumption`
-			WHERE customer = %s AND date BETWEEN %s AND %s AND DOCSTATUS = 1
-		"""
-		avg_result = frappe.db.sql(query_avg, (self.customer, start_date, end_date), as_dict=True)
-		average_kw = avg_result[0]["average_kw"] if avg_result else 0
-		average_kwh = avg_result[0]["average_kwh"] if avg_result else 0
-
-		# Compute new average tariffs
-		query_tariff = """
-			SELECT 
-				AVG(CASE WHEN tarriff = 'High' THEN kwh__ ELSE NULL END) AS average_kwh_high,
-				AVG(CASE WHEN tarriff = 'Low' THEN kwh__ ELSE NULL END) AS average_kwh_low
-			FROM `tabPower Consumption`
-			WHERE customer = %s AND date BETWEEN %s AND %s AND DOCSTATUS = 1
-		"""
-		tariff_result = frappe.db.sql(query_tariff, (self.customer, start_date, end_date), as_dict=True)
-		average_low = tariff_result[0]["average_kwh_low"] if tariff_result else 0
-		average_high = tariff_result[0]["average_kwh_high"] if tariff_result else 0
-
-		low_tariff = 0.1 * average_low if average_low else 0
-		high_tariff = 0.3 * average_high if average_high else 0
-
-		# Update the existing ROI Calculation record
-		query_update = """
-			UPDATE `tabROI Calculation`
-			SET 
-				average_kw = %s,
-				average_kwh = %s,
-				low_tariff = %s,
-				high_tarriff = %s
-			WHERE customer = %s 
-			AND month = %s
-			AND year = %s
-		"""
-		frappe.db.sql(query_update, (average_kw, average_kwh, low_tariff, high_tariff, self.customer, month_dict.get(str(month), "").capitalize(), year))
-		frappe.db.commit()
+		lock_customer_month(self.customer, formatted_date)
+		apply_reading(self.customer, formatted_date, self.tarriff, self.kwh, self.kwh__, sign=-1)
+		update_roi_calculation(self.customer, formatted_date.year, formatted_date.month, demand=False)
+		mark_month_stale(self.customer, formatted_date)
+		self.update_customer_consumption(sign=-1)
+
+
+def get_tarriff(date):
+	"""
+	Returns the tariff band for a consumption time from the configured Tariff Schedules.
+
+	Without any schedule the original split applies:
+	- "LOW" tariff applies between 11 PM and 6 AM.
+	- "HIGH" tariff applies between 6 AM and 11 PM.
+	"""
+	return get_tariff_engine().get_band(date)
+
+
+def get_series_key(customer):
+	"""Naming series holding the customer's Power Consumption instance count."""
+	return f"Power Consumption::{customer}"
+
+
+def make_reading_key(customer, date, meter_channel=None):
+	"""
+	Hashes the natural key of a reading. The same MD5 of
+	`customer|YYYY-MM-DD HH:MM:SS|channel` can be produced in SQL for backfills.
+	"""
+	timestamp = get_datetime(date).strftime("%Y-%m-%d %H:%M:%S")
+	natural_key = f"{customer}|{timestamp}|{meter_channel or DEFAULT_METER_CHANNEL}"
+	return hashlib.md5(natural_key.encode(), usedforsecurity=False).hexdigest()
+
+
+def make_reading_keys(customer, timestamps, meter_channel=None):
+	"""`make_reading_key` of many readings of one customer and channel, from `YYYY-MM-DD HH:MM:SS` strings."""
+	prefix, suffix = f"{customer}|", f"|{meter_channel or DEFAULT_METER_CHANNEL}"
+	return [
+		hashlib.md5(f"{prefix}{timestamp}{suffix}".encode(), usedforsecurity=False).hexdigest()
+		for timestamp in timestamps
+	]
+
+
+def on_doctype_update():
+	"""Composite indexes for the per-customer month scans, tariff splits and report edge days."""
+	frappe.db.add_index("Power Consumption", ["customer", "docstatus", "date"], "customer_docstatus_date_index")
+	frappe.db.add_index("Power Consumption", ["customer", "tarriff", "date"], "customer_tarriff_date_index")
+	frappe.db.add_index("Power Consumption", ["docstatus", "date"], "docstatus_date_index")
@@ -1,9 +1,235 @@
 # Copyright (c) 2025, NoBoneZ and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from test_abraham.base.constants import TarriffChoices
+from test_abraham.solar_cell_company.doctype.customer.customer import reconcile_customer_totals
+from test_abraham.solar_cell_company.doctype.power_consumption.power_consumption import make_reading_key
+from test_abraham.utils.consumption_aggregates import get_month_totals
+from test_abraham.utils.consumption_series import ConsumptionSeries
+from test_abraham.utils.helper_functions import get_customer_permission_query_conditions
+from test_abraham.utils.recalculation import DIRTY_MONTHS_KEY, refresh_consumption_summaries
+
+
+def make_test_customer(email="power_consumption_customer@example.com"):
+	"""Creates (or reuses) a portal user and a Customer linked to it."""
+	if not frappe.db.exists("User", email):
+		frappe.get_doc({
+			"doctype": "User",
+			"email": email,
+			"first_name": "Power",
+			"send_welcome_email": 0,
+			"roles": [{"role": "Customer"}],
+		}).insert(ignore_permissions=True)
+
+	customer = frappe.db.get_value("Customer", {"email": email}, "name")
+	if customer:
+		return customer
+
+	return frappe.get_doc({
+		"doctype": "Customer",
+		"first_name": "Power",
+		"last_name": "Consumer",
+		"email": email,
+		"country": "Nigeria",
+		"phone_number": "+2348000000000",
+	}).insert(ignore_permissions=True).name
+
+
+def make_power_consumption(customer, date, kwh, kwh__, submit=True):
+	doc = frappe.get_doc({
+		"doctype": "Power Consumption",
+		"customer": customer,
+		"date": date,
+		"kwh": kwh,
+		"kwh__": kwh__,
+	}).insert(ignore_permissions=True)
+	if submit:
+		doc.submit()
+	return doc
+
 
 class TestPowerConsumption(FrappeTestCase):
-	pass
+
+	def setUp(self):
+		self.customer = make_test_customer()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_tariff_is_persisted(self):
+		"""The tariff is assigned before save so it is stored with the record"""
+		low = make_power_consumption(self.customer, "2024-01-10 23:15:00", 1.5, 6)
+		high = make_power_consumption(self.customer, "2024-01-10 12:00:00", 2.5, 10)
+
+		self.assertEqual(frappe.db.get_value("Power Consumption", low.name, "tarriff"), TarriffChoices.LOW)
+		self.assertEqual(frappe.db.get_value("Power Consumption", high.name, "tarriff"), TarriffChoices.HIGH)
+
+	def test_names_are_not_reused(self):
+		"""Names come from the customer's series, so deleting a record never frees its number"""
+		first = make_power_consumption(self.customer, "2024-03-01 10:00:00", 1, 4, submit=False)
+		frappe.delete_doc("Power Consumption", first.name)
+		second = make_power_consumption(self.customer, "2024-03-01 10:00:00", 1, 4, submit=False)
+
+		self.assertTrue(second.name.startswith(f"{self.customer}-2024-"))
+		self.assertNotEqual(first.name, second.name)
+
+	def test_duplicate_reading(self):
+		"""A second reading for the same customer, timestamp and channel is rejected until the first is cancelled"""
+		first = make_power_consumption(self.customer, "2024-04-01 10:15:00", 1, 4)
+		self.assertRaises(
+			frappe.ValidationError, make_power_consumption, self.customer, "2024-04-01 10:15:00", 2, 8
+		)
+
+		# Another register of the same meter is a different reading
+		frappe.get_doc({
+			"doctype": "Power Consumption",
+			"customer": self.customer,
+			"date": "2024-04-01 10:15:00",
+			"meter_channel": "export",
+			"kwh": 0.5,
+			"kwh__": 2,
+		}).insert(ignore_permissions=True)
+
+		first.cancel()
+		make_power_consumption(self.customer, "2024-04-01 10:15:00", 3, 12)
+
+	def test_query_plans(self):
+		"""Duplicate checks and month scans seek on the index built for them"""
+
+		def explain(query, values):
+			return frappe.db.sql(f"EXPLAIN {query}", values, as_dict=True)[0]
+
+		duplicate_check = explain(
+			"SELECT name FROM `tabPower Consumption` WHERE reading_key = %s",
+			(make_reading_key(self.customer, "2024-04-01 10:15:00"),),
+		)
+		self.assertEqual(duplicate_check.key, "reading_key")
+
+		month_scan = explain(
+			"""
+			SELECT tarriff, COUNT(*), SUM(kwh), SUM(kwh__) FROM `tabPower Consumption`
+			WHERE customer = %s AND date >= %s AND date < %s AND docstatus = 1
+			GROUP BY tarriff
+			""",
+			(self.customer, "2024-04-01", "2024-05-01"),
+		)
+		self.assertEqual(month_scan.key, "customer_docstatus_date_index")
+
+		tariff_scan = explain(
+			"""
+			SELECT SUM(kwh__) FROM `tabPower Consumption`
+			WHERE customer = %s AND tarriff = %s AND date >= %s AND date < %s
+			""",
+			(self.customer, TarriffChoices.LOW, "2024-04-01", "2024-05-01"),
+		)
+		self.assertEqual(tariff_scan.key, "customer_tarriff_date_index")
+
+	def test_roi_derived_from_aggregates(self):
+		"""Submitting and cancelling keeps the monthly aggregates and ROI Calculation in sync"""
+		make_power_consumption(self.customer, "2024-01-10 02:00:00", 1, 4)
+		make_power_consumption(self.customer, "2024-01-31 18:45:00", 3, 12)
+		cancelled = make_power_consumption(self.customer, "2024-01-15 10:00:00", 5, 20)
+		cancelled.cancel()
+
+		totals = get_month_totals(self.customer, 2024, 1)
+		self.assertEqual(totals.reading_count, 2)
+		self.assertAlmostEqual(totals.kwh_sum, 16)
+
+		roi = frappe.get_doc("ROI Calculation", {"customer": self.customer, "month": "January", "year": 2024})
+		self.assertAlmostEqual(roi.average_kw, 2)
+		self.assertAlmostEqual(roi.average_kwh, 8)
+		self.assertAlmostEqual(roi.low_tariff, 0.4)
+		self.assertAlmostEqual(roi.high_tarriff, 3.6)
+		self.assertEqual(
+			{row.band: row.reading_count for row in roi.tariff_bands},
+			{TarriffChoices.LOW: 1, TarriffChoices.HIGH: 1},
+		)
+
+	def test_deferred_recalculation(self):
+		"""With deferred recalculation a submit only marks the ROI stale until the job runs"""
+		make_power_consumption(self.customer, "2024-02-05 12:00:00", 1, 4)
+
+		settings = frappe.get_single("Solar Cell Settings")
+		settings.defer_roi_recalculation = 1
+		settings.save()
+		self.addCleanup(frappe.clear_document_cache, "Solar Cell Settings", "Solar Cell Settings")
+
+		make_power_consumption(self.customer, "2024-02-06 12:00:00", 3, 12)
+		filters = {"customer": self.customer, "month": "February", "year": 2024}
+		roi = frappe.db.get_value("ROI Calculation", filters, ["average_kwh", "is_stale"], as_dict=True)
+		self.assertEqual(roi.is_stale, 1)
+		self.assertAlmostEqual(roi.average_kwh, 4)
+
+		self.assertEqual(frappe.db.get_value("Customer", self.customer, "reading_count"), 1)
+
+		# A queued month is left to the job; repairing the totals as well would count the reading twice
+		member = f"{self.customer}|2024|2"
+		frappe.cache.sadd(DIRTY_MONTHS_KEY, member)
+		self.addCleanup(frappe.cache.srem, DIRTY_MONTHS_KEY, member)
+		self.assertEqual(reconcile_customer_totals([self.customer]), [])
+		self.assertEqual(frappe.db.get_value("Customer", self.customer, "reading_count"), 1)
+		frappe.cache.srem(DIRTY_MONTHS_KEY, member)
+
+		refresh_consumption_summaries({(self.customer, 2024, 2)})
+		roi = frappe.db.get_value("ROI Calculation", filters, ["average_kwh", "is_stale"], as_dict=True)
+		self.assertEqual(roi.is_stale, 0)
+		self.assertAlmostEqual(roi.average_kwh, 8)
+		self.assertEqual(frappe.db.get_value("Customer", self.customer, "reading_count"), 2)
+		self.assertEqual(reconcile_customer_totals([self.customer]), [])
+
+	def test_consumption_series(self):
+		"""A loaded series buckets into the same monthly totals as the maintained aggregates"""
+		make_power_consumption(self.customer, "2024-08-01 02:00:00", 1, 4)
+		make_power_consumption(self.customer, "2024-08-20 18:00:00", 5, 20)
+		make_power_consumption(self.customer, "2024-09-03 10:00:00", 3, 12)
+
+		series = ConsumptionSeries.load(self.customer, "2024-08-01 00:00:00", "2024-09-30 23:59:59", chunk_size=2)
+		self.assertEqual(len(series), 3)
+		self.assertEqual(series.peak()[1], 5)
+		for (year, month), totals in series.month_totals().items():
+			self.assertEqual(totals, get_month_totals(self.customer, year, month))
+
+	def test_customer_scope(self):
+		"""Portal users only list their own readings, without a query for their Customer"""
+		other = make_test_customer("other_power_consumption_customer@example.com")
+		own = make_power_consumption(self.customer, "2024-10-01 10:00:00", 1, 4)
+		make_power_consumption(other, "2024-10-01 10:00:00", 1, 4)
+
+		email = "power_consumption_customer@example.com"
+		get_customer_permission_query_conditions(email, "Power Consumption")
+		with self.assertQueryCount(0):
+			conditions = get_customer_permission_query_conditions(email, "Power Consumption")
+		self.assertIn(self.customer, conditions)
+
+		frappe.set_user(email)
+		self.addCleanup(frappe.set_user, "Administrator")
+		self.assertEqual(
+			frappe.get_list("Power Consumption", filters={"date": "2024-10-01 10:00:00"}, pluck="name"), [own.name]
+		)
+
+	def test_customer_running_totals(self):
+		"""Submit and cancel keep the customer's running totals exact; reconciliation repairs drift"""
+		make_power_consumption(self.customer, "2024-11-01 10:00:00", 1, 4)
+		make_power_consumption(self.customer, "2024-11-02 10:00:00", 3, 12)
+		make_power_consumption(self.customer, "2024-11-03 10:00:00", 8, 32).cancel()
+
+		customer = frappe.db.get_value(
+			"Customer", self.customer, ["reading_count", "kwh_sum", "average_kw", "average_kwh"], as_dict=True
+		)
+		self.assertEqual(customer.reading_count, 2)
+		self.assertAlmostEqual(customer.kwh_sum, 16)
+		self.assertAlmostEqual(customer.average_kw, 2)
+		self.assertAlmostEqual(customer.average_kwh, 8)
+		self.assertEqual(reconcile_customer_totals([self.customer]), [])
+
+		# A refreshed month moves the totals by its change only, here none
+		refresh_consumption_summaries({(self.customer, 2024, 11)})
+		self.assertEqual(frappe.db.get_value("Customer", self.customer, "reading_count"), 2)
+		self.assertEqual(reconcile_customer_totals([self.customer]), [])
+
+		frappe.db.set_value("Customer", self.customer, "reading_count", 5)
+		self.assertEqual(len(reconcile_customer_totals([self.customer])), 1)
+		self.assertEqual(frappe.db.get_value("Customer", self.customer, "reading_count"), 2)
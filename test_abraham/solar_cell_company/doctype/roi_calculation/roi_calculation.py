@@ -1,9 +1,22 @@
 # Copyright (c) 2025, NoBoneZ and contributors
 # For license information, please see license.txt
 
+from datetime import timedelta
+
 import frappe
 from frappe.model.document import Document
-from frappe.utils import now_datetime
+from frappe.utils import get_datetime, now_datetime
+
+from test_abraham.base.constants import month_dict, TarriffChoices
+from test_abraham.utils.consumption_aggregates import get_month_range, get_month_totals
+from test_abraham.utils.consumption_blocks import get_archived_demand
+from test_abraham.utils.consumption_series import ConsumptionSeries
+from test_abraham.utils.helper_functions import reserve_series
+from test_abraham.utils.summary_cache import invalidate_summaries
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+MONTH_NUMBERS = {name: int(number) for number, name in month_dict.items()}
+DEMAND_FIELDS = ("peak_kw", "peak_time", "load_factor", "p95_kw")
 
 
 class ROICalculation(Document):
@@ -16,20 +29,12 @@ class ROICalculation(Document):
 		"""
 		Automatically generates a unique name for the ROI Calculation document.
 		The naming format is: `customer-month-year-instance_count`
-		- Counts existing ROI documents for the same customer.
+		- Reserves the next number of the customer's ROI naming series atomically.
 		- Ensures unique identification when multiple ROI calculations exist for a month.
 		"""
-		number_of_customer = frappe.db.sql(
-			"""
-			SELECT COUNT(*) as customer_count 
-			FROM `tabROI Calculation` 
-			WHERE customer = %s
-			""",
-			(self.customer,),
-			as_dict=True
-		)[0].get("customer_count", 0)
-
-		self.name = f"{self.customer}-{self.month}-{self.year}-{number_of_customer + 1}"
+		instance_count = reserve_series(get_series_key(self.customer))
+
+		self.name = f"{self.customer}-{self.month}-{self.year}-{instance_count}"
 
 	def validate(self):
 		"""
@@ -37,6 +42,7 @@ class ROICalculation(Document):
 		- Ensures that an ROI Calculation does not already exist for the same customer, 
 			month, and year to prevent duplicate records.
 		"""
+		self.roi_key = get_roi_key(self.customer, self.year, MONTH_NUMBERS.get(self.month))
 		self.validate_unique()
 
 
@@ -44,11 +50,219 @@ class ROICalculation(Document):
 		"""
 		Checks for an existing ROI Calculation document for the same customer, month, and year.
 		- If found, raises an error to prevent duplicate entries.
+		- The unique `roi_key` column enforces the same rule for concurrent writers.
 		"""
-		if self.is_new() and frappe.db.exists(
-			"ROI Calculation", {"month": self.month, "year": self.year, "customer": self.customer}
-		):
+		if self.is_new() and frappe.db.exists("ROI Calculation", {"roi_key": self.roi_key}):
 			frappe.throw(
 				f"ROI document for the month of {self.month} of {self.year} already exists. "
 				"Kindly update that document if changes are required."
-			)
\ No newline at end of file
+			)
+
+	def on_update(self):
+		invalidate_summaries(self.customer, self.year, MONTH_NUMBERS.get(self.month))
+
+	def on_cancel(self):
+		# Release the natural key so the month can be calculated again
+		self.db_set("roi_key", None, update_modified=False)
+		invalidate_summaries(self.customer, self.year, MONTH_NUMBERS.get(self.month))
+
+	def on_trash(self):
+		invalidate_summaries(self.customer, self.year, MONTH_NUMBERS.get(self.month))
+
+def update_roi_calculation(customer, year, month, demand=True):
+	"""
+	Creates, updates or removes the ROI Calculation of a customer for a month.
+
+	Averages and tariffs are derived from the Monthly Consumption Aggregate counters. The
+	peak demand figures need the distribution of the month's KW readings, which is read
+	once and evaluated in a single vectorized pass (`get_demand_values`).
+
+	Args:
+		customer (str): The customer whose ROI Calculation should be refreshed.
+		year (int): Year of the month.
+		month (int): Month number (1-12).
+		demand (bool, optional): Recompute the demand figures. Single submits and cancels
+			leave them to the recalculation job, so their cost does not grow with the month.
+
+	Returns:
+		None
+	"""
+	totals = get_month_totals(customer, year, month, for_update=True)
+
+	if totals.reading_count <= 0:
+		# No submitted readings remain for the month, drop its ROI Calculation
+		existing_roi = frappe.db.get_value(
+			"ROI Calculation", {"roi_key": get_roi_key(customer, year, month)}, "name", for_update=True
+		)
+		if existing_roi:
+			roi_entry = frappe.get_doc("ROI Calculation", existing_roi)
+			roi_entry.cancel()
+			frappe.delete_doc("ROI Calculation", existing_roi)
+		return
+
+	values, bands = get_roi_values(totals, year, month)
+	if demand:
+		values.update(get_demand_values(customer, year, month))
+	upsert_roi_calculation(customer, year, month, values, bands)
+
+
+def upsert_roi_calculation(customer, year, month, values, bands):
+	"""
+	Writes the submitted ROI Calculation of a customer-month with one
+	`INSERT ... ON DUPLICATE KEY UPDATE` on the unique `roi_key`, then replaces its bands.
+
+	Concurrent writers for the same month never create a second row: whichever inserts
+	second updates the first one's row instead, and holds its row lock until commit.
+	A series number is only reserved when no row was visible beforehand.
+
+	Returns:
+		str: Name of the ROI Calculation.
+	"""
+	roi_key = get_roi_key(customer, year, month)
+	month_name = month_dict[str(month)]
+	name = frappe.db.get_value("ROI Calculation", {"roi_key": roi_key}, "name")
+	created = not name
+	if created:
+		name = f"{customer}-{month_name}-{year}-{reserve_series(get_series_key(customer))}"
+
+	now = now_datetime()
+	row = {
+		"name": name,
+		"roi_key": roi_key,
+		"customer": customer,
+		"customer_name": frappe.db.get_value("Customer", customer, "full_name") if created else None,
+		"month": month_name,
+		"year": year,
+		**values,
+		"docstatus": 1,
+		"creation": now,
+		"modified": now,
+		"owner": frappe.session.user,
+		"modified_by": frappe.session.user,
+	}
+	updated = (*values, "modified", "modified_by")
+	frappe.db.sql(
+		f"""
+		INSERT INTO `tabROI Calculation` ({", ".join(f"`{field}`" for field in row)})
+		VALUES ({", ".join(f"%({field})s" for field in row)})
+		ON DUPLICATE KEY UPDATE {", ".join(f"`{field}` = VALUES(`{field}`)" for field in updated)}
+		""",
+		row,
+	)
+
+	if created:
+		# Another writer may have inserted the month first; read its name with a current read
+		name = frappe.db.get_value("ROI Calculation", {"roi_key": roi_key}, "name", for_update=True)
+
+	set_tariff_bands(name, bands)
+	invalidate_summaries(customer, year, month)
+	return name
+
+
+def get_roi_values(totals, year, month):
+	"""
+	Derives the ROI Calculation fields of a month from its aggregate counters.
+
+	Each tariff band is priced with the rate of the Tariff Schedule in effect at the start
+	of the month. `low_tariff` and `high_tarriff` keep reporting the Low and High bands.
+
+	Returns:
+		tuple: The ROI Calculation field values and the rows of its `tariff_bands` table.
+	"""
+	engine = get_tariff_engine()
+	period, _ = get_month_range(year, month)
+	count = totals.reading_count
+
+	bands = []
+	for band, band_totals in sorted(totals.tariffs.items()):
+		if band_totals.reading_count <= 0:
+			continue
+		average_kwh = band_totals.kwh_sum / band_totals.reading_count
+		rate = engine.get_rate(band, period)
+		bands.append({
+			"band": band,
+			"reading_count": band_totals.reading_count,
+			"average_kwh": average_kwh,
+			"rate": rate,
+			"tariff": rate * average_kwh,
+		})
+
+	tariff_by_band = {row["band"]: row["tariff"] for row in bands}
+	values = {
+		"average_kw": totals.kw_sum / count if count else 0,
+		"average_kwh": totals.kwh_sum / count if count else 0,
+		"low_tariff": tariff_by_band.get(TarriffChoices.LOW, 0),
+		"high_tarriff": tariff_by_band.get(TarriffChoices.HIGH, 0),
+		"tariff_schedule": engine.get_schedule(period),
+		"is_stale": 0,
+	}
+	return values, bands
+
+
+def get_demand_values(customer, year, month):
+	"""
+	Peak KW, its time, load factor and 95th percentile KW of a customer-month, from one
+	read of its readings (documents and packed blocks alike). A month archived without a
+	readings file has the figures stored on its Consumption Block.
+
+	Returns:
+		dict: Values of `DEMAND_FIELDS`, empty figures for a month without readings.
+	"""
+	start, end = get_month_range(year, month)
+	series = ConsumptionSeries.load(customer, start, get_datetime(end) - timedelta(seconds=1))
+	return (
+		series.month_demand().get((year, month))
+		or get_archived_demand([customer], start, end).get((customer, year, month))
+		or get_empty_demand()
+	)
+
+
+def get_empty_demand():
+	return {"peak_kw": 0, "peak_time": None, "load_factor": 0, "p95_kw": 0}
+
+
+def set_tariff_bands(roi_name, bands):
+	"""Replaces the `tariff_bands` rows of a submitted ROI Calculation in place."""
+	replace_tariff_bands({roi_name: bands})
+
+
+def replace_tariff_bands(bands_by_roi):
+	"""
+	Replaces the `tariff_bands` rows of several submitted ROI Calculations with one
+	delete and one multi-row insert.
+
+	Args:
+		bands_by_roi (dict): ROI Calculation name -> rows as returned by `get_roi_values`.
+	"""
+	if not bands_by_roi:
+		return
+
+	frappe.db.delete("ROI Tariff Band", {"parent": ("in", list(bands_by_roi)), "parenttype": "ROI Calculation"})
+
+	now = now_datetime()
+	user = frappe.session.user
+	values = [
+		(frappe.generate_hash(length=10), roi_name, "ROI Calculation", "tariff_bands", idx, 1, row["band"],
+			row["reading_count"], row["average_kwh"], row["rate"], row["tariff"], now, now, user, user)
+		for roi_name, bands in bands_by_roi.items()
+		for idx, row in enumerate(bands, start=1)
+	]
+	if not values:
+		return
+
+	frappe.db.bulk_insert(
+		"ROI Tariff Band",
+		("name", "parent", "parenttype", "parentfield", "idx", "docstatus", "band", "reading_count",
+			"average_kwh", "rate", "tariff", "creation", "modified", "owner", "modified_by"),
+		values,
+	)
+
+
+def get_roi_key(customer, year, month):
+	"""Natural key of the active ROI Calculation of a customer-month: `customer|year|month`."""
+	return f"{customer}|{year}|{month}"
+
+
+def get_series_key(customer):
+	"""Naming series holding the customer's ROI Calculation instance count."""
+	return f"ROI Calculation::{customer}"
@@ -1,9 +1,22 @@
 # Copyright (c) 2025, NoBoneZ and Contributors
 # See license.txt
 
+import threading
+
 import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from test_abraham.solar_cell_company.doctype.customer.customer import get_customer_totals
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+    make_power_consumption,
+    make_test_customer,
+)
+from test_abraham.solar_cell_company.doctype.roi_calculation.roi_calculation import get_roi_key
+from test_abraham.utils.consumption_aggregates import AGGREGATE_DOCTYPES, get_month_totals
+from test_abraham.utils.full_rebuild import rebuild_roi_calculations
+from test_abraham.utils.recalculation import DIRTY_MONTHS_KEY, refresh_consumption_summaries
+from test_abraham.utils.summary_cache import get_customer_summary, get_month_summary, get_summary_cache_stats
+
 
 class TestROICalculation(FrappeTestCase):
     """
@@ -46,6 +59,143 @@ class TestROICalculation(FrappeTestCase):
                 "year": 2025
             }).insert()
 
+    def test_rebuild_dry_run(self):
+        """A dry-run rebuild reports drifted ROI Calculations without changing them."""
+        customer = make_test_customer()
+        make_power_consumption(customer, "2024-05-10 12:00:00", 2, 8)
+        roi = frappe.db.get_value("ROI Calculation", {"customer": customer, "month": "May", "year": 2024})
+
+        summary = rebuild_roi_calculations(customer=customer, workers=1, dry_run=True)
+        self.assertEqual((summary.created, summary.updated, summary.removed), (0, 0, 0))
+
+        frappe.db.set_value("ROI Calculation", roi, "average_kwh", 99)
+        summary = rebuild_roi_calculations(customer=customer, from_date="2024-05-01", to_date="2024-05-01",
+            workers=1, dry_run=True)
+        self.assertEqual(summary.updated, 1)
+        self.assertEqual(summary.readings, 1)
+        self.assertEqual(summary.differences[0]["changes"]["average_kwh"], (99, 8))
+        self.assertEqual(frappe.db.get_value("ROI Calculation", roi, "average_kwh"), 99)
+
+    def test_peak_demand(self):
+        """The peak follows submits at once; load factor and p95 KW follow the recalculation of the stale month."""
+        customer = make_test_customer()
+        make_power_consumption(customer, "2024-08-01 08:00:00", 2, 8)
+        make_power_consumption(customer, "2024-08-01 09:00:00", 6, 24)
+        make_power_consumption(customer, "2024-08-02 09:00:00", 6, 24)
+        peak = make_power_consumption(customer, "2024-08-03 19:00:00", 10, 40)
+
+        filters = {"customer": customer, "month": "August", "year": 2024}
+        fields = ["peak_kw", "peak_time", "load_factor", "p95_kw", "is_stale"]
+        roi = frappe.db.get_value("ROI Calculation", filters, fields, as_dict=True)
+        self.assertEqual(roi.peak_kw, 10)
+        self.assertEqual(str(roi.peak_time), "2024-08-03 19:00:00")
+        self.assertEqual(roi.is_stale, 1)
+
+        refresh_consumption_summaries({(customer, 2024, 8)})
+        roi = frappe.db.get_value("ROI Calculation", filters, fields, as_dict=True)
+        self.assertEqual(roi.peak_kw, 10)
+        self.assertAlmostEqual(roi.load_factor, 0.6)
+        self.assertAlmostEqual(roi.p95_kw, 9.4)
+        self.assertEqual(roi.is_stale, 0)
+
+        # A cancel can only lower the peak, which needs the month's remaining readings
+        peak.cancel()
+        roi = frappe.db.get_value("ROI Calculation", filters, fields, as_dict=True)
+        self.assertEqual(roi.peak_kw, 10)
+        self.assertEqual(roi.is_stale, 1)
+
+        refresh_consumption_summaries({(customer, 2024, 8)})
+        roi = frappe.db.get_value("ROI Calculation", filters, fields, as_dict=True)
+        self.assertEqual(roi.peak_kw, 6)
+        self.assertEqual(str(roi.peak_time), "2024-08-01 09:00:00")
+        self.assertAlmostEqual(roi.load_factor, 14 / 18)
+
+        summary = rebuild_roi_calculations(customer=customer, workers=1, dry_run=True)
+        self.assertEqual(summary.updated, 0)
+
+    def test_summary_cache(self):
+        """Summaries are served from the cache without queries until a submit or cancel invalidates them."""
+        customer = make_test_customer()
+        make_power_consumption(customer, "2024-06-10 12:00:00", 2, 8)
+        get_summary_cache_stats(reset=True)
+
+        summary = get_customer_summary(customer)
+        month = get_month_summary(customer, 2024, 6)
+        with self.assertQueryCount(0):
+            self.assertEqual(get_customer_summary(customer), summary)
+            self.assertEqual(get_month_summary(customer, 2024, 6), month)
+        stats = get_summary_cache_stats()
+        self.assertEqual((stats["customer"]["hits"], stats["customer"]["misses"]), (1, 1))
+        self.assertEqual(stats["month"]["hit_rate"], 0.5)
+
+        reading = make_power_consumption(customer, "2024-06-11 12:00:00", 4, 16)
+        self.assertEqual(get_customer_summary(customer)["reading_count"], summary["reading_count"] + 1)
+        self.assertEqual(get_month_summary(customer, 2024, 6)["average_kwh"], 12)
+
+        reading.cancel()
+        self.assertEqual(get_customer_summary(customer)["reading_count"], summary["reading_count"])
+        self.assertEqual(get_month_summary(customer, 2024, 6)["average_kwh"], 8)
+        self.assertEqual(get_summary_cache_stats()["month"]["misses"], 3)
+
+    def test_concurrent_submits(self):
+        """Readings of one customer-month submitted concurrently add up to what a fresh rebuild computes."""
+        email = "roi_stress_customer@example.com"
+        customer = make_test_customer(email)
+        frappe.db.commit()
+        self.addCleanup(self.delete_customer_data, customer, email)
+
+        site, sites_path = frappe.local.site, frappe.local.sites_path
+        errors = []
+
+        def worker(index):
+            frappe.init(site=site, sites_path=sites_path)
+            frappe.connect()
+            try:
+                for hour in range(8, 13):
+                    make_power_consumption(customer, f"2024-03-{index + 1:02d} {hour:02d}:00:00", index + 1, hour)
+                    frappe.db.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                frappe.destroy()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        rois = frappe.get_all("ROI Calculation", {"customer": customer, "month": "March", "year": 2024}, pluck="name")
+        self.assertEqual(len(rois), 1)
+        self.assertEqual(frappe.db.get_value("ROI Calculation", rois[0], "roi_key"), get_roi_key(customer, 2024, 3))
+
+        # Load factor and p95 KW are left to the recalculation job, everything else is maintained on submit
+        summary = rebuild_roi_calculations(customer=customer, workers=1, dry_run=True)
+        changed = {field for difference in summary.differences for field in difference["changes"]}
+        self.assertLessEqual(changed, {"is_stale", "load_factor", "p95_kw"})
+        self.assertEqual(get_month_totals(customer, 2024, 3).reading_count, 40)
+
+        stored = frappe.db.get_value("Customer", customer, ["reading_count", "kw_sum", "kwh_sum"], as_dict=True)
+        expected = get_customer_totals([customer])[customer]
+        self.assertEqual(stored.reading_count, expected.reading_count)
+        self.assertAlmostEqual(stored.kw_sum, expected.kw_sum)
+        self.assertAlmostEqual(stored.kwh_sum, expected.kwh_sum)
+
+    def delete_customer_data(self, customer, email):
+        rois = frappe.get_all("ROI Calculation", {"customer": customer}, pluck="name")
+        if rois:
+            frappe.db.delete("ROI Tariff Band", {"parent": ("in", rois)})
+            frappe.db.delete("ROI Calculation", {"name": ("in", rois)})
+        frappe.db.delete("Power Consumption", {"customer": customer})
+        for doctype in AGGREGATE_DOCTYPES.values():
+            frappe.db.delete(doctype, {"customer": customer})
+        frappe.cache.srem(DIRTY_MONTHS_KEY, f"{customer}|2024|3")
+        frappe.db.delete("User Permission", {"user": email})
+        frappe.db.delete("Customer", {"name": customer})
+        frappe.delete_doc("User", email, force=True, ignore_permissions=True)
+        frappe.db.commit()
+
     def tearDown(self):
         """Cleanup test data."""
         frappe.db.rollback()
\ No newline at end of file
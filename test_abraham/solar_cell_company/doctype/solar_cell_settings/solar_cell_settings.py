@@ -0,0 +1,15 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class SolarCellSettings(Document):
+	"""App wide settings for how power consumption is processed."""
+	pass
+
+
+def get_settings():
+	"""Returns the settings from the document cache, so reading them does not hit the database."""
+	return frappe.get_cached_doc("Solar Cell Settings")
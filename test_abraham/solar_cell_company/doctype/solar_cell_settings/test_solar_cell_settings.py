@@ -0,0 +1,35 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.utils.solar_simulator import evaluate, get_pv_profile, simulate, simulate_configurations
+
+
+class TestSolarCellSettings(FrappeTestCase):
+
+	def test_solar_simulation(self):
+		"""Larger systems generate more, batteries shift surplus into the evening, payback follows savings"""
+		hours = np.arange(np.datetime64("2024-06-01T00"), np.datetime64("2024-06-02T00"), np.timedelta64(1, "h"))
+		pv = get_pv_profile(hours.astype("datetime64[s]"), 6.5, 1400)
+		self.assertEqual(pv[:5].sum(), 0)
+		self.assertGreater(pv[12], pv[8])
+
+		load = np.ones(24)
+		result = simulate(load, pv, np.full(24, 0.3), [0, 5, 5], [0, 0, 10], export_rate=0.05)
+		self.assertEqual(result.savings[0], 0)
+		self.assertAlmostEqual(result.self_consumption[1] + result.export[1], result.generation[1])
+		self.assertGreater(result.self_consumption[2], result.self_consumption[1])
+		self.assertAlmostEqual(result.grid_import[2], 24 - result.self_consumption[2])
+
+		payback, npv = evaluate(np.array([100.0, 0.0]), np.array([450.0, 10.0]), 10)
+		self.assertAlmostEqual(payback[0], 4.5)
+		self.assertTrue(np.isnan(payback[1]))
+		self.assertEqual(npv.tolist(), [550, -10])
+
+		configurations = simulate_configurations(hours.astype("datetime64[s]"), load)
+		self.assertEqual(len(configurations), 50)
+		self.assertEqual(
+			[c["npv"] for c in configurations], sorted((c["npv"] for c in configurations), reverse=True)
+		)
@@ -0,0 +1,8 @@
+// Copyright (c) 2025, NoBoneZ and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Tariff Schedule", {
+// 	refresh(frm) {
+
+// 	},
+// });
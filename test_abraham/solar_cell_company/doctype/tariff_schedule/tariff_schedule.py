@@ -0,0 +1,51 @@
+# Copyright (c) 2025, NoBoneZ and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from test_abraham.utils.repricing import queue_repricing
+from test_abraham.utils.tariff_engine import clear_tariff_engine_cache
+
+
+class TariffSchedule(Document):
+	"""
+	A time-of-use tariff in effect from `effective_from` until the next schedule starts.
+	Schedules are compiled into the cached hour-of-week lookup of the TariffEngine.
+	"""
+
+	def validate(self):
+		"""
+		Validates the document before saving.
+		- Every band used by the default, the rules and the holidays must be priced in the bands table.
+		- Rule hours must lie within a day.
+		"""
+		self.validate_bands()
+		self.validate_rule_hours()
+
+	def validate_bands(self):
+		"""Ensures every referenced band is defined exactly once in the bands table."""
+		bands = [row.band for row in self.bands]
+		duplicates = {band for band in bands if bands.count(band) > 1}
+		if duplicates:
+			frappe.throw(f"Bands {', '.join(sorted(duplicates))} are defined more than once.")
+
+		used = {self.default_band, *(row.band for row in self.rules), *(row.band for row in self.holidays)}
+		undefined = used - set(bands)
+		if undefined:
+			frappe.throw(f"Bands {', '.join(sorted(undefined))} need a rate in the bands table.")
+
+	def validate_rule_hours(self):
+		"""Ensures each rule starts between 0 and 23 and ends between 1 and 24."""
+		for row in self.rules:
+			if not (0 <= row.from_hour <= 23 and 1 <= row.to_hour <= 24) or row.from_hour == row.to_hour:
+				frappe.throw(f"Row {row.idx}: rule hours must run from 0-23 to 1-24 and cannot be equal.")
+
+	def on_update(self):
+		"""Recompiles the TariffEngine and re-prices the ROI Calculations with the new rates after commit."""
+		clear_tariff_engine_cache()
+		queue_repricing()
+
+	def on_trash(self):
+		clear_tariff_engine_cache()
+		queue_repricing()
@@ -0,0 +1,171 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+from datetime import datetime
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.base.constants import TarriffChoices
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+	make_power_consumption,
+	make_test_customer,
+)
+from test_abraham.utils.full_rebuild import rebuild_roi_calculations
+from test_abraham.utils.repricing import get_repriced_totals, reprice_roi_calculations
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+
+class TestTariffSchedule(FrappeTestCase):
+
+	def setUp(self):
+		frappe.get_doc({
+			"doctype": "Tariff Schedule",
+			"schedule_name": "Test Time of Use",
+			"effective_from": "2030-01-01",
+			"default_band": "Peak",
+			"bands": [
+				{"band": "Peak", "rate": 0.35},
+				{"band": "Shoulder", "rate": 0.2},
+				{"band": "Off Peak", "rate": 0.08},
+			],
+			"rules": [
+				{"band": "Shoulder", "days": "All Days", "from_hour": 7, "to_hour": 17},
+				{"band": "Off Peak", "days": "All Days", "from_hour": 22, "to_hour": 7},
+				{"band": "Off Peak", "days": "Weekends", "from_hour": 0, "to_hour": 24},
+			],
+			"holidays": [{"holiday_date": "2030-01-01", "band": "Off Peak"}],
+		}).insert(ignore_permissions=True)
+
+	def tearDown(self):
+		frappe.db.rollback()
+		frappe.cache.delete_value("test_abraham:tariff_engine")
+
+	def test_classification(self):
+		"""Single and vectorized lookups follow the rules, weekends, holidays and effective dates"""
+		engine = get_tariff_engine()
+		timestamps = [
+			datetime(2029, 12, 31, 12),  # before the schedule, built-in HIGH
+			datetime(2029, 12, 31, 23),  # before the schedule, built-in LOW
+			datetime(2030, 1, 1, 12),    # holiday
+			datetime(2030, 1, 2, 8),     # Wednesday shoulder
+			datetime(2030, 1, 2, 18),    # Wednesday peak
+			datetime(2030, 1, 2, 23),    # Wednesday off peak
+			datetime(2030, 1, 5, 12),    # Saturday
+		]
+
+		self.assertEqual(
+			list(engine.classify_names(timestamps)),
+			[TarriffChoices.HIGH, TarriffChoices.LOW, "Off Peak", "Shoulder", "Peak", "Off Peak", "Off Peak"],
+		)
+		self.assertEqual(engine.get_band(datetime(2030, 1, 2, 18)), "Peak")
+
+	def test_overnight_day_rule(self):
+		"""A day's overnight window continues into the early hours of the following day"""
+		frappe.get_doc({
+			"doctype": "Tariff Schedule",
+			"schedule_name": "Test Overnight",
+			"effective_from": "2032-01-01",
+			"default_band": "Peak",
+			"bands": [{"band": "Peak", "rate": 0.35}, {"band": "Off Peak", "rate": 0.08}],
+			"rules": [
+				{"band": "Off Peak", "days": "Friday", "from_hour": 22, "to_hour": 6},
+				{"band": "Off Peak", "days": "Sunday", "from_hour": 22, "to_hour": 6},
+			],
+		}).insert(ignore_permissions=True)
+		engine = get_tariff_engine()
+		timestamps = [
+			datetime(2032, 1, 2, 3),   # Friday before the window
+			datetime(2032, 1, 2, 23),  # Friday night
+			datetime(2032, 1, 3, 3),   # Saturday morning, still Friday's window
+			datetime(2032, 1, 3, 23),  # Saturday night
+			datetime(2032, 1, 4, 3),   # Sunday morning
+			datetime(2032, 1, 5, 3),   # Monday morning, Sunday's window
+		]
+
+		self.assertEqual(
+			list(engine.classify_names(timestamps)),
+			["Peak", "Off Peak", "Off Peak", "Peak", "Peak", "Off Peak"],
+		)
+
+	def test_rates(self):
+		"""Rates come from the schedule in effect for the date"""
+		engine = get_tariff_engine()
+		self.assertEqual(engine.get_rate(TarriffChoices.LOW, "2029-06-01"), 0.1)
+		self.assertEqual(engine.get_rate("Shoulder", "2030-02-01"), 0.2)
+		self.assertEqual(engine.get_rate("Shoulder", "2029-06-01"), 0)
+		self.assertEqual(
+			engine.get_rates([datetime(2029, 12, 31, 23), datetime(2030, 1, 2, 8), datetime(2030, 1, 2, 18)]).tolist(),
+			[0.1, 0.2, 0.35],
+		)
+
+	def test_undefined_band(self):
+		"""Bands used by rules must be priced"""
+		schedule = frappe.get_doc({
+			"doctype": "Tariff Schedule",
+			"schedule_name": "Test Missing Band",
+			"effective_from": "2031-01-01",
+			"default_band": "Peak",
+			"bands": [{"band": "Peak", "rate": 0.3}],
+			"rules": [{"band": "Night", "days": "All Days", "from_hour": 0, "to_hour": 6}],
+		})
+		self.assertRaises(frappe.ValidationError, schedule.insert)
+
+	def test_repricing(self):
+		"""New rates re-price stored band averages; the what-if totals write nothing"""
+		customer = make_test_customer()
+		make_power_consumption(customer, "2024-05-01 12:00:00", 2, 8)
+		make_power_consumption(customer, "2024-05-01 23:00:00", 1, 4)
+		filters = {"customer": customer, "month": "May", "year": 2024, "docstatus": 1}
+		roi = frappe.db.get_value("ROI Calculation", filters)
+		averages = dict(frappe.get_all(
+			"ROI Tariff Band", {"parent": roi, "parenttype": "ROI Calculation"}, ["band", "average_kwh"], as_list=True
+		))
+
+		frappe.get_doc({
+			"doctype": "Tariff Schedule",
+			"schedule_name": "Test Repricing",
+			"effective_from": "2024-01-01",
+			"default_band": TarriffChoices.HIGH,
+			"bands": [{"band": TarriffChoices.HIGH, "rate": 0.5}, {"band": TarriffChoices.LOW, "rate": 0.2}],
+			"rules": [{"band": TarriffChoices.LOW, "days": "All Days", "from_hour": 23, "to_hour": 6}],
+		}).insert(ignore_permissions=True)
+
+		current = 0.3 * averages[TarriffChoices.HIGH] + 0.1 * averages[TarriffChoices.LOW]
+		totals = {row.customer: row for row in get_repriced_totals({TarriffChoices.HIGH: 1}, "2024-05-01")}
+		self.assertAlmostEqual(totals[customer].current_tariff, current)
+		self.assertAlmostEqual(
+			totals[customer].repriced_tariff, averages[TarriffChoices.HIGH] + 0.2 * averages[TarriffChoices.LOW]
+		)
+		self.assertAlmostEqual(frappe.db.get_value("ROI Calculation", roi, "high_tarriff"), 0.3 * averages[TarriffChoices.HIGH])
+
+		reprice_roi_calculations()
+		values = frappe.db.get_value(
+			"ROI Calculation", roi, ["high_tarriff", "low_tariff", "tariff_schedule"], as_dict=True
+		)
+		self.assertAlmostEqual(values.high_tarriff, 0.5 * averages[TarriffChoices.HIGH])
+		self.assertAlmostEqual(values.low_tariff, 0.2 * averages[TarriffChoices.LOW])
+		self.assertEqual(values.tariff_schedule, "Test Repricing")
+		self.assertEqual(reprice_roi_calculations(), {"bands": 0, "roi_calculations": 0})
+		totals = {row.customer: row for row in get_repriced_totals()}
+		self.assertEqual(totals[customer].difference, 0)
+
+	def test_rebuild_reclassifies_readings(self):
+		"""A rebuild moves readings into the bands of a changed schedule; a dry run only reports it"""
+		customer = make_test_customer()
+		reading = make_power_consumption(customer, "2024-05-01 12:00:00", 2, 8)
+		self.assertEqual(reading.tarriff, TarriffChoices.HIGH)
+
+		frappe.get_doc({
+			"doctype": "Tariff Schedule",
+			"schedule_name": "Test Midday Low",
+			"effective_from": "2024-01-01",
+			"default_band": TarriffChoices.HIGH,
+			"bands": [{"band": TarriffChoices.HIGH, "rate": 0.3}, {"band": TarriffChoices.LOW, "rate": 0.1}],
+			"rules": [{"band": TarriffChoices.LOW, "days": "All Days", "from_hour": 11, "to_hour": 13}],
+		}).insert(ignore_permissions=True)
+
+		summary = rebuild_roi_calculations(customer=customer, workers=1, dry_run=True)
+		self.assertEqual((summary.reclassified, summary.updated), (1, 1))
+		self.assertIn("low_tariff", summary.differences[0]["changes"])
+		self.assertEqual(frappe.db.get_value("Power Consumption", reading.name, "tarriff"), TarriffChoices.HIGH)
@@ -3,6 +3,15 @@
 
 frappe.query_reports["Customer Average Consumption Report"] = {
 	"filters": [
-
+		{
+			"fieldname": "from_date",
+			"label": __("From Date"),
+			"fieldtype": "Datetime"
+		},
+		{
+			"fieldname": "to_date",
+			"label": __("To Date"),
+			"fieldtype": "Datetime"
+		}
 	]
 };
@@ -1,9 +1,14 @@
 import frappe
+from frappe import _
 
+from test_abraham.utils.consumption_aggregates import get_range_totals
+from test_abraham.utils.instrumentation import instrument
+
+@instrument("Customer Average Consumption Report")
 def execute(filters=None):
     # Default filters to use all records if none are provided
-    from_date = filters.get("from_date") if filters and filters.get("from_date") else "0000-01-01"
-    to_date = filters.get("to_date") if filters and filters.get("to_date") else "9999-12-31"
+    from_date = filters.get("from_date") if filters and filters.get("from_date") else None
+    to_date = filters.get("to_date") if filters and filters.get("to_date") else None
     
     # Define columns for the report
     columns = [
@@ -13,21 +18,32 @@ def execute(filters=None):
         {"label": "Average kWh", "fieldname": "average_kwh", "fieldtype": "Float", "width": 150},
     ]
     
-    # Query to fetch average power consumption per customer
-    data = frappe.db.sql(
-        """
-        SELECT 
-            pc.customer,
-            c.full_name AS full_name,
-            AVG(pc.kwh) AS average_kw,
-            AVG(pc.kwh__) AS average_kwh
-        FROM `tabPower Consumption` pc
-        LEFT JOIN `tabCustomer` c ON pc.customer = c.name
-        WHERE pc.date BETWEEN %s AND %s
-        GROUP BY pc.customer, c.full_name
-        """,
-        (from_date, to_date),
-        as_dict=True
-    )
-    
-    return columns, data
\ No newline at end of file
+    # Totals per customer, read from the daily/monthly rollups for whole days and
+    # from the raw submitted readings only for partial days at the edges of the range
+    totals = get_range_totals(from_date, to_date)
+    if not totals:
+        return columns, [], None
+
+    full_names = dict(frappe.db.sql(
+        "SELECT name, full_name FROM `tabCustomer` WHERE name IN %s",
+        (tuple(totals),),
+    ))
+
+    data = [
+        {
+            "customer": customer,
+            "full_name": full_names.get(customer),
+            "average_kw": total.kw_sum / total.reading_count,
+            "average_kwh": total.kwh_sum / total.reading_count,
+        }
+        for customer, total in sorted(totals.items())
+        if total.reading_count > 0
+    ]
+
+    # Months archived with their summaries only have no readings to cut a partial day from
+    widened = [customer for customer, total in sorted(totals.items()) if total.widened]
+    message = _(
+        "Partial days in months archived with their summaries only are counted as whole days for: {0}"
+    ).format(", ".join(widened)) if widened else None
+
+    return columns, data, message
@@ -0,0 +1,334 @@
+import csv
+import os
+from collections import Counter
+from itertools import islice
+
+import frappe
+from frappe import _
+from frappe.utils import flt, get_datetime, now_datetime
+
+from test_abraham.solar_cell_company.doctype.power_consumption.power_consumption import (
+    DEFAULT_METER_CHANNEL,
+    get_series_key,
+    make_reading_key,
+)
+from test_abraham.utils.consumption_blocks import get_block_name
+from test_abraham.utils.helper_functions import reserve_series
+from test_abraham.utils.recalculation import refresh_consumption_summaries
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+# Accepted column headers, either the fieldname or the label shown on the form
+COLUMN_MAP = {
+    "customer": "customer",
+    "Customer": "customer",
+    "date": "date",
+    "Date Time": "date",
+    "kwh": "kwh",
+    "KW": "kwh",
+    "kwh__": "kwh__",
+    "KWH": "kwh__",
+    "meter_channel": "meter_channel",
+    "Meter Channel": "meter_channel",
+}
+REQUIRED_COLUMNS = {"date", "kwh", "kwh__"}
+
+INSERT_FIELDS = (
+    "name", "customer", "customer_name", "date", "kwh", "kwh__", "tarriff",
+    "meter_channel", "reading_key", "docstatus", "creation", "modified", "owner", "modified_by",
+)
+
+
+def read_rows(file_path):
+    """
+    Streams the rows of a CSV or XLSX meter export as dicts keyed by Power Consumption fieldnames.
+    The file is never loaded into memory as a whole.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".csv":
+        rows = _read_csv(file_path)
+    elif extension in (".xlsx", ".xlsm"):
+        rows = _read_xlsx(file_path)
+    else:
+        frappe.throw(_("Only CSV and XLSX files can be imported"))
+
+    header = None
+    for row in rows:
+        if header is None:
+            header = [COLUMN_MAP.get(str(column).strip()) if column is not None else None for column in row]
+            missing = REQUIRED_COLUMNS - set(header)
+            if missing:
+                frappe.throw(_("Missing columns in import file: {0}").format(", ".join(sorted(missing))))
+            continue
+
+        yield {field: value for field, value in zip(header, row) if field}
+
+
+def _read_csv(file_path):
+    with open(file_path, newline="", encoding="utf-8-sig") as csv_file:
+        yield from csv.reader(csv_file)
+
+
+def _read_xlsx(file_path):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _is_blank(value):
+    return value is None or str(value).strip() == ""
+
+
+def parse_rows(rows, first_row_number, default_customer, errors):
+    """
+    Converts raw file rows into readings, recording rows with missing or invalid values
+    and rows dated in the future (mirrors `PowerConsumption.validate_future_dates`).
+
+    Returns:
+        list: `(row_number, reading)` tuples for the rows that parsed correctly.
+    """
+    now = now_datetime()
+    parsed = []
+
+    for row_number, row in enumerate(rows, start=first_row_number):
+        if all(_is_blank(value) for value in row.values()):
+            continue
+
+        customer = row.get("customer") or default_customer
+        if _is_blank(customer) or any(_is_blank(row.get(field)) for field in REQUIRED_COLUMNS):
+            add_error(errors, row_number, _("Customer, date, KW and KWH are mandatory"))
+            continue
+
+        try:
+            reading = frappe._dict(
+                customer=str(customer).strip(),
+                date=get_datetime(row["date"]),
+                kwh=flt(float(row["kwh"]), 2),
+                kwh__=flt(float(row["kwh__"]), 2),
+                meter_channel=str(row.get("meter_channel") or DEFAULT_METER_CHANNEL).strip(),
+            )
+        except (TypeError, ValueError):
+            add_error(errors, row_number, _("Invalid date or number"))
+            continue
+
+        if reading.date > now:
+            add_error(errors, row_number, _("Power consumption can not be recorded for future dates"))
+            continue
+
+        reading.reading_key = make_reading_key(reading.customer, reading.date, reading.meter_channel)
+        parsed.append((row_number, reading))
+
+    return parsed
+
+
+def get_existing_readings(readings):
+    """
+    Fetches the reading keys of a batch that are already taken, in one query
+    served by the unique `reading_key` index.
+    """
+    if not readings:
+        return set()
+
+    return set(frappe.db.sql_list(
+        "SELECT reading_key FROM `tabPower Consumption` WHERE reading_key IN %s",
+        (tuple(reading.reading_key for reading in readings),),
+    ))
+
+
+def validate_readings(rows, first_row_number, default_customer, errors, seen, user=None):
+    """
+    Validates a chunk of rows in bulk: one query each for the referenced customers,
+    potential duplicates and packed months, instead of one `frappe.db.exists` per record.
+    Rows of customers the importing user can not read are rejected, as in `ingest_readings`.
+
+    Args:
+        rows (list): Raw rows from `read_rows`.
+        first_row_number (int): File row number of the first row in the chunk.
+        default_customer (str): Customer used when the file has no customer column.
+        errors (list): Collects `{row, message}` entries for rejected rows.
+        seen (set): Reading keys already accepted earlier in the same file.
+        user (str, optional): User the readings are imported for, the session user by default.
+
+    Returns:
+        list: The readings that can be inserted.
+    """
+    parsed = parse_rows(rows, first_row_number, default_customer, errors)
+    if not parsed:
+        return []
+
+    readings = [reading for _, reading in parsed]
+    customer_names = dict(frappe.db.sql(
+        "SELECT name, full_name FROM `tabCustomer` WHERE name IN %s",
+        (tuple({reading.customer for reading in readings}),),
+    ))
+    existing = get_existing_readings(readings)
+    packed = set(frappe.db.sql_list(
+        "SELECT name FROM `tabConsumption Block` WHERE name IN %s",
+        (tuple({get_block_name(reading.customer, reading.date) for reading in readings}),),
+    ))
+    readable = {
+        customer for customer in customer_names if frappe.has_permission("Customer", "read", customer, user=user)
+    }
+
+    valid = []
+    for row_number, reading in parsed:
+        if reading.customer not in customer_names:
+            add_error(errors, row_number, _("Customer {0} does not exist").format(reading.customer))
+        elif reading.customer not in readable:
+            add_error(
+                errors, row_number, _("Not permitted to import readings for Customer {0}").format(reading.customer)
+            )
+        elif get_block_name(reading.customer, reading.date) in packed:
+            add_error(errors, row_number, _("Readings for this month are archived in a Consumption Block."))
+        elif reading.reading_key in seen or reading.reading_key in existing:
+            add_error(errors, row_number, _("A record for this date and meter channel already exists."))
+        else:
+            seen.add(reading.reading_key)
+            reading.customer_name = customer_names[reading.customer]
+            valid.append(reading)
+
+    return valid
+
+
+def insert_readings(readings):
+    """
+    Inserts submitted Power Consumption rows with multi-row INSERTs, assigning the
+    tariff and the `customer-year-instance_count` name in bulk.
+
+    Names come from the same per-customer series as `PowerConsumption.autoname`, with
+    one reservation per customer for the whole batch.
+
+    Args:
+        readings (list): Validated readings.
+    """
+    if not readings:
+        return
+
+    # Reserve in a fixed order so concurrent imports lock series rows consistently
+    next_index = {}
+    for customer, count in sorted(Counter(reading.customer for reading in readings).items()):
+        next_index[customer] = reserve_series(get_series_key(customer), count)
+
+    now = now_datetime()
+    user = frappe.session.user
+    tariffs = get_tariff_engine().classify_names([reading.date for reading in readings])
+    values = []
+    for reading, tariff in zip(readings, tariffs):
+        name = f"{reading.customer}-{reading.date.year}-{next_index[reading.customer]}"
+        next_index[reading.customer] += 1
+        values.append((
+            name, reading.customer, reading.customer_name, reading.date, reading.kwh, reading.kwh__,
+            tariff, reading.meter_channel, reading.reading_key, 1, now, now, user, user,
+        ))
+
+    frappe.db.bulk_insert("Power Consumption", INSERT_FIELDS, values, chunk_size=len(values))
+
+
+def add_error(errors, row_number, message):
+    if len(errors) < MAX_REPORTED_ERRORS:
+        errors.append({"row": row_number, "message": message})
+
+
+def import_power_consumption_file(file_path, customer=None, chunk_size=CHUNK_SIZE, progress=None, user=None):
+    """
+    Imports a meter export into Power Consumption in chunks.
+
+    Each chunk is validated in bulk, inserted as submitted records and committed. The
+    per-record submit hooks are skipped; summaries are refreshed once per month of the
+    committed chunks at the end, and the customers' running totals move by those months'
+    change. If the import stops part way, the failed chunk is rolled back first and only
+    the committed chunks are summarized.
+
+    Args:
+        file_path (str): Path of the CSV or XLSX file.
+        customer (str, optional): Customer for files without a customer column.
+        chunk_size (int, optional): Rows validated and inserted per batch.
+        progress (callable, optional): Called with the running summary after each chunk.
+        user (str, optional): User whose Customer permissions apply, the session user by default.
+
+    Returns:
+        frappe._dict: `processed`, `inserted`, `skipped` counts and the first rejected rows in `errors`.
+    """
+    summary = frappe._dict(processed=0, inserted=0, skipped=0, errors=[])
+    touched_months = set()
+    seen = set()
+
+    try:
+        for chunk in chunked(read_rows(file_path), chunk_size):
+            # Row 1 is the header
+            readings = validate_readings(chunk, summary.processed + 2, customer, summary.errors, seen, user)
+            insert_readings(readings)
+            frappe.db.commit()
+            # Only months of committed chunks are summarized
+            touched_months.update((reading.customer, reading.date.year, reading.date.month) for reading in readings)
+
+            summary.processed += len(chunk)
+            summary.inserted += len(readings)
+            summary.skipped = summary.processed - summary.inserted
+
+            if progress:
+                progress(summary)
+    except Exception:
+        frappe.db.rollback()
+        refresh_consumption_summaries(touched_months)
+        frappe.db.commit()
+        raise
+
+    refresh_consumption_summaries(touched_months)
+    frappe.db.commit()
+    return summary
+
+
+def run_power_consumption_import(file_path, customer=None, user=None):
+    """Background job wrapper that publishes progress to the user who started the import."""
+
+    def publish(summary):
+        frappe.publish_realtime("power_consumption_import_progress", summary, user=user)
+
+    summary = import_power_consumption_file(file_path, customer=customer, progress=publish, user=user)
+    frappe.publish_realtime("power_consumption_import_complete", summary, user=user)
+    return summary
+
+
+@frappe.whitelist()
+def start_power_consumption_import(file_url, customer=None):
+    """
+    Queues the import of an uploaded CSV/XLSX meter export.
+
+    Args:
+        file_url (str): URL of the uploaded File.
+        customer (str, optional): Customer for files without a customer column.
+
+    Returns:
+        dict: The id of the background job. Progress is published on the
+        `power_consumption_import_progress` realtime event.
+    """
+    frappe.has_permission("Power Consumption", "create", throw=True)
+    frappe.has_permission("Power Consumption", "submit", throw=True)
+    if customer:
+        frappe.has_permission("Customer", "read", customer, throw=True)
+
+    file_doc = frappe.get_doc("File", {"file_url": file_url})
+    file_doc.check_permission("read")
+    job = frappe.enqueue(
+        "test_abraham.utils.bulk_import.run_power_consumption_import",
+        queue="long",
+        timeout=60 * 60,
+        file_path=file_doc.get_full_path(),
+        customer=customer,
+        user=frappe.session.user,
+    )
+    return {"job_id": job.id}
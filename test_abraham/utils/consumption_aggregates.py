@@ -0,0 +1,470 @@
+import hashlib
+from datetime import timedelta
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, add_months, cint, get_datetime, get_first_day, getdate, now_datetime
+
+from test_abraham.utils.consumption_blocks import get_block_day_totals, get_block_range_totals
+
+
+# Aggregate doctype and name format per granularity
+AGGREGATE_DOCTYPES = {
+    "Day": "Daily Consumption Aggregate",
+    "Month": "Monthly Consumption Aggregate",
+}
+PERIOD_FORMATS = {
+    "Day": "%Y-%m-%d",
+    "Month": "%Y-%m",
+}
+# Seconds to wait for another writer of the same customer-month
+LOCK_TIMEOUT = 30
+
+
+def get_period(date, granularity):
+    """First day of the day or month bucket a date falls into."""
+    return getdate(date) if granularity == "Day" else get_first_day(date)
+
+
+def get_aggregate_name(customer, period, tariff, granularity="Month"):
+    """Builds the deterministic name of an aggregate row: `customer-YYYY-MM[-DD]-tariff`."""
+    return f"{customer}-{getdate(period).strftime(PERIOD_FORMATS[granularity])}-{tariff or ''}"
+
+
+def get_month_range(year, month):
+    """Returns the first day of the month and the first day of the following month."""
+    start = getdate(f"{year}-{str(month).zfill(2)}-01")
+    return start, add_months(start, 1)
+
+
+def lock_customer_month(customer, date, timeout=LOCK_TIMEOUT):
+    """
+    Serializes the writers of a customer-month's aggregates and ROI Calculation with a
+    MariaDB named lock, held until the current transaction commits or rolls back.
+
+    Without it two submits in different tariff bands would each lock their own aggregate
+    row and then wait for the other's when reading the month's totals.
+    """
+    locks = frappe.flags.setdefault("customer_month_locks", set())
+    key = "test_abraham:" + hashlib.md5(f"{customer}|{getdate(date):%Y-%m}".encode()).hexdigest()
+    if key in locks:
+        return
+
+    if not frappe.db.sql("SELECT GET_LOCK(%s, %s)", (key, timeout))[0][0]:
+        frappe.throw(
+            _("Consumption of {0} for {1} is being updated by another process, please try again").format(
+                customer, getdate(date).strftime("%B %Y")
+            ),
+            frappe.QueryTimeoutError,
+        )
+
+    if not locks:
+        frappe.db.after_commit.add(release_customer_month_locks)
+        frappe.db.after_rollback.add(release_customer_month_locks)
+    locks.add(key)
+
+
+def release_customer_month_locks():
+    for key in frappe.flags.pop("customer_month_locks", None) or ():
+        frappe.db.sql("SELECT RELEASE_LOCK(%s)", (key,))
+
+
+def apply_reading(customer, date, tariff, kw, kwh, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) a single reading from the daily and monthly
+    aggregates of its customer, one atomic statement per granularity.
+
+    Submitting upserts the rows with `INSERT ... ON DUPLICATE KEY UPDATE` so concurrent
+    submits never lose an increment; minimum and maximum only widen. Cancelling
+    decrements the existing rows and, since an extreme may have been removed, re-reads
+    the minimum and maximum of the reading's day and month.
+    """
+    now = now_datetime()
+    for granularity, doctype in AGGREGATE_DOCTYPES.items():
+        period = get_period(date, granularity)
+        values = {
+            "name": get_aggregate_name(customer, period, tariff, granularity),
+            "customer": customer,
+            "period": period,
+            "tariff": tariff or "",
+            "kw": sign * (kw or 0),
+            "kwh": sign * (kwh or 0),
+            "now": now,
+            "user": frappe.session.user,
+        }
+
+        if sign > 0:
+            frappe.db.sql(
+                f"""
+                INSERT INTO `tab{doctype}`
+                    (name, customer, period, tariff, reading_count, kw_sum, kwh_sum,
+                    kw_min, kw_max, kwh_min, kwh_max, creation, modified, owner, modified_by, docstatus)
+                VALUES
+                    (%(name)s, %(customer)s, %(period)s, %(tariff)s, 1, %(kw)s, %(kwh)s,
+                    %(kw)s, %(kw)s, %(kwh)s, %(kwh)s, %(now)s, %(now)s, %(user)s, %(user)s, 0)
+                ON DUPLICATE KEY UPDATE
+                    reading_count = reading_count + 1,
+                    kw_sum = kw_sum + VALUES(kw_sum),
+                    kwh_sum = kwh_sum + VALUES(kwh_sum),
+                    kw_min = LEAST(IFNULL(kw_min, VALUES(kw_min)), VALUES(kw_min)),
+                    kw_max = GREATEST(IFNULL(kw_max, VALUES(kw_max)), VALUES(kw_max)),
+                    kwh_min = LEAST(IFNULL(kwh_min, VALUES(kwh_min)), VALUES(kwh_min)),
+                    kwh_max = GREATEST(IFNULL(kwh_max, VALUES(kwh_max)), VALUES(kwh_max)),
+                    modified = VALUES(modified),
+                    modified_by = VALUES(modified_by)
+                """,
+                values,
+            )
+        else:
+            frappe.db.sql(
+                f"""
+                UPDATE `tab{doctype}`
+                SET
+                    reading_count = reading_count - 1,
+                    kw_sum = kw_sum + %(kw)s,
+                    kwh_sum = kwh_sum + %(kwh)s,
+                    modified = %(now)s,
+                    modified_by = %(user)s
+                WHERE name = %(name)s
+                """,
+                values,
+            )
+
+    if sign < 0:
+        refresh_extremes(customer, date, tariff)
+
+
+def refresh_extremes(customer, date, tariff):
+    """
+    Re-reads the minimum and maximum of a customer's day (from its raw readings, an index
+    range on customer, docstatus and date) and month (from its daily rows) for one tariff.
+    Readings without a tariff belong to the aggregates of the empty tariff.
+    """
+    day = getdate(date)
+    month = get_first_day(day)
+    values = {
+        "customer": customer,
+        "tariff": tariff or "",
+        "day": day,
+        "next_day": add_days(day, 1),
+        "month": month,
+        "next_month": add_months(month, 1),
+        "day_name": get_aggregate_name(customer, day, tariff, "Day"),
+        "month_name": get_aggregate_name(customer, month, tariff, "Month"),
+    }
+
+    frappe.db.sql(
+        """
+        UPDATE `tabDaily Consumption Aggregate` agg, (
+            SELECT MIN(kwh) AS kw_min, MAX(kwh) AS kw_max, MIN(kwh__) AS kwh_min, MAX(kwh__) AS kwh_max
+            FROM `tabPower Consumption`
+            WHERE customer = %(customer)s AND IFNULL(tarriff, '') = %(tariff)s
+            AND date >= %(day)s AND date < %(next_day)s AND docstatus = 1
+        ) raw
+        SET agg.kw_min = raw.kw_min, agg.kw_max = raw.kw_max,
+            agg.kwh_min = raw.kwh_min, agg.kwh_max = raw.kwh_max
+        WHERE agg.name = %(day_name)s
+        """,
+        values,
+    )
+    frappe.db.sql(
+        """
+        UPDATE `tabMonthly Consumption Aggregate` agg, (
+            SELECT MIN(kw_min) AS kw_min, MAX(kw_max) AS kw_max, MIN(kwh_min) AS kwh_min, MAX(kwh_max) AS kwh_max
+            FROM `tabDaily Consumption Aggregate`
+            WHERE customer = %(customer)s AND tariff = %(tariff)s
+            AND period >= %(month)s AND period < %(next_month)s AND reading_count > 0
+        ) daily
+        SET agg.kw_min = daily.kw_min, agg.kw_max = daily.kw_max,
+            agg.kwh_min = daily.kwh_min, agg.kwh_max = daily.kwh_max
+        WHERE agg.name = %(month_name)s
+        """,
+        values,
+    )
+
+
+def rebuild_month(customer, year, month):
+    """
+    Recomputes the daily and monthly aggregates of one customer-month from the submitted
+    Power Consumption records. Used for backfills and after bulk writes that bypass the
+    document lifecycle.
+    """
+    start, end = get_month_range(year, month)
+    values = {"customer": customer, "start": start, "end": end, "user": frappe.session.user}
+
+    for doctype in AGGREGATE_DOCTYPES.values():
+        frappe.db.sql(
+            f"""
+            DELETE FROM `tab{doctype}`
+            WHERE customer = %(customer)s AND period >= %(start)s AND period < %(end)s
+            """,
+            values,
+        )
+
+    rollup_days("customer = %(customer)s AND date >= %(start)s AND date < %(end)s", values)
+    insert_day_totals(get_block_day_totals([customer], start, end))
+    rollup_months("customer = %(customer)s AND period >= %(start)s AND period < %(end)s", values)
+
+
+def backfill_aggregates(customer=None, from_date=None, to_date=None):
+    """
+    Rebuilds the aggregates month by month for the customer-months that have submitted
+    records or a Consumption Block, committing after each month so no long transaction is held.
+
+    Returns:
+        int: Number of customer-months rebuilt.
+    """
+    conditions = ["docstatus = 1", "date IS NOT NULL"]
+    block_conditions = ["1 = 1"]
+    if customer:
+        conditions.append("customer = %(customer)s")
+        block_conditions.append("customer = %(customer)s")
+    if from_date:
+        conditions.append("date >= %(from_date)s")
+        block_conditions.append("period >= %(from_date)s")
+    if to_date:
+        conditions.append("date < %(to_date)s")
+        block_conditions.append("period < %(to_date)s")
+
+    months = frappe.db.sql(
+        f"""
+        SELECT DISTINCT customer, YEAR(date), MONTH(date)
+        FROM `tabPower Consumption`
+        WHERE {" AND ".join(conditions)}
+        UNION
+        SELECT customer, YEAR(period), MONTH(period)
+        FROM `tabConsumption Block`
+        WHERE {" AND ".join(block_conditions)}
+        """,
+        {"customer": customer, "from_date": get_first_day(from_date) if from_date else None,
+            "to_date": add_months(get_first_day(to_date), 1) if to_date else None},
+    )
+
+    for month_customer, year, month in months:
+        rebuild_month(month_customer, year, month)
+        frappe.db.commit()
+
+    return len(months)
+
+
+def rebuild_all_aggregates():
+    """Rebuilds every daily and monthly aggregate from the submitted records."""
+    for doctype in AGGREGATE_DOCTYPES.values():
+        frappe.db.sql(f"DELETE FROM `tab{doctype}`")
+
+    values = {"user": frappe.session.user}
+    rollup_days("date IS NOT NULL", values)
+    insert_day_totals(get_block_day_totals())
+    rollup_months("1 = 1", values)
+
+
+def rollup_days(condition, values):
+    """Builds daily aggregate rows from the submitted Power Consumption records matching `condition`."""
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabDaily Consumption Aggregate`
+            (name, customer, period, tariff, reading_count, kw_sum, kwh_sum,
+            kw_min, kw_max, kwh_min, kwh_max, creation, modified, owner, modified_by, docstatus)
+        SELECT
+            CONCAT(customer, '-', DATE_FORMAT(date, '%%Y-%%m-%%d'), '-', IFNULL(tarriff, '')),
+            customer, DATE(date), IFNULL(tarriff, ''), COUNT(*), SUM(kwh), SUM(kwh__),
+            MIN(kwh), MAX(kwh), MIN(kwh__), MAX(kwh__), NOW(6), NOW(6), %(user)s, %(user)s, 0
+        FROM `tabPower Consumption`
+        WHERE docstatus = 1 AND {condition}
+        GROUP BY customer, DATE(date), IFNULL(tarriff, '')
+        """,
+        values,
+    )
+
+
+def insert_day_totals(rows):
+    """
+    Adds precomputed per-day totals, such as those of packed Consumption Blocks, to the
+    daily aggregates with one multi-row upsert.
+    """
+    if not rows:
+        return
+
+    now = now_datetime()
+    user = frappe.session.user
+    fields = ("name", "customer", "period", "tariff", "reading_count", "kw_sum", "kwh_sum",
+        "kw_min", "kw_max", "kwh_min", "kwh_max", "creation", "modified", "owner", "modified_by", "docstatus")
+    values = [
+        (get_aggregate_name(row.customer, row.period, row.tariff, "Day"), row.customer, row.period, row.tariff,
+            row.reading_count, row.kw_sum, row.kwh_sum, row.kw_min, row.kw_max, row.kwh_min, row.kwh_max,
+            now, now, user, user, 0)
+        for row in rows
+    ]
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabDaily Consumption Aggregate` ({", ".join(fields)})
+        VALUES {", ".join(["(" + ", ".join(["%s"] * len(fields)) + ")"] * len(values))}
+        ON DUPLICATE KEY UPDATE
+            reading_count = reading_count + VALUES(reading_count),
+            kw_sum = kw_sum + VALUES(kw_sum),
+            kwh_sum = kwh_sum + VALUES(kwh_sum),
+            kw_min = LEAST(kw_min, VALUES(kw_min)),
+            kw_max = GREATEST(kw_max, VALUES(kw_max)),
+            kwh_min = LEAST(kwh_min, VALUES(kwh_min)),
+            kwh_max = GREATEST(kwh_max, VALUES(kwh_max))
+        """,
+        [value for row in values for value in row],
+    )
+
+
+def rollup_months(condition, values):
+    """Builds monthly aggregate rows from the daily aggregate rows matching `condition`."""
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabMonthly Consumption Aggregate`
+            (name, customer, period, tariff, reading_count, kw_sum, kwh_sum,
+            kw_min, kw_max, kwh_min, kwh_max, creation, modified, owner, modified_by, docstatus)
+        SELECT
+            CONCAT(customer, '-', DATE_FORMAT(period, '%%Y-%%m'), '-', tariff),
+            customer, DATE_FORMAT(period, '%%Y-%%m-01'), tariff, SUM(reading_count), SUM(kw_sum), SUM(kwh_sum),
+            MIN(kw_min), MAX(kw_max), MIN(kwh_min), MAX(kwh_max), NOW(6), NOW(6), %(user)s, %(user)s, 0
+        FROM `tabDaily Consumption Aggregate`
+        WHERE {condition}
+        GROUP BY customer, DATE_FORMAT(period, '%%Y-%%m'), tariff
+        """,
+        values,
+    )
+
+
+def get_month_totals(customer, year, month, for_update=False):
+    """
+    Reads the maintained aggregates of a customer-month. With `for_update` the rows are
+    read with a locking read, which sees changes committed after the transaction began.
+
+    Returns:
+        frappe._dict: `reading_count`, `kw_sum`, `kwh_sum` for the whole month and a
+        `tariffs` mapping of tariff -> `{reading_count, kwh_sum}`.
+    """
+    start, _ = get_month_range(year, month)
+    rows = frappe.db.sql(
+        """
+        SELECT tariff, reading_count, kw_sum, kwh_sum
+        FROM `tabMonthly Consumption Aggregate`
+        WHERE customer = %s AND period = %s
+        """ + (" FOR UPDATE" if for_update else ""),
+        (customer, start),
+        as_dict=True,
+    )
+
+    totals = frappe._dict(reading_count=0, kw_sum=0.0, kwh_sum=0.0, tariffs={})
+    for row in rows:
+        totals.reading_count += row.reading_count
+        totals.kw_sum += row.kw_sum
+        totals.kwh_sum += row.kwh_sum
+        totals.tariffs[row.tariff] = frappe._dict(reading_count=row.reading_count, kwh_sum=row.kwh_sum)
+
+    return totals
+
+
+def get_range_totals(from_date=None, to_date=None, customer=None):
+    """
+    Sums submitted consumption per customer between two datetimes (both inclusive).
+
+    Whole months inside the range are read from the monthly aggregates, remaining whole
+    days from the daily aggregates, and only the partial days at either edge from the
+    raw Power Consumption records. A partial day in a month archived without its readings
+    is counted as a whole day from the block's day summaries, and the customer's totals
+    then have `widened` set.
+
+    Args:
+        from_date (str or datetime, optional): Start of the range, unbounded if empty.
+        to_date (str or datetime, optional): End of the range, unbounded if empty.
+        customer (str, optional): Restrict the totals to one customer.
+
+    Returns:
+        dict: customer -> `{reading_count, kw_sum, kwh_sum, widened}`.
+    """
+    from_date = get_datetime(from_date) if from_date else None
+    to_date = get_datetime(to_date) if to_date else None
+    totals = {}
+
+    # Whole days covered by the range: [first_day, end_day)
+    first_day = end_day = None
+    if from_date:
+        first_day = getdate(from_date) if from_date == get_datetime(getdate(from_date)) else add_days(getdate(from_date), 1)
+    if to_date:
+        end_day = getdate(to_date + timedelta(seconds=1))
+
+    if first_day and end_day and first_day >= end_day:
+        _add_totals(totals, _query_raw(from_date, to_date, customer))
+        return totals
+
+    if from_date and from_date < get_datetime(first_day):
+        _add_totals(totals, _query_raw(from_date, get_datetime(first_day), customer, end_inclusive=False))
+    if to_date and get_datetime(end_day) <= to_date:
+        _add_totals(totals, _query_raw(get_datetime(end_day), to_date, customer))
+
+    # Whole months covered by the whole days: [first_month, end_month)
+    first_month = None
+    if first_day:
+        first_month = first_day if first_day.day == 1 else add_months(get_first_day(first_day), 1)
+    end_month = get_first_day(end_day) if end_day else None
+
+    if first_month is None or end_month is None or first_month < end_month:
+        _add_totals(totals, _query_aggregates("Month", first_month, end_month, customer))
+        if first_day and first_day < first_month:
+            _add_totals(totals, _query_aggregates("Day", first_day, first_month, customer))
+        if end_day and end_month < end_day:
+            _add_totals(totals, _query_aggregates("Day", end_month, end_day, customer))
+    else:
+        _add_totals(totals, _query_aggregates("Day", first_day, end_day, customer))
+
+    return totals
+
+
+def _query_aggregates(granularity, start, end, customer):
+    conditions = ["reading_count > 0"]
+    if start:
+        conditions.append("period >= %(start)s")
+    if end:
+        conditions.append("period < %(end)s")
+    if customer:
+        conditions.append("customer = %(customer)s")
+
+    return frappe.db.sql(
+        f"""
+        SELECT customer, SUM(reading_count) AS reading_count, SUM(kw_sum) AS kw_sum, SUM(kwh_sum) AS kwh_sum
+        FROM `tab{AGGREGATE_DOCTYPES[granularity]}`
+        WHERE {" AND ".join(conditions)}
+        GROUP BY customer
+        """,
+        {"start": start, "end": end, "customer": customer},
+        as_dict=True,
+    )
+
+
+def _query_raw(start, end, customer, end_inclusive=True):
+    return _query_readings(start, end, customer, end_inclusive) + get_block_range_totals(
+        start, end, customer, end_inclusive
+    )
+
+
+def _query_readings(start, end, customer, end_inclusive=True):
+    conditions = ["docstatus = 1", "date >= %(start)s", "date <= %(end)s" if end_inclusive else "date < %(end)s"]
+    if customer:
+        conditions.append("customer = %(customer)s")
+
+    return frappe.db.sql(
+        f"""
+        SELECT customer, COUNT(*) AS reading_count, SUM(kwh) AS kw_sum, SUM(kwh__) AS kwh_sum
+        FROM `tabPower Consumption`
+        WHERE {" AND ".join(conditions)}
+        GROUP BY customer
+        """,
+        {"start": start, "end": end, "customer": customer},
+        as_dict=True,
+    )
+
+
+def _add_totals(totals, rows):
+    for row in rows:
+        entry = totals.setdefault(row.customer, frappe._dict(reading_count=0, kw_sum=0.0, kwh_sum=0.0, widened=0))
+        entry.reading_count += row.reading_count or 0
+        entry.kw_sum += row.kw_sum or 0
+        entry.kwh_sum += row.kwh_sum or 0
+        entry.widened = entry.widened or cint(row.get("widened"))
@@ -0,0 +1,540 @@
+import os
+import re
+import time
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import add_days, add_months, get_datetime, get_first_day, getdate, nowdate
+
+from test_abraham.solar_cell_company.doctype.solar_cell_settings.solar_cell_settings import get_settings
+
+
+STORAGE_DOCUMENTS = "Documents"
+STORAGE_BLOCKS = "Blocks"
+BLOCK_DIRECTORY = "consumption_blocks"
+
+# Arrays of a block file; `tariff` and `meter_channel` are codes into `tariffs` and `meter_channels`
+BLOCK_ARRAYS = ("date", "kw", "kwh", "tariff", "tariffs", "meter_channel", "meter_channels")
+DEMAND_FIELDS = ("peak_kw", "peak_time", "load_factor", "p95_kw")
+PACK_JOB_ID = "test_abraham:pack_closed_months"
+# Seconds a packing job runs before it queues the remaining months as a new job
+PACK_TIME_LIMIT = 20 * 60
+
+
+def get_block_name(customer, date):
+    """Name of the Consumption Block holding a customer's month: `customer-YYYY-MM`."""
+    return f"{customer}-{getdate(date).strftime('%Y-%m')}"
+
+
+def get_block_path(customer, period):
+    """
+    A fresh path for a block file, relative to the site's private files. Every pack writes
+    a new file, so a rolled back pack never leaves the index pointing at changed data.
+    """
+    folder = re.sub(r"[^\w.-]", "_", customer)
+    period = getdate(period).strftime("%Y-%m")
+    return os.path.join(BLOCK_DIRECTORY, folder, f"{period}-{frappe.generate_hash(length=8)}.npz")
+
+
+def get_full_path(file_path):
+    return frappe.get_site_path("private", "files", file_path)
+
+
+def delete_block_file(file_path):
+    if file_path and os.path.exists(get_full_path(file_path)):
+        os.remove(get_full_path(file_path))
+
+
+def is_packed(customer, date):
+    return bool(frappe.db.exists("Consumption Block", get_block_name(customer, date)))
+
+
+def validate_not_packed(customer, date):
+    """Rejects new readings for a month whose readings were already packed into a block."""
+    if is_packed(customer, date):
+        frappe.throw(
+            _("Readings of {0} for {1} are archived in a Consumption Block and can not be changed").format(
+                customer, getdate(date).strftime("%B %Y")
+            )
+        )
+
+
+def pack_month(customer, year, month, keep_file=None):
+    """
+    Archives the submitted readings of a customer-month into a Consumption Block.
+
+    The block keeps the month's totals, demand figures (peak, load factor, 95th percentile
+    KW) and per-day and tariff totals, from which the aggregates and the ROI Calculation
+    are rebuilt without the readings. With `keep_file` the readings are also written as
+    columns (timestamps, KW, KWH, tariff and meter channel codes) to a compressed NPZ
+    file, merged with the month's existing file if any. The readings are then deleted from
+    `tabPower Consumption` in one statement. The daily and monthly aggregates and the ROI
+    Calculation already cover the readings and stay as is.
+
+    The customer-month lock of `lock_customer_month` is taken first, in the same order as
+    submits and recalculations take it, and the month's readings are then read with
+    `FOR UPDATE`, so a reading cancelled or added meanwhile waits for the pack instead
+    of being lost; the locks cover one month only.
+
+    Args:
+        keep_file (bool, optional): Write the readings file. By default unless *Keep
+            Summaries Only* is set in Solar Cell Settings.
+
+    Returns:
+        str: Name of the Consumption Block, or None if the month has no readings.
+    """
+    # Imported here: consumption_aggregates reads block totals through this module
+    from test_abraham.utils.consumption_aggregates import lock_customer_month
+
+    if keep_file is None:
+        keep_file = not get_settings().summaries_only
+
+    start = getdate(f"{year}-{str(month).zfill(2)}-01")
+    lock_customer_month(customer, start)
+    values = {"customer": customer, "start": start, "end": add_months(start, 1)}
+    rows = frappe.db.sql(
+        """
+        SELECT date, kwh, kwh__, IFNULL(tarriff, ''), IFNULL(meter_channel, '')
+        FROM `tabPower Consumption`
+        WHERE customer = %(customer)s AND docstatus = 1 AND date >= %(start)s AND date < %(end)s
+        ORDER BY date
+        FOR UPDATE
+        """,
+        values,
+    )
+
+    name = get_block_name(customer, start)
+    previous = frappe.db.get_value("Consumption Block", name, ["name", "file_path"], as_dict=True)
+    if not rows:
+        return name if previous else None
+    if previous and not previous.file_path:
+        frappe.throw(
+            _("Readings of {0} for {1} were archived without a file and can not be merged").format(
+                customer, start.strftime("%B %Y")
+            )
+        )
+
+    block = _from_rows(rows)
+    if previous:
+        block = _concatenate(read_block_file(previous.file_path), block)
+
+    index_values = {
+        "reading_count": len(block.date),
+        "kw_sum": float(block.kw.sum()),
+        "kwh_sum": float(block.kwh.sum()),
+        "first_reading": block.date[0].item(),
+        "last_reading": block.date[-1].item(),
+        "file_path": None,
+        "file_size": 0,
+        **get_month_demand(block),
+    }
+    if keep_file:
+        file_path = get_block_path(customer, start)
+        index_values.update(file_path=file_path, file_size=write_block_file(file_path, block))
+        frappe.db.after_rollback.add(lambda: delete_block_file(file_path))
+
+    days = summarize_days(block)
+    if previous:
+        doc = frappe.get_doc("Consumption Block", name)
+        doc.update(index_values)
+        doc.set("days", days)
+        doc.save(ignore_permissions=True)
+        frappe.db.after_commit.add(lambda: delete_block_file(previous.file_path))
+    else:
+        frappe.get_doc({
+            "doctype": "Consumption Block",
+            "customer": customer,
+            "period": start,
+            "days": days,
+            **index_values,
+        }).insert(ignore_permissions=True)
+
+    frappe.db.sql(
+        """
+        DELETE FROM `tabPower Consumption`
+        WHERE customer = %(customer)s AND docstatus = 1 AND date >= %(start)s AND date < %(end)s
+        """,
+        values,
+    )
+    return name
+
+
+def pack_closed_months(time_limit=PACK_TIME_LIMIT):
+    """
+    Packs every customer-month older than the configured number of months into blocks.
+    Runs daily; does nothing unless the storage mode is Blocks.
+
+    Each month is packed and committed on its own, so locks are held for one month at a
+    time. A month that fails is rolled back and logged without stopping the others. When
+    the run exceeds `time_limit` seconds, the remaining months are left to a new job.
+
+    Returns:
+        int: Number of packed months.
+    """
+    settings = get_settings()
+    if settings.consumption_storage != STORAGE_BLOCKS:
+        return 0
+
+    cutoff = add_months(get_first_day(nowdate()), -(settings.pack_after_months or 0))
+    months = frappe.db.sql(
+        """
+        SELECT DISTINCT customer, YEAR(date), MONTH(date)
+        FROM `tabPower Consumption`
+        WHERE docstatus = 1 AND date < %s
+        """,
+        (cutoff,),
+    )
+
+    started = time.monotonic()
+    packed = 0
+    for customer, year, month in months:
+        if time.monotonic() - started > time_limit:
+            frappe.enqueue(
+                "test_abraham.utils.consumption_blocks.pack_closed_months",
+                queue="long",
+                job_id=PACK_JOB_ID,
+                deduplicate=True,
+            )
+            break
+
+        try:
+            pack_month(customer, year, month, keep_file=not settings.summaries_only)
+            frappe.db.commit()
+            packed += 1
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(title=f"Packing {customer} {year}-{month:02d} failed")
+
+    return packed
+
+
+def get_month_demand(block):
+    """Peak demand figures of the readings of a block, see `ConsumptionSeries.month_demand`."""
+    # Imported here: consumption_series reads blocks through this module
+    from test_abraham.utils.consumption_series import ConsumptionSeries
+
+    series = ConsumptionSeries.from_columns(block.date, block.kw, block.kwh, _decode(block).tariff)
+    demand = next(iter(series.month_demand().values()))
+    return {field: demand[field] for field in DEMAND_FIELDS}
+
+
+def summarize_days(block):
+    """
+    Per-day and tariff totals and extremes of the readings of a block, as Consumption
+    Block Day rows.
+
+    Returns:
+        list: `frappe._dict` rows with `period`, `tariff`, `reading_count`, `kw_sum`,
+        `kwh_sum` and the KW/KWH minimum and maximum.
+    """
+    days, day_index = np.unique(block.date.astype("datetime64[D]"), return_inverse=True)
+    tariff_count = max(len(block.tariffs), 1)
+    keys, group = np.unique(day_index * tariff_count + block.tariff, return_inverse=True)
+
+    counts = np.bincount(group)
+    sums = {column: np.bincount(group, weights=block[column]) for column in ("kw", "kwh")}
+    extremes = {}
+    for column in ("kw", "kwh"):
+        minimum = np.full(len(keys), np.inf)
+        maximum = np.full(len(keys), -np.inf)
+        np.minimum.at(minimum, group, block[column])
+        np.maximum.at(maximum, group, block[column])
+        extremes[column] = (minimum, maximum)
+
+    return [
+        frappe._dict(
+            period=days[key // tariff_count].item(),
+            tariff=str(block.tariffs[key % tariff_count]) if len(block.tariffs) else "",
+            reading_count=int(counts[i]),
+            kw_sum=float(sums["kw"][i]),
+            kwh_sum=float(sums["kwh"][i]),
+            kw_min=float(extremes["kw"][0][i]),
+            kw_max=float(extremes["kw"][1][i]),
+            kwh_min=float(extremes["kwh"][0][i]),
+            kwh_max=float(extremes["kwh"][1][i]),
+        )
+        for i, key in enumerate(keys)
+    ]
+
+
+def write_block_file(file_path, block):
+    """Writes the arrays of a block atomically and returns the file size in bytes."""
+    full_path = get_full_path(file_path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+    temporary_path = f"{full_path}.tmp"
+    with open(temporary_path, "wb") as block_file:
+        np.savez_compressed(block_file, **{array: block[array] for array in BLOCK_ARRAYS})
+    os.replace(temporary_path, full_path)
+    return os.path.getsize(full_path)
+
+
+def read_block_file(file_path):
+    """Loads the raw arrays of a block file."""
+    with np.load(get_full_path(file_path), allow_pickle=False) as data:
+        return frappe._dict({array: data[array] for array in BLOCK_ARRAYS})
+
+
+def read_block(customer, year, month):
+    """
+    Reads a packed customer-month.
+
+    Returns:
+        frappe._dict: `date` (datetime64[s]), `kw`, `kwh` (float64), `tariff` and
+        `meter_channel` (str) arrays in date order, or None if the month is not packed.
+    """
+    file_path = frappe.db.get_value(
+        "Consumption Block", get_block_name(customer, f"{year}-{str(month).zfill(2)}-01"), "file_path"
+    )
+    if not file_path:
+        return None
+    return _decode(read_block_file(file_path))
+
+
+def read_readings(customer, from_date=None, to_date=None):
+    """
+    Reads a customer's submitted readings between two datetimes (both inclusive) as NumPy
+    arrays, from the Consumption Blocks and the remaining Power Consumption records alike.
+
+    Returns:
+        frappe._dict: Arrays as returned by `read_block`, in date order.
+    """
+    parts = []
+    for block in get_blocks([customer], from_date, to_date):
+        data = _decode(read_block_file(block.file_path))
+        parts.append(_slice(data, date_mask(data.date, from_date, to_date)))
+
+    conditions = ["customer = %(customer)s", "docstatus = 1", "date IS NOT NULL"]
+    if from_date:
+        conditions.append("date >= %(from_date)s")
+    if to_date:
+        conditions.append("date <= %(to_date)s")
+    rows = frappe.db.sql(
+        f"""
+        SELECT date, kwh, kwh__, IFNULL(tarriff, ''), IFNULL(meter_channel, '')
+        FROM `tabPower Consumption`
+        WHERE {" AND ".join(conditions)}
+        ORDER BY date
+        """,
+        {"customer": customer, "from_date": from_date, "to_date": to_date},
+    )
+    if rows or not parts:
+        parts.append(_decode(_from_rows(rows)))
+
+    readings = frappe._dict({name: np.concatenate([part[name] for part in parts]) for name in parts[0]})
+    return _slice(readings, np.argsort(readings.date, kind="stable"))
+
+
+def get_blocks(customers=None, from_date=None, to_date=None, with_file=True):
+    """
+    Consumption Blocks with a readings file whose month overlaps the datetime range (both
+    ends inclusive). Months archived without a file only have their summaries and are
+    returned instead with `with_file=False`.
+    """
+    conditions = ["IFNULL(file_path, '') != ''" if with_file else "IFNULL(file_path, '') = ''"]
+    if customers:
+        conditions.append("customer IN %(customers)s")
+    if from_date:
+        conditions.append("period >= %(from_period)s")
+    if to_date:
+        conditions.append("period <= %(to_date)s")
+
+    return frappe.db.sql(
+        f"""
+        SELECT name, customer, period, file_path
+        FROM `tabConsumption Block`
+        WHERE {" AND ".join(conditions)}
+        ORDER BY customer, period
+        """,
+        {
+            "customers": tuple(customers or ()),
+            "from_period": get_first_day(from_date) if from_date else None,
+            "to_date": get_datetime(to_date) if to_date else None,
+        },
+        as_dict=True,
+    )
+
+
+def validate_readings_kept(customers, from_date=None, to_date=None):
+    """
+    Throws if the readings of a customer in the datetime range were archived without a
+    file, so callers that need the readings themselves do not silently miss those months.
+    """
+    blocks = get_blocks(customers, from_date, to_date, with_file=False)
+    if blocks:
+        frappe.throw(
+            _("The readings of {0} were archived with their summaries only. Choose a range outside these months.").format(
+                ", ".join(f"{block.customer} ({block.period:%B %Y})" for block in blocks)
+            ),
+            title=_("Readings Not Available"),
+        )
+
+
+def get_block_day_totals(customers=None, start=None, end=None):
+    """
+    Per-day and tariff totals and extremes of the packed readings in months `[start, end)`,
+    shaped like Daily Consumption Aggregate rows. They are read from the blocks' stored
+    day summaries, so no file is opened and months archived without a file are included.
+
+    Returns:
+        list: `frappe._dict` rows with `customer`, `period`, `tariff`, `reading_count`,
+        `kw_sum`, `kwh_sum` and the KW/KWH minimum and maximum.
+    """
+    conditions = _block_conditions(customers, start, end)
+    return frappe.db.sql(
+        f"""
+        SELECT block.customer, day.period, IFNULL(day.tariff, '') AS tariff, day.reading_count,
+            day.kw_sum, day.kwh_sum, day.kw_min, day.kw_max, day.kwh_min, day.kwh_max
+        FROM `tabConsumption Block Day` day
+        JOIN `tabConsumption Block` block ON block.name = day.parent
+        WHERE day.parenttype = 'Consumption Block' AND {" AND ".join(conditions)}
+        ORDER BY block.customer, day.period
+        """,
+        {"customers": tuple(customers or ()), "start": get_first_day(start) if start else None, "end": end},
+        as_dict=True,
+    )
+
+
+def get_archived_demand(customers=None, start=None, end=None):
+    """
+    Stored demand figures of the months in `[start, end)` archived without a readings
+    file, which `ConsumptionSeries` can not load.
+
+    Returns:
+        dict: `(customer, year, month)` -> values of `DEMAND_FIELDS`.
+    """
+    conditions = [*_block_conditions(customers, start, end), "IFNULL(block.file_path, '') = ''"]
+    blocks = frappe.db.sql(
+        f"""
+        SELECT block.customer, block.period, {", ".join(f"block.{field}" for field in DEMAND_FIELDS)}
+        FROM `tabConsumption Block` block
+        WHERE {" AND ".join(conditions)}
+        """,
+        {"customers": tuple(customers or ()), "start": get_first_day(start) if start else None, "end": end},
+        as_dict=True,
+    )
+    return {
+        (block.customer, block.period.year, block.period.month): frappe._dict(
+            {field: block[field] for field in DEMAND_FIELDS}
+        )
+        for block in blocks
+    }
+
+
+def _block_conditions(customers=None, start=None, end=None):
+    conditions = ["1 = 1"]
+    if customers:
+        conditions.append("block.customer IN %(customers)s")
+    if start:
+        conditions.append("block.period >= %(start)s")
+    if end:
+        conditions.append("block.period < %(end)s")
+    return conditions
+
+
+def get_block_range_totals(from_date, to_date, customer=None, end_inclusive=True):
+    """
+    Per-customer totals of the packed readings between two datetimes, shaped like the
+    raw reading totals used by `get_range_totals`.
+
+    Months archived without a file only have day summaries, so their days in the range
+    are counted whole. Those rows have `widened` set.
+    """
+    totals = {}
+    for block in get_blocks([customer] if customer else None, from_date, to_date):
+        data = read_block_file(block.file_path)
+        mask = date_mask(data.date, from_date, to_date, end_inclusive)
+        if not mask.any():
+            continue
+
+        entry = totals.setdefault(block.customer, frappe._dict(
+            customer=block.customer, reading_count=0, kw_sum=0.0, kwh_sum=0.0,
+        ))
+        entry.reading_count += int(mask.sum())
+        entry.kw_sum += float(data.kw[mask].sum())
+        entry.kwh_sum += float(data.kwh[mask].sum())
+
+    return list(totals.values()) + get_summary_day_range_totals(from_date, to_date, customer, end_inclusive)
+
+
+def get_summary_day_range_totals(from_date, to_date, customer=None, end_inclusive=True):
+    """Per-customer totals of the stored day summaries of file-less blocks for the days the range touches."""
+    last_day = getdate(to_date)
+    if not end_inclusive and get_datetime(to_date) == get_datetime(last_day):
+        last_day = add_days(last_day, -1)
+
+    return frappe.db.sql(
+        f"""
+        SELECT block.customer, SUM(day.reading_count) AS reading_count, SUM(day.kw_sum) AS kw_sum,
+            SUM(day.kwh_sum) AS kwh_sum, 1 AS widened
+        FROM `tabConsumption Block Day` day
+        JOIN `tabConsumption Block` block ON block.name = day.parent
+        WHERE day.parenttype = 'Consumption Block' AND IFNULL(block.file_path, '') = ''
+            AND day.period BETWEEN %(first_day)s AND %(last_day)s
+            {"AND block.customer = %(customer)s" if customer else ""}
+        GROUP BY block.customer
+        """,
+        {"first_day": getdate(from_date), "last_day": last_day, "customer": customer},
+        as_dict=True,
+    )
+
+
+def _from_rows(rows):
+    """Builds block arrays from `(date, kw, kwh, tariff, meter_channel)` rows."""
+    tariffs, tariff = np.unique(np.array([row[3] for row in rows], dtype=str), return_inverse=True)
+    meter_channels, meter_channel = np.unique(np.array([row[4] for row in rows], dtype=str), return_inverse=True)
+    return frappe._dict(
+        date=np.array([row[0] for row in rows], dtype="datetime64[s]"),
+        kw=np.array([row[1] or 0 for row in rows], dtype=np.float64),
+        kwh=np.array([row[2] or 0 for row in rows], dtype=np.float64),
+        tariff=tariff.astype(np.uint8),
+        tariffs=tariffs,
+        meter_channel=meter_channel.astype(np.uint8),
+        meter_channels=meter_channels,
+    )
+
+
+def _decode(block):
+    return frappe._dict(
+        date=block.date,
+        kw=block.kw,
+        kwh=block.kwh,
+        tariff=block.tariffs[block.tariff] if len(block.tariffs) else np.array([], dtype=str),
+        meter_channel=block.meter_channels[block.meter_channel] if len(block.meter_channels) else np.array([], dtype=str),
+    )
+
+
+def _concatenate(first, second):
+    """Merges two encoded blocks into one, re-encoding the codes and keeping date order."""
+    first, second = _decode(first), _decode(second)
+    date = np.concatenate([first.date, second.date])
+    order = np.argsort(date, kind="stable")
+    tariffs, tariff = np.unique(np.concatenate([first.tariff, second.tariff]), return_inverse=True)
+    meter_channels, meter_channel = np.unique(
+        np.concatenate([first.meter_channel, second.meter_channel]), return_inverse=True
+    )
+    return frappe._dict(
+        date=date[order],
+        kw=np.concatenate([first.kw, second.kw])[order],
+        kwh=np.concatenate([first.kwh, second.kwh])[order],
+        tariff=tariff.astype(np.uint8)[order],
+        tariffs=tariffs,
+        meter_channel=meter_channel.astype(np.uint8)[order],
+        meter_channels=meter_channels,
+    )
+
+
+def date_mask(dates, from_date=None, to_date=None, end_inclusive=True):
+    mask = np.ones(len(dates), dtype=bool)
+    if from_date:
+        mask &= dates >= np.datetime64(get_datetime(from_date), "s")
+    if to_date:
+        end = np.datetime64(get_datetime(to_date), "s")
+        mask &= dates <= end if end_inclusive else dates < end
+    return mask
+
+
+def _slice(arrays, index):
+    return frappe._dict({name: values[index] for name, values in arrays.items()})
+
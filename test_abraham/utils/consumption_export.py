@@ -0,0 +1,244 @@
+import csv
+import io
+import os
+import tempfile
+
+import frappe
+from frappe import _
+from frappe.utils import get_datetime
+
+from test_abraham.utils.consumption_blocks import date_mask, get_blocks, read_block, validate_readings_kept
+
+
+EXPORT_CHUNK_SIZE = 5000
+# Power Consumption fieldnames, so an export can be imported again
+EXPORT_COLUMNS = ("customer", "date", "kwh", "kwh__", "tarriff", "meter_channel")
+FILE_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+# Bytes read from the temporary Parquet file per response chunk
+FILE_BLOCK_SIZE = 1024 * 1024
+
+
+def get_export_customers(customer=None):
+    """
+    Customers the session user may export, in name order. The list goes through
+    `frappe.get_list`, so the User Permission created by `Customer.create_user_permission`
+    and the customer permission query conditions apply.
+    """
+    frappe.has_permission("Power Consumption", "read", throw=True)
+    customers = frappe.get_list(
+        "Customer", filters={"name": customer} if customer else None, pluck="name", order_by="name asc"
+    )
+    if customer and not customers:
+        frappe.throw(_("Not permitted to export the readings of {0}").format(customer), frappe.PermissionError)
+    return customers
+
+
+def iter_reading_chunks(customers, from_date=None, to_date=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the submitted readings of the customers ordered by customer and date, in
+    chunks of at most `chunk_size` rows in `EXPORT_COLUMNS` order.
+
+    Power Consumption records are read with keyset pagination on `(date, name)` through
+    the `(customer, docstatus, date)` index, each page on an unbuffered cursor, so no
+    page costs more than its own rows and memory stays flat. Months packed into a
+    Consumption Block have no records left and are emitted from their block in between.
+    """
+    for customer in customers:
+        blocks = list(get_blocks([customer], from_date, to_date))
+        last_date, last_name = None, ""
+        while True:
+            rows = fetch_page(customer, last_date, last_name, from_date, to_date, chunk_size)
+            boundary = rows[0][1] if rows else None
+            while blocks and (boundary is None or get_datetime(blocks[0].period) < boundary):
+                if block_rows := read_block_rows(customer, blocks.pop(0), from_date, to_date):
+                    yield block_rows
+
+            if not rows:
+                break
+
+            last_date, last_name = rows[-1][1], rows[-1][-1]
+            yield [row[:-1] for row in rows]
+
+
+def fetch_page(customer, last_date, last_name, from_date, to_date, limit):
+    """The next page of a customer's records after `(last_date, last_name)`, with the name as last column."""
+    conditions = ["customer = %(customer)s", "docstatus = 1", "date IS NOT NULL"]
+    if last_date:
+        conditions.append("(date > %(last_date)s OR (date = %(last_date)s AND name > %(last_name)s))")
+    if from_date:
+        conditions.append("date >= %(from_date)s")
+    if to_date:
+        conditions.append("date <= %(to_date)s")
+
+    with frappe.db.unbuffered_cursor():
+        return list(frappe.db.sql(
+            f"""
+            SELECT customer, date, kwh, kwh__, IFNULL(tarriff, ''), IFNULL(meter_channel, ''), name
+            FROM `tabPower Consumption`
+            WHERE {" AND ".join(conditions)}
+            ORDER BY date, name
+            LIMIT %(limit)s
+            """,
+            {
+                "customer": customer,
+                "last_date": last_date,
+                "last_name": last_name,
+                "from_date": from_date,
+                "to_date": to_date,
+                "limit": limit,
+            },
+            as_iterator=True,
+        ))
+
+
+def read_block_rows(customer, block, from_date=None, to_date=None):
+    """The readings of one packed month within the range, as export rows."""
+    period = get_datetime(block.period)
+    data = read_block(customer, period.year, period.month)
+    mask = date_mask(data.date, from_date, to_date)
+    return list(zip(
+        [customer] * int(mask.sum()), data.date[mask].astype(object).tolist(), data.kw[mask].tolist(),
+        data.kwh[mask].tolist(), data.tariff[mask].tolist(), data.meter_channel[mask].tolist(),
+    ))
+
+
+def iter_csv(chunks):
+    """Encodes the chunks as CSV text, one string per chunk after the header."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_parquet(chunks, path):
+    """Writes the chunks to a Parquet file, one row group per chunk. Needs `pyarrow`."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        frappe.throw(_("Parquet exports need the pyarrow package, install test_abraham[parquet]"))
+
+    schema = pa.schema([
+        ("customer", pa.string()),
+        ("date", pa.timestamp("s")),
+        ("kwh", pa.float64()),
+        ("kwh__", pa.float64()),
+        ("tarriff", pa.string()),
+        ("meter_channel", pa.string()),
+    ])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            columns = zip(*chunk)
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+
+
+def export_readings(path, customers, file_format="csv", from_date=None, to_date=None):
+    """
+    Writes the readings of the customers to a CSV or Parquet file.
+
+    Returns:
+        int: Number of exported readings.
+    """
+    validate_readings_kept(customers, from_date, to_date)
+    exported = 0
+
+    def counted(chunks):
+        nonlocal exported
+        for chunk in chunks:
+            exported += len(chunk)
+            yield chunk
+
+    chunks = counted(iter_reading_chunks(customers, from_date, to_date))
+    if file_format == "parquet":
+        write_parquet(chunks, path)
+    else:
+        with open(path, "w", newline="") as f:
+            f.writelines(iter_csv(chunks))
+    return exported
+
+
+def stream_from_own_connection(body):
+    """
+    Runs a response body generator on a database connection of its own. The request's
+    connection is closed once the handler returns, before the body is sent.
+    """
+    site, sites_path = frappe.local.site, frappe.local.sites_path
+
+    def generate():
+        initialized = not getattr(frappe.local, "site", None)
+        if initialized:
+            frappe.init(site=site, sites_path=sites_path)
+        frappe.connect(set_admin_as_user=False)
+        try:
+            yield from body
+        finally:
+            frappe.db.close()
+            if initialized:
+                frappe.destroy()
+
+    return generate()
+
+
+def iter_file(path):
+    """Sends a temporary file in blocks and deletes it afterwards."""
+    try:
+        with open(path, "rb") as f:
+            while block := f.read(FILE_BLOCK_SIZE):
+                yield block
+    finally:
+        os.remove(path)
+
+
+@frappe.whitelist()
+def export_consumption(customer=None, from_date=None, to_date=None, file_format="csv"):
+    """
+    Downloads submitted readings as a chunked HTTP response, ordered by customer and date.
+
+    CSV rows are encoded and sent page by page while the records are read. Parquet is
+    written to a temporary file one row group per page, then sent in blocks. Ranges over
+    months archived with their summaries only are rejected before anything is sent.
+
+    Args:
+        customer (str, optional): Only this customer. Without it, all permitted customers.
+        from_date (str, optional): First reading time (inclusive).
+        to_date (str, optional): Last reading time (inclusive).
+        file_format (str, optional): `csv` or `parquet`.
+
+    Returns:
+        werkzeug.wrappers.Response: The streamed file.
+    """
+    from werkzeug.wrappers import Response
+
+    if file_format not in FILE_FORMATS:
+        frappe.throw(_("File format must be one of {0}").format(", ".join(FILE_FORMATS)))
+
+    customers = get_export_customers(customer)
+    validate_readings_kept(customers, from_date, to_date)
+    filename = f"power-consumption-{customer or 'all'}.{file_format}"
+
+    if file_format == "parquet":
+        path = tempfile.NamedTemporaryFile(suffix=".parquet", delete=False).name
+        try:
+            write_parquet(iter_reading_chunks(customers, from_date, to_date), path)
+        except Exception:
+            os.remove(path)
+            raise
+        body = iter_file(path)
+    else:
+        body = stream_from_own_connection(
+            chunk.encode() for chunk in iter_csv(iter_reading_chunks(customers, from_date, to_date))
+        )
+
+    return Response(
+        body,
+        mimetype=FILE_FORMATS[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        direct_passthrough=True,
+    )
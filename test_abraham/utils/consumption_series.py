@@ -0,0 +1,274 @@
+from itertools import islice
+
+import frappe
+import numpy as np
+
+from test_abraham.utils.consumption_blocks import date_mask, get_blocks, read_block_file
+
+
+CHUNK_SIZE = 10000
+EPOCH = np.datetime64("1970-01-01T00:00:00", "s")
+READ_COLUMNS = ("date", "kw", "kwh", "tariff", "meter_channel")
+
+
+class ConsumptionSeries:
+    """
+    Readings of a customer held as parallel NumPy arrays: `timestamps` (int64 seconds since
+    the epoch, in site time), `kw` and `kwh` (float64) and `tariff` codes (uint8) into
+    `bands`. Analytics run vectorized over the arrays instead of per-row dicts.
+    """
+
+    __slots__ = ("customer", "timestamps", "kw", "kwh", "tariff", "bands")
+
+    def __init__(self, timestamps, kw, kwh, tariff=None, bands=(), customer=None):
+        self.customer = customer
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.kw = np.asarray(kw, dtype=np.float64)
+        self.kwh = np.asarray(kwh, dtype=np.float64)
+        self.tariff = (
+            np.asarray(tariff, dtype=np.uint8) if tariff is not None else np.zeros(len(self.timestamps), np.uint8)
+        )
+        self.bands = tuple(bands)
+
+    @classmethod
+    def from_columns(cls, dates, kw, kwh, tariffs, customer=None):
+        """Builds a series from datetime64 dates and tariff names, ordered by date."""
+        bands, tariff = np.unique(np.asarray(tariffs, dtype=str), return_inverse=True)
+        timestamps = (np.asarray(dates, dtype="datetime64[s]") - EPOCH).astype(np.int64)
+        order = np.argsort(timestamps, kind="stable")
+        return cls(timestamps[order], np.asarray(kw)[order], np.asarray(kwh)[order], tariff[order],
+            bands.tolist(), customer)
+
+    @classmethod
+    def load(cls, customer, from_date=None, to_date=None, chunk_size=CHUNK_SIZE, meter_channel=None):
+        """
+        Loads a customer's submitted readings between two datetimes (both inclusive).
+
+        Documents are streamed with an unbuffered cursor in chunks straight into arrays,
+        so no row dicts are built, and readings packed into Consumption Blocks are added.
+        Months archived with their summaries only have no readings to load; callers that
+        need complete readings check the range with `validate_readings_kept` first.
+
+        Without `meter_channel` the readings of all channels are merged; use
+        `load_by_channel` where the channels have to be told apart.
+        """
+        columns = read_columns(customer, from_date, to_date, chunk_size, meter_channel)
+        if not columns["date"]:
+            return cls([], [], [], customer=customer)
+
+        return cls.from_columns(
+            *(np.concatenate(columns[name]) for name in ("date", "kw", "kwh", "tariff")), customer=customer
+        )
+
+    @classmethod
+    def load_by_channel(cls, customer, from_date=None, to_date=None, chunk_size=CHUNK_SIZE):
+        """
+        Loads a customer's readings like `load` in a single pass and splits them by meter channel.
+
+        Returns:
+            dict: Meter channel -> series of that channel's readings.
+        """
+        columns = read_columns(customer, from_date, to_date, chunk_size)
+        if not columns["date"]:
+            return {}
+
+        dates, kw, kwh, tariff, channel = (np.concatenate(columns[name]) for name in READ_COLUMNS)
+        return {
+            str(name): cls.from_columns(
+                dates[channel == name], kw[channel == name], kwh[channel == name], tariff[channel == name],
+                customer=customer,
+            )
+            for name in np.unique(channel)
+        }
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def dates(self):
+        """Timestamps as datetime64[s]."""
+        return EPOCH + self.timestamps
+
+    def select(self, mask):
+        """A new series holding the readings selected by a boolean mask or index array."""
+        return ConsumptionSeries(
+            self.timestamps[mask], self.kw[mask], self.kwh[mask], self.tariff[mask], self.bands, self.customer
+        )
+
+    def between(self, from_date=None, to_date=None):
+        """Readings between two datetimes, both inclusive."""
+        return self.select(date_mask(self.dates, from_date, to_date))
+
+    def sum(self):
+        """Returns `(kw_sum, kwh_sum)`."""
+        return float(self.kw.sum()), float(self.kwh.sum())
+
+    def mean(self):
+        """Returns `(average_kw, average_kwh)`, zero for an empty series."""
+        if not len(self):
+            return 0.0, 0.0
+        return float(self.kw.mean()), float(self.kwh.mean())
+
+    def peak(self):
+        """Returns the datetime and value of the highest KW reading, or `(None, 0)` when empty."""
+        if not len(self):
+            return None, 0.0
+        index = int(np.argmax(self.kw))
+        return self.dates[index].item(), float(self.kw[index])
+
+    def split_by_tariff(self):
+        """Returns tariff band -> series of the readings in that band."""
+        return {
+            band: self.select(self.tariff == code)
+            for code, band in enumerate(self.bands)
+            if (self.tariff == code).any()
+        }
+
+    def resample(self, seconds):
+        """
+        Buckets the readings into fixed intervals starting at the epoch.
+
+        Returns:
+            tuple: Bucket start datetimes (datetime64[s]), reading counts, mean KW and
+            summed KWH per non-empty bucket.
+        """
+        buckets, group = np.unique(self.timestamps // seconds, return_inverse=True)
+        counts = np.bincount(group, minlength=len(buckets))
+        kw = np.bincount(group, weights=self.kw, minlength=len(buckets)) / np.maximum(counts, 1)
+        kwh = np.bincount(group, weights=self.kwh, minlength=len(buckets))
+        return EPOCH + buckets * seconds, counts, kw, kwh
+
+    def month_keys(self):
+        """Calendar month of each reading as datetime64[M]."""
+        return self.dates.astype("datetime64[M]")
+
+    def by_month(self):
+        """Returns `(year, month)` -> series of that month's readings."""
+        months, group = np.unique(self.month_keys(), return_inverse=True)
+        result = {}
+        for index, month in enumerate(months):
+            period = month.item()
+            result[(period.year, period.month)] = self.select(group == index)
+        return result
+
+    def month_totals(self):
+        """
+        Per-month totals shaped like `consumption_aggregates.get_month_totals`, so ROI
+        values can be derived with `get_roi_values`.
+
+        Returns:
+            dict: `(year, month)` -> `frappe._dict` of `reading_count`, `kw_sum`, `kwh_sum`
+            and `tariffs`.
+        """
+        totals = {}
+        for key, series in self.by_month().items():
+            kw_sum, kwh_sum = series.sum()
+            totals[key] = frappe._dict(
+                reading_count=len(series),
+                kw_sum=kw_sum,
+                kwh_sum=kwh_sum,
+                tariffs={
+                    band: frappe._dict(reading_count=len(band_series), kwh_sum=band_series.sum()[1])
+                    for band, band_series in series.split_by_tariff().items()
+                },
+            )
+        return totals
+
+    def month_demand(self, percentile=95):
+        """
+        Peak demand figures of each month, computed in one vectorized pass: the readings are
+        sorted once by month and KW, after which every figure is an index into the groups.
+
+        Returns:
+            dict: `(year, month)` -> `frappe._dict` of `peak_kw` (highest 15-minute KW),
+            `peak_time` (earliest reading at the peak), `load_factor` (average over peak KW)
+            and `p95_kw` (the given percentile of KW, interpolated like `numpy.percentile`).
+        """
+        if not len(self):
+            return {}
+
+        months, group = np.unique(self.month_keys(), return_inverse=True)
+        # Within a month ascending by KW, equal KW latest first, so a month's last reading is its earliest peak
+        order = np.lexsort((-self.timestamps, self.kw, group))
+        kw = self.kw[order]
+        counts = np.bincount(group, minlength=len(months))
+        ends = np.cumsum(counts)
+        starts = ends - counts
+
+        peak_kw = kw[ends - 1]
+        peak_time = self.dates[order[ends - 1]]
+        rank = starts + (counts - 1) * percentile / 100
+        lower = np.floor(rank).astype(np.int64)
+        upper = np.minimum(lower + 1, ends - 1)
+        high = kw[lower] + (kw[upper] - kw[lower]) * (rank - lower)
+        average_kw = np.bincount(group, weights=self.kw, minlength=len(months)) / counts
+        load_factor = np.divide(average_kw, peak_kw, out=np.zeros(len(months)), where=peak_kw > 0)
+
+        result = {}
+        for index, month in enumerate(months):
+            period = month.item()
+            result[(period.year, period.month)] = frappe._dict(
+                peak_kw=float(peak_kw[index]),
+                peak_time=peak_time[index].item(),
+                load_factor=float(load_factor[index]),
+                p95_kw=float(high[index]),
+            )
+        return result
+
+
+def read_columns(customer, from_date=None, to_date=None, chunk_size=CHUNK_SIZE, meter_channel=None):
+    """
+    Reads a customer's submitted readings, packed and unpacked, into lists of arrays per
+    `READ_COLUMNS` name. Readings without a meter channel belong to the default channel.
+    """
+    from test_abraham.solar_cell_company.doctype.power_consumption.power_consumption import DEFAULT_METER_CHANNEL
+
+    columns = {name: [] for name in READ_COLUMNS}
+
+    for block in get_blocks([customer], from_date, to_date):
+        data = read_block_file(block.file_path)
+        channel = data.meter_channels[data.meter_channel] if len(data.meter_channels) else np.full(len(data.date), "")
+        channel = np.where(channel == "", DEFAULT_METER_CHANNEL, channel)
+        mask = date_mask(data.date, from_date, to_date)
+        if meter_channel:
+            mask &= channel == meter_channel
+        columns["date"].append(data.date[mask])
+        columns["kw"].append(data.kw[mask])
+        columns["kwh"].append(data.kwh[mask])
+        columns["tariff"].append(data.tariffs[data.tariff[mask]] if len(data.tariffs) else np.array([], str))
+        columns["meter_channel"].append(channel[mask])
+
+    conditions = ["customer = %(customer)s", "docstatus = 1", "date IS NOT NULL"]
+    if from_date:
+        conditions.append("date >= %(from_date)s")
+    if to_date:
+        conditions.append("date <= %(to_date)s")
+    if meter_channel:
+        conditions.append("IFNULL(NULLIF(meter_channel, ''), %(default_channel)s) = %(meter_channel)s")
+
+    with frappe.db.unbuffered_cursor():
+        rows = iter(frappe.db.sql(
+            f"""
+            SELECT TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', date), IFNULL(kwh, 0), IFNULL(kwh__, 0),
+                IFNULL(tarriff, ''), IFNULL(NULLIF(meter_channel, ''), %(default_channel)s)
+            FROM `tabPower Consumption`
+            WHERE {" AND ".join(conditions)}
+            """,
+            {
+                "customer": customer,
+                "from_date": from_date,
+                "to_date": to_date,
+                "meter_channel": meter_channel,
+                "default_channel": DEFAULT_METER_CHANNEL,
+            },
+            as_iterator=True,
+        ))
+        while chunk := list(islice(rows, chunk_size)):
+            timestamps, kw, kwh, tariff, channel = zip(*chunk)
+            columns["date"].append(EPOCH + np.array(timestamps, dtype=np.int64))
+            columns["kw"].append(np.array(kw, dtype=np.float64))
+            columns["kwh"].append(np.array(kwh, dtype=np.float64))
+            columns["tariff"].append(np.array(tariff, dtype=str))
+            columns["meter_channel"].append(np.array(channel, dtype=str))
+
+    return columns
@@ -0,0 +1,278 @@
+from datetime import timedelta
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import add_days, add_months, cint, get_datetime, getdate, now_datetime
+
+from test_abraham.utils.consumption_aggregates import AGGREGATE_DOCTYPES
+from test_abraham.utils.consumption_blocks import date_mask, get_blocks, read_block_file, validate_readings_kept
+from test_abraham.utils.consumption_series import EPOCH, ConsumptionSeries
+
+
+RAW_INTERVAL = 15 * 60
+DEFAULT_MAX_POINTS = 1000
+MAX_POINTS_LIMIT = 10000
+# Bucket sizes tried from fine to coarse; "1mo" buckets by calendar month
+RESOLUTIONS = {
+    "15m": 15 * 60,
+    "30m": 30 * 60,
+    "1h": 3600,
+    "3h": 3 * 3600,
+    "6h": 6 * 3600,
+    "12h": 12 * 3600,
+    "1d": 86400,
+    "2d": 2 * 86400,
+    "1w": 7 * 86400,
+    "1mo": None,
+}
+# 1970-01-05 was the first Monday after the epoch, weekly buckets start on Mondays
+WEEK_ORIGIN = 4 * 86400
+
+
+def choose_resolution(from_date, to_date, max_points=DEFAULT_MAX_POINTS):
+    """
+    The finest resolution whose number of points over the range stays within
+    `max_points`: raw readings (one per 15 minutes), then the `RESOLUTIONS` buckets.
+    """
+    seconds = max((get_datetime(to_date) - get_datetime(from_date)).total_seconds(), 0)
+    if seconds / RAW_INTERVAL <= max_points:
+        return "raw"
+
+    for resolution, bucket_seconds in RESOLUTIONS.items():
+        if bucket_seconds and np.ceil(seconds / bucket_seconds) <= max_points:
+            return resolution
+    return "1mo"
+
+
+def needs_readings(resolution):
+    """Raw readings and buckets under a day are computed from the readings themselves."""
+    return resolution == "raw" or (RESOLUTIONS[resolution] or 86400) < 86400
+
+
+def bucket(keys, counts, kw_sum, kwh_sum, kw_max, tariff, bands):
+    """
+    Groups readings, or aggregate rows of readings, by bucket key in one vectorized pass.
+
+    Args:
+        keys (np.ndarray): Bucket key of each row (sortable, e.g. bucket start seconds).
+        counts, kw_sum, kwh_sum, kw_max (np.ndarray): Reading count, sums and highest KW per row.
+        tariff (np.ndarray): Code of each row's band in `bands`.
+        bands (sequence): Tariff band names.
+
+    Returns:
+        tuple: Sorted unique keys and a dict of parallel `reading_count`, `mean_kw`,
+        `max_kw`, `kwh` arrays and a `tariffs` dict of KWH per band.
+    """
+    keys, group = np.unique(keys, return_inverse=True)
+    size = len(keys)
+    reading_count = np.bincount(group, weights=counts, minlength=size)
+    max_kw = np.full(size, -np.inf)
+    np.maximum.at(max_kw, group, kw_max)
+    band_kwh = np.bincount(
+        tariff.astype(np.int64) * size + group, weights=kwh_sum, minlength=len(bands) * size
+    ).reshape(len(bands), size)
+
+    return keys, {
+        "reading_count": reading_count.astype(np.int64).tolist(),
+        "mean_kw": _round(np.bincount(group, weights=kw_sum, minlength=size) / np.maximum(reading_count, 1)),
+        "max_kw": _round(max_kw),
+        "kwh": _round(np.bincount(group, weights=kwh_sum, minlength=size)),
+        "tariffs": {band: _round(band_kwh[code]) for code, band in enumerate(bands) if band_kwh[code].any()},
+    }
+
+
+def get_bucketed_series(customer, from_date, to_date, resolution):
+    """
+    Buckets a customer's consumption at a resolution of `RESOLUTIONS`.
+
+    Buckets under a day are computed from the readings (`ConsumptionSeries.load`). Day,
+    week and month buckets are computed from the Daily and Monthly Consumption Aggregates,
+    one row per period and band, and cover the whole days or months at the range ends.
+    """
+    bucket_seconds = RESOLUTIONS[resolution]
+    if bucket_seconds and bucket_seconds < 86400:
+        series = ConsumptionSeries.load(customer, from_date, to_date)
+        ones = np.ones(len(series))
+        keys, values = bucket(
+            series.timestamps // bucket_seconds * bucket_seconds, ones, series.kw, series.kwh, series.kw,
+            series.tariff, series.bands,
+        )
+        return EPOCH + keys, values
+
+    granularity = "Month" if resolution == "1mo" else "Day"
+    rows = frappe.db.sql(
+        f"""
+        SELECT period, IFNULL(tariff, ''), reading_count, kw_sum, kwh_sum, kw_max
+        FROM `tab{AGGREGATE_DOCTYPES[granularity]}`
+        WHERE customer = %(customer)s AND period BETWEEN %(from_period)s AND %(to_period)s
+        """,
+        {
+            "customer": customer,
+            "from_period": getdate(from_date).replace(day=1) if granularity == "Month" else getdate(from_date),
+            "to_period": getdate(to_date),
+        },
+    )
+    periods, tariffs, counts, kw_sum, kwh_sum, kw_max = zip(*rows) if rows else ((),) * 6
+    periods = np.array(periods, dtype="datetime64[D]")
+    bands, tariff = np.unique(np.array(tariffs, dtype=str), return_inverse=True)
+    if granularity == "Month":
+        keys = periods.astype("datetime64[M]")
+    else:
+        origin = WEEK_ORIGIN if bucket_seconds % RESOLUTIONS["1w"] == 0 else 0
+        seconds = (periods.astype("datetime64[s]") - EPOCH).astype(np.int64)
+        keys = (seconds - origin) // bucket_seconds * bucket_seconds + origin
+
+    keys, values = bucket(
+        keys, np.array(counts, np.float64), np.array(kw_sum, np.float64), np.array(kwh_sum, np.float64),
+        np.array(kw_max, np.float64), tariff, bands.tolist(),
+    )
+    starts = keys.astype("datetime64[s]") if granularity == "Month" else EPOCH + keys
+    return starts, values
+
+
+def get_raw_page(customer, after=None, to_date=None, limit=DEFAULT_MAX_POINTS):
+    """
+    One page of raw readings after the keyset cursor `after` (exclusive), in time order.
+
+    The end of the page is found with `get_page_end`, and only the readings up to it are
+    loaded. Readings sharing the last timestamp (several meter channels) stay on the
+    same page.
+
+    Returns:
+        tuple: The page as a ConsumptionSeries and the cursor of the next page, or None.
+    """
+    start = get_datetime(after) + timedelta(seconds=1) if after else None
+    end = get_page_end(customer, start, to_date, limit)
+    series = ConsumptionSeries.load(customer, start, end or to_date)
+
+    more = bool(end)
+    if len(series) > limit:
+        series = series.select(series.timestamps <= series.timestamps[limit - 1])
+        more = True
+    cursor = str(series.dates[-1].item()) if more and len(series) else None
+    return series, cursor
+
+
+def get_page_end(customer, start=None, to_date=None, limit=DEFAULT_MAX_POINTS):
+    """
+    Date of the reading `limit` places from `start`, i.e. the first one past the page, or
+    None when fewer readings are left before `to_date`.
+
+    Months are walked in time order like the export interleaves them: records up to a
+    packed month are counted with seeks on the `(customer, docstatus, date)` index, the
+    packed month from its block file, and the records after the last block are sought.
+    """
+    remaining = limit
+    for block in get_blocks([customer], start, to_date):
+        period = get_datetime(block.period)
+        if end := seek_record(customer, start, period, remaining, end_inclusive=False):
+            return end
+        remaining -= count_records(customer, start, period)
+
+        dates = read_block_file(block.file_path).date
+        dates = dates[date_mask(dates, start, to_date)]
+        if len(dates) > remaining:
+            return dates[remaining].item()
+        remaining -= len(dates)
+        start = add_months(period, 1)
+
+    return seek_record(customer, start, to_date, remaining)
+
+
+def seek_record(customer, start, end, offset, end_inclusive=True):
+    """Date of the submitted record `offset` places into the range, or None."""
+    conditions, values = _record_conditions(customer, start, end, end_inclusive)
+    found = frappe.db.sql(
+        f"""
+        SELECT date FROM `tabPower Consumption`
+        WHERE {conditions}
+        ORDER BY date
+        LIMIT 1 OFFSET %(offset)s
+        """,
+        {**values, "offset": offset},
+    )
+    return found[0][0] if found else None
+
+
+def count_records(customer, start, end):
+    """Submitted records from `start` up to `end` (exclusive)."""
+    conditions, values = _record_conditions(customer, start, end, end_inclusive=False)
+    return frappe.db.sql(f"SELECT COUNT(*) FROM `tabPower Consumption` WHERE {conditions}", values)[0][0]
+
+
+def _record_conditions(customer, start, end, end_inclusive):
+    conditions = ["customer = %(customer)s", "docstatus = 1", "date IS NOT NULL"]
+    if start:
+        conditions.append("date >= %(start)s")
+    if end:
+        conditions.append("date <= %(end)s" if end_inclusive else "date < %(end)s")
+    return " AND ".join(conditions), {"customer": customer, "start": start, "end": end}
+
+
+def _round(values, decimals=4):
+    return np.round(np.where(np.isfinite(values), values, 0), decimals).tolist()
+
+
+def _format(dates):
+    return np.datetime_as_string(dates, unit="s").tolist()
+
+
+@frappe.whitelist()
+def get_consumption_timeseries(customer, from_date=None, to_date=None, resolution="auto",
+        max_points=DEFAULT_MAX_POINTS, cursor=None):
+    """
+    A customer's consumption as parallel arrays for charts.
+
+    With `resolution` "auto" the finest resolution that keeps the response within
+    `max_points` is chosen: raw readings for short ranges, otherwise buckets of 15 minutes
+    up to calendar months (`RESOLUTIONS`) with the mean and highest KW, the KWH and the
+    KWH of each tariff band. Raw readings are paged with a keyset `cursor`.
+
+    Months archived with their summaries only can only be charted from day buckets: an
+    "auto" resolution finer than a day is widened to "1d" and `widened` is set, an
+    explicit one throws.
+
+    Args:
+        customer (str): The customer.
+        from_date (str, optional): Start of the range, a year before `to_date` by default.
+        to_date (str, optional): End of the range (inclusive), now by default.
+        resolution (str, optional): "auto", "raw" or a key of `RESOLUTIONS`.
+        max_points (int, optional): Points per response, at most `MAX_POINTS_LIMIT`.
+        cursor (str, optional): `next_cursor` of the previous raw page.
+
+    Returns:
+        dict: `resolution`, `timestamps` and per-point arrays; raw pages have `kw`, `kwh`,
+        `tariff` and `next_cursor`, buckets `reading_count`, `mean_kw`, `max_kw`, `kwh`, `tariffs`
+        and `widened`.
+    """
+    frappe.has_permission("Power Consumption", "read", throw=True)
+    frappe.has_permission("Customer", "read", customer, throw=True)
+
+    to_date = get_datetime(to_date) if to_date else now_datetime().replace(microsecond=0)
+    from_date = get_datetime(from_date) if from_date else get_datetime(add_days(to_date, -365))
+    max_points = min(max(cint(max_points) or DEFAULT_MAX_POINTS, 1), MAX_POINTS_LIMIT)
+    widened = 0
+    if resolution == "auto":
+        resolution = choose_resolution(from_date, to_date, max_points)
+        if needs_readings(resolution) and get_blocks([customer], from_date, to_date, with_file=False):
+            resolution, widened = "1d", 1
+    elif resolution != "raw" and resolution not in RESOLUTIONS:
+        frappe.throw(_("Resolution must be auto, raw or one of {0}").format(", ".join(RESOLUTIONS)))
+    elif needs_readings(resolution):
+        validate_readings_kept([customer], from_date, to_date)
+
+    if resolution == "raw":
+        series, next_cursor = get_raw_page(customer, cursor or from_date - timedelta(seconds=1), to_date, max_points)
+        bands = np.asarray(series.bands or [""], dtype=object)
+        return {
+            "resolution": "raw",
+            "timestamps": _format(series.dates),
+            "kw": _round(series.kw),
+            "kwh": _round(series.kwh),
+            "tariff": bands[series.tariff].tolist() if len(series) else [],
+            "next_cursor": next_cursor,
+        }
+
+    starts, values = get_bucketed_series(customer, from_date, to_date, resolution)
+    return {"resolution": resolution, "timestamps": _format(starts), **values, "widened": widened}
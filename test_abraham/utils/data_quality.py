@@ -0,0 +1,287 @@
+from datetime import datetime, time
+from zoneinfo import ZoneInfo
+
+import frappe
+import numpy as np
+from frappe.utils import get_system_timezone, getdate, now_datetime
+
+from test_abraham.solar_cell_company.doctype.power_consumption.power_consumption import DEFAULT_METER_CHANNEL
+from test_abraham.utils.consumption_series import EPOCH, ConsumptionSeries
+
+
+INTERVAL_SECONDS = 15 * 60
+SLOTS_PER_HOUR = 3600 // INTERVAL_SECONDS
+# Robust z-score (distance from the month's median in scaled MADs) above which a KW reading is an outlier
+OUTLIER_THRESHOLD = 6
+# Relative margin by which an hour's KWH may exceed the highest KW of that hour
+KWH_TOLERANCE = 0.1
+SCAN_BATCH_SIZE = 100
+SCAN_JOB_ID = "test_abraham:scan_consumption_quality"
+
+SUMMARY_FIELDS = (
+    "reading_count", "expected_slots", "completeness", "missing_slots", "longest_gap", "duplicate_timestamps",
+    "off_grid_readings", "dst_suspects", "outliers", "negative_readings", "inconsistent_kwh",
+)
+
+
+def get_summary_name(customer, period, meter_channel=None):
+    """Name of the Consumption Quality Summary of a customer-month and channel: `customer-YYYY-MM-channel`."""
+    return f"{customer}-{getdate(period).strftime('%Y-%m')}-{meter_channel or DEFAULT_METER_CHANNEL}"
+
+
+def get_dst_days(first_year, last_year, timezone=None):
+    """
+    Local dates on which a timezone shifts between standard and daylight saving time,
+    as days since the epoch. Defaults to the system timezone.
+    """
+    zone = ZoneInfo(timezone or get_system_timezone())
+    days = np.arange(np.datetime64(f"{first_year}-01-01"), np.datetime64(f"{last_year + 1}-01-02"))
+    offsets = np.array([
+        datetime.combine(day, time(), zone).utcoffset().total_seconds() for day in days.tolist()
+    ])
+    # A shift during a day changes the offset between its midnight and the next one
+    return (days[:-1][np.diff(offsets) != 0] - np.datetime64("1970-01-01")).astype(np.int64)
+
+
+def scan_series(series, timezone=None):
+    """
+    Checks the readings of one meter channel of a customer for interval and value
+    problems, month by month.
+
+    Every check is a vectorized diff, group count or comparison over the whole series,
+    which is ordered by time, so millions of readings take seconds. Expected slots are
+    counted on the 15-minute grid between the customer's first and last reading. Skipped
+    and repeated hours only count as DST suspects on the transition dates of `timezone`,
+    the system timezone by default.
+
+    Returns:
+        dict: `(year, month)` -> `frappe._dict` of `SUMMARY_FIELDS`.
+    """
+    if not len(series):
+        return {}
+
+    timestamps, kw, kwh = series.timestamps, series.kw, series.kwh
+    months, group = np.unique(series.month_keys(), return_inverse=True)
+    size = len(months)
+    counts = np.bincount(group, minlength=size)
+
+    def per_month(mask, groups=group):
+        return np.bincount(groups, weights=mask, minlength=size).astype(np.int64)
+
+    slots = timestamps // INTERVAL_SECONDS
+    repeated = np.r_[False, np.diff(timestamps) == 0]
+    new_slot = np.r_[True, np.diff(slots) > 0]
+
+    # Grid slots of each month, clipped to the customer's first and last reading
+    month_starts = (months.astype("datetime64[s]") - EPOCH).astype(np.int64) // INTERVAL_SECONDS
+    month_ends = ((months + 1).astype("datetime64[s]") - EPOCH).astype(np.int64) // INTERVAL_SECONDS
+    expected = np.minimum(month_ends, slots[-1] + 1) - np.maximum(month_starts, slots[0])
+    filled = per_month(new_slot)
+
+    # Gaps between consecutive occupied slots, counted in the month of the slot after the gap
+    occupied = slots[new_slot]
+    occupied_group = group[new_slot]
+    gaps = np.diff(occupied) - 1
+    longest_gap = np.zeros(size, np.int64)
+    np.maximum.at(longest_gap, occupied_group[1:], gaps)
+
+    # On DST transition dates a skipped hour shows as a gap of exactly one hour and a repeated
+    # hour as an hour whose slots are all doubled; elsewhere these are outages or double imports
+    slots_per_day = 24 * SLOTS_PER_HOUR
+    dst_days = get_dst_days(months[0].item().year, months[-1].item().year, timezone)
+    skipped_hours = (gaps == SLOTS_PER_HOUR) & np.isin((occupied[:-1] + 1) // slots_per_day, dst_days)
+    slot_counts = np.diff(np.r_[np.flatnonzero(new_slot), len(slots)])
+    doubled = slot_counts > 1
+    doubled_hours, first_doubled, doubled_per_hour = np.unique(
+        occupied[doubled] // SLOTS_PER_HOUR, return_index=True, return_counts=True
+    )
+    repeated_hours = (doubled_per_hour == SLOTS_PER_HOUR) & np.isin(doubled_hours // 24, dst_days)
+    dst_suspects = (
+        per_month(skipped_hours, occupied_group[1:])
+        + per_month(repeated_hours, occupied_group[doubled][first_doubled])
+    )
+
+    # Energy of an hour cannot exceed its highest demand
+    hours, hour_index = np.unique(timestamps // 3600, return_inverse=True)
+    hour_peak = np.full(len(hours), -np.inf)
+    np.maximum.at(hour_peak, hour_index, kw)
+    inconsistent = (kwh > 0) & (kwh > hour_peak[hour_index] * (1 + KWH_TOLERANCE))
+
+    # Readings are ordered by time, so each month is a contiguous slice
+    outliers = np.zeros(size, np.int64)
+    ends = np.cumsum(counts)
+    for index, (start, end) in enumerate(zip(ends - counts, ends)):
+        deviation = np.abs(kw[start:end] - np.median(kw[start:end]))
+        # Scaled median absolute deviation, or mean absolute deviation when most readings are equal
+        spread = 1.4826 * np.median(deviation) or 1.2533 * deviation.mean()
+        if spread > 0:
+            outliers[index] = np.count_nonzero(deviation > OUTLIER_THRESHOLD * spread)
+
+    columns = {
+        "reading_count": counts,
+        "expected_slots": expected,
+        "completeness": np.round(100 * filled / np.maximum(expected, 1), 2),
+        "missing_slots": np.maximum(expected - filled, 0),
+        "longest_gap": longest_gap,
+        "duplicate_timestamps": per_month(repeated),
+        "off_grid_readings": per_month(timestamps % INTERVAL_SECONDS != 0),
+        "dst_suspects": dst_suspects,
+        "outliers": outliers,
+        "negative_readings": per_month((kw < 0) | (kwh < 0)),
+        "inconsistent_kwh": per_month(inconsistent),
+    }
+
+    result = {}
+    for index, month in enumerate(months):
+        period = month.item()
+        result[(period.year, period.month)] = frappe._dict(
+            {field: columns[field][index].item() for field in SUMMARY_FIELDS}
+        )
+    return result
+
+
+def interpolate_missing(series):
+    """
+    Fill values for the empty 15-minute slots between a series' first and last reading.
+
+    KW is interpolated linearly between the neighbouring on-grid readings; KWH only on
+    full-hour slots, from the neighbouring readings that carry an hour's KWH.
+
+    Returns:
+        ConsumptionSeries: One reading per missing slot.
+    """
+    on_grid = series.select(series.timestamps % INTERVAL_SECONDS == 0)
+    timestamps, first = np.unique(on_grid.timestamps, return_index=True)
+    if len(timestamps) < 2:
+        return ConsumptionSeries([], [], [], customer=series.customer)
+
+    grid = np.arange(timestamps[0], timestamps[-1] + 1, INTERVAL_SECONDS)
+    missing = grid[~np.isin(grid, timestamps, assume_unique=True)]
+    kw = np.interp(missing, timestamps, on_grid.kw[first])
+
+    kwh = np.zeros(len(missing))
+    hourly = on_grid.kwh[first] > 0
+    full_hour = missing % 3600 == 0
+    if hourly.any():
+        kwh[full_hour] = np.interp(missing[full_hour], timestamps[hourly], on_grid.kwh[first][hourly])
+
+    return ConsumptionSeries(missing, kw, kwh, customer=series.customer)
+
+
+def scan_customer(customer):
+    """
+    Scans all readings of a customer, documents and packed blocks alike, and replaces its
+    Consumption Quality Summaries. Each meter channel is scanned on its own, so readings
+    of separate channels at the same time are not taken for duplicates.
+
+    Returns:
+        dict: Meter channel -> scanned months, see `scan_series`.
+    """
+    timezone = get_system_timezone()
+    channels = {
+        meter_channel: scan_series(series, timezone)
+        for meter_channel, series in ConsumptionSeries.load_by_channel(customer).items()
+    }
+    write_summaries(customer, channels)
+    return channels
+
+
+def write_summaries(customer, channels):
+    """
+    Replaces the Consumption Quality Summaries of a customer with one delete and one
+    multi-row insert, one summary per month and meter channel. Months archived without
+    a readings file can not be scanned again and keep their summaries.
+    """
+    frappe.db.sql(
+        """
+        DELETE FROM `tabConsumption Quality Summary`
+        WHERE customer = %(customer)s AND period NOT IN (
+            SELECT period FROM `tabConsumption Block`
+            WHERE customer = %(customer)s AND IFNULL(file_path, '') = ''
+        )
+        """,
+        {"customer": customer},
+    )
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+    for meter_channel, months in sorted(channels.items()):
+        for (year, month), summary in sorted(months.items()):
+            period = f"{year}-{month:02d}-01"
+            values.append((
+                get_summary_name(customer, period, meter_channel), customer, period, meter_channel, now,
+                *(summary[field] for field in SUMMARY_FIELDS), now, now, user, user,
+            ))
+    if not values:
+        return
+
+    frappe.db.bulk_insert(
+        "Consumption Quality Summary",
+        (
+            "name", "customer", "period", "meter_channel", "scanned_on", *SUMMARY_FIELDS,
+            "creation", "modified", "owner", "modified_by",
+        ),
+        values,
+    )
+
+
+def scan_all_customers(batch_size=SCAN_BATCH_SIZE):
+    """
+    Background job scanning every customer in name order, committing after each one so a
+    long scan never holds locks or a large transaction.
+
+    Returns:
+        int: Number of scanned customers.
+    """
+    scanned = 0
+    last_customer = ""
+    while customers := frappe.db.sql_list(
+        "SELECT name FROM `tabCustomer` WHERE name > %s ORDER BY name LIMIT %s",
+        (last_customer, batch_size),
+    ):
+        for customer in customers:
+            scan_customer(customer)
+            frappe.db.commit()
+        scanned += len(customers)
+        last_customer = customers[-1]
+    return scanned
+
+
+@frappe.whitelist()
+def start_quality_scan():
+    """
+    Queues a data-quality scan of all customers. A scan that is already queued or
+    running is not queued again.
+
+    Returns:
+        dict: The id of the background job.
+    """
+    frappe.only_for("System Manager")
+    frappe.enqueue(
+        "test_abraham.utils.data_quality.scan_all_customers",
+        queue="long",
+        timeout=6 * 60 * 60,
+        job_id=SCAN_JOB_ID,
+        deduplicate=True,
+    )
+    return {"job_id": SCAN_JOB_ID}
+
+
+@frappe.whitelist()
+def get_fill_values(customer, from_date=None, to_date=None, meter_channel=None):
+    """
+    Interpolated KW and KWH for the missing 15-minute slots of a customer's meter channel
+    (the default channel if none is given) between two datetimes. Nothing is written; the
+    values can be reviewed and imported.
+
+    Returns:
+        list: `{date, kw, kwh}` per missing slot.
+    """
+    frappe.has_permission("Customer", "read", customer, throw=True)
+    fill = interpolate_missing(ConsumptionSeries.load(
+        customer, from_date, to_date, meter_channel=meter_channel or DEFAULT_METER_CHANNEL
+    ))
+    return [
+        {"date": str(date), "kw": round(float(kw), 3), "kwh": round(float(kwh), 3)}
+        for date, kw, kwh in zip(fill.dates.tolist(), fill.kw, fill.kwh)
+    ]
@@ -0,0 +1,525 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import frappe
+import numpy as np
+from frappe.utils import add_months, flt, get_datetime, get_first_day, getdate, now_datetime
+
+from test_abraham.base.constants import month_dict
+from test_abraham.solar_cell_company.doctype.customer.customer import reconcile_customer_totals
+from test_abraham.solar_cell_company.doctype.roi_calculation.roi_calculation import (
+    DEMAND_FIELDS,
+    MONTH_NUMBERS,
+    get_empty_demand,
+    get_roi_key,
+    get_roi_values,
+    get_series_key,
+    replace_tariff_bands,
+)
+from test_abraham.utils.consumption_aggregates import (
+    insert_day_totals,
+    lock_customer_month,
+    rollup_days,
+    rollup_months,
+)
+from test_abraham.utils.consumption_blocks import get_archived_demand, get_block_day_totals
+from test_abraham.utils.consumption_series import ConsumptionSeries
+from test_abraham.utils.helper_functions import reserve_series
+from test_abraham.utils.summary_cache import invalidate_months
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+
+BATCH_SIZE = 50
+# Readings per UPDATE when storing reclassified tariff bands
+RECLASSIFY_CHUNK_SIZE = 5000
+DRY_RUN_SAVEPOINT = "rebuild_dry_run"
+MAX_REPORTED_DIFFERENCES = 200
+PRECISION = 6
+
+ROI_FIELDS = ("average_kw", "average_kwh", "low_tariff", "high_tarriff", "tariff_schedule", "is_stale", *DEMAND_FIELDS)
+BAND_FIELDS = ("band", "reading_count", "average_kwh", "rate", "tariff")
+
+
+def rebuild_roi_calculations(customer=None, from_date=None, to_date=None, workers=None, dry_run=False,
+        batch_size=BATCH_SIZE, progress=None):
+    """
+    Rebuilds the consumption rollups, ROI Calculations and customer averages from the
+    submitted Power Consumption records.
+
+    Customers are split into batches that run in a process pool, one database connection
+    per worker. Each batch first puts its readings through the current Tariff Schedules
+    again, so a changed schedule moves readings between bands. It then reads its
+    customer-months with set-based GROUP BY queries and writes only the ROI Calculations
+    that differ, with one multi-row upsert.
+
+    Args:
+        customer (str, optional): Only rebuild this customer.
+        from_date (str, optional): First month to rebuild, unbounded if empty.
+        to_date (str, optional): Last month to rebuild, unbounded if empty.
+        workers (int, optional): Worker processes, defaults to the CPU count. With 1 the
+            batches run in the current process and connection.
+        dry_run (bool, optional): Only compute the differences, write nothing.
+        batch_size (int, optional): Customers per batch.
+        progress (callable, optional): Called with the running summary after each batch.
+
+    Returns:
+        frappe._dict: Counts of customers, months and readings processed, readings
+        `reclassified`, ROI Calculations created, updated and removed, `rows_per_second`
+        and the first `differences`.
+    """
+    start, end = get_rebuild_range(from_date, to_date)
+    customers = get_customers(customer)
+    batches = [customers[i:i + batch_size] for i in range(0, len(customers), batch_size)]
+    workers = min(workers or multiprocessing.cpu_count(), len(batches) or 1)
+
+    summary = frappe._dict(
+        customers=0, months=0, readings=0, reclassified=0, created=0, updated=0, removed=0, averages_updated=0,
+        differences=[], dry_run=dry_run,
+    )
+    started = time.monotonic()
+
+    if workers <= 1:
+        for batch in batches:
+            _merge_result(summary, rebuild_batch(batch, start, end, dry_run), progress)
+    else:
+        # Workers are spawned, not forked, so none of them inherits this process's connection
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(run_batch, frappe.local.site, frappe.local.sites_path, batch, start, end, dry_run)
+                for batch in batches
+            ]
+            for future in as_completed(futures):
+                _merge_result(summary, future.result(), progress)
+
+    elapsed = time.monotonic() - started
+    summary.seconds = round(elapsed, 2)
+    summary.rows_per_second = round(summary.readings / elapsed) if elapsed else summary.readings
+    return summary
+
+
+def get_rebuild_range(from_date=None, to_date=None):
+    """Turns the inclusive `from`/`to` months into a half-open `[start, end)` range of month starts."""
+    start = get_first_day(from_date) if from_date else None
+    end = add_months(get_first_day(to_date), 1) if to_date else None
+    return start, end
+
+
+def get_customers(customer=None):
+    if customer:
+        return [customer]
+    return frappe.db.sql_list("SELECT name FROM `tabCustomer` ORDER BY name")
+
+
+def run_batch(site, sites_path, customers, start, end, dry_run):
+    """Entry point of a worker process: connects to the site and rebuilds one batch."""
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+    try:
+        return rebuild_batch(customers, start, end, dry_run)
+    finally:
+        frappe.destroy()
+
+
+def rebuild_batch(customers, start, end, dry_run=False):
+    """
+    Rebuilds one batch of customers and commits it.
+
+    Unless it is a dry run, the batch first takes the named lock of every customer-month
+    it may write and row locks on its customers, then reads everything from a snapshot
+    started after that. Submits, ingestion and the recalculation job touching those
+    months or customers wait until the batch commits instead of being overwritten. A dry
+    run reclassifies the readings inside a savepoint it rolls back at the end.
+
+    Returns:
+        frappe._dict: The batch's counts and differences, see `rebuild_roi_calculations`.
+    """
+    result = frappe._dict(
+        customers=len(customers), months=0, readings=0, reclassified=0, created=0, updated=0, removed=0,
+        averages_updated=0, differences=[],
+    )
+    if not customers:
+        return result
+
+    if dry_run:
+        frappe.db.savepoint(DRY_RUN_SAVEPOINT)
+    else:
+        lock_batch(customers, start, end)
+    result.reclassified = reclassify_readings(customers, start, end)
+
+    block_days = get_block_day_totals(customers, start, end)
+    month_totals = get_month_totals_by_customer(customers, start, end, block_days)
+    demand = get_month_demand_by_customer(customers, start, end)
+    existing = get_existing_rois(customers, start, end)
+    result.months = len(month_totals)
+    result.readings = sum(totals.reading_count for totals in month_totals.values())
+
+    upserts, bands_by_key = [], {}
+    for key, totals in sorted(month_totals.items()):
+        values, bands = get_roi_values(totals, key[1], key[2])
+        values.update(demand.get(key) or get_empty_demand())
+        current = existing.pop(key, None)
+        changes = _diff(current, values, bands)
+        if not changes:
+            continue
+
+        _add_difference(result, key, "update" if current else "create", changes)
+        upserts.append((key, current.name if current else None, values))
+        bands_by_key[key] = bands
+
+    # Months that still have an ROI Calculation but no submitted readings left
+    removed = sorted(existing.items())
+    for key, _ in removed:
+        _add_difference(result, key, "remove", {})
+
+    result.created = sum(1 for _, name, _ in upserts if not name)
+    result.updated = len(upserts) - result.created
+    result.removed = len(removed)
+    # Running totals and averages always cover all readings, regardless of the rebuild range
+    result.averages_updated = len(reconcile_customer_totals(customers, repair=not dry_run))
+
+    if not dry_run:
+        rebuild_aggregates(customers, start, end, block_days)
+        names = upsert_roi_calculations(upserts)
+        replace_tariff_bands({names[key]: bands for key, bands in bands_by_key.items()})
+        delete_roi_calculations([roi.name for _, roi in removed])
+        invalidate_months([*bands_by_key, *(key for key, _ in removed)])
+        frappe.db.commit()
+    else:
+        frappe.db.rollback(save_point=DRY_RUN_SAVEPOINT)
+
+    return result
+
+
+def lock_batch(customers, start, end):
+    """
+    Locks what a batch writes, in the order single submits take their locks: the named
+    lock of each customer-month (`lock_customer_month`), then the Customer rows. A new
+    transaction is started in between, so the batch's reads see every writer that
+    finished before the locks were granted.
+    """
+    frappe.db.commit()
+    for customer, period in get_batch_months(customers, start, end):
+        lock_customer_month(customer, period)
+
+    # Locking reads do not start the snapshot; the first plain read after them does
+    frappe.db.begin()
+    frappe.db.sql(
+        "SELECT name FROM `tabCustomer` WHERE name IN %(customers)s FOR UPDATE", {"customers": tuple(customers)}
+    )
+
+
+def get_batch_months(customers, start, end):
+    """
+    Customer-months within the range that have submitted readings, a Consumption Block
+    or an ROI Calculation, sorted so concurrent batches lock them in the same order.
+
+    Returns:
+        list: `(customer, month start)` tuples.
+    """
+    values = {"customers": tuple(customers), "start": start, "end": end}
+    months = set(frappe.db.sql(
+        f"""
+        SELECT DISTINCT customer, CAST(DATE_FORMAT(date, '%%Y-%%m-01') AS DATE)
+        FROM `tabPower Consumption`
+        WHERE docstatus = 1 AND customer IN %(customers)s AND date IS NOT NULL {_date_conditions(start, end)}
+        UNION
+        SELECT customer, period
+        FROM `tabConsumption Block`
+        WHERE customer IN %(customers)s {_date_conditions(start, end, "period")}
+        """,
+        values,
+    ))
+    for customer, year, month in frappe.db.sql(
+        "SELECT customer, year, month FROM `tabROI Calculation` WHERE customer IN %(customers)s AND docstatus = 1",
+        values,
+    ):
+        month = MONTH_NUMBERS.get(month)
+        if month and _in_range(year, month, start, end):
+            months.add((customer, getdate(f"{year}-{str(month).zfill(2)}-01")))
+
+    return sorted((customer, getdate(period)) for customer, period in months)
+
+
+def reclassify_readings(customers, start, end):
+    """
+    Classifies the batch's readings with the current Tariff Schedules and stores the
+    bands that changed, with one UPDATE per band and chunk of readings. Readings packed
+    into Consumption Blocks keep the bands they were packed with.
+
+    Returns:
+        int: Number of readings whose band changed.
+    """
+    engine = get_tariff_engine()
+    changed = {}
+    for customer in customers:
+        rows = frappe.db.sql(
+            f"""
+            SELECT name, date, IFNULL(tarriff, '')
+            FROM `tabPower Consumption`
+            WHERE docstatus = 1 AND customer = %(customer)s AND date IS NOT NULL {_date_conditions(start, end)}
+            """,
+            {"customer": customer, "start": start, "end": end},
+        )
+        if not rows:
+            continue
+
+        names, dates, tariffs = (np.asarray(column, dtype=object) for column in zip(*rows))
+        bands = engine.classify_names(dates.astype("datetime64[s]"))
+        moved = bands != tariffs
+        for band in np.unique(bands[moved]):
+            changed.setdefault(band, []).extend(names[moved & (bands == band)].tolist())
+
+    for band, names in changed.items():
+        for index in range(0, len(names), RECLASSIFY_CHUNK_SIZE):
+            frappe.db.sql(
+                "UPDATE `tabPower Consumption` SET tarriff = %s WHERE name IN %s",
+                (band, tuple(names[index:index + RECLASSIFY_CHUNK_SIZE])),
+            )
+    return sum(len(names) for names in changed.values())
+
+
+def get_month_totals_by_customer(customers, start, end, block_days=()):
+    """
+    Sums the submitted readings of a batch per customer, month and tariff in one query,
+    adding the per-day totals of the batch's packed Consumption Blocks.
+
+    Returns:
+        dict: `(customer, year, month)` -> totals shaped like `get_month_totals`.
+    """
+    rows = frappe.db.sql(
+        f"""
+        SELECT customer, YEAR(date) AS year, MONTH(date) AS month, IFNULL(tarriff, '') AS tariff,
+            COUNT(*) AS reading_count, SUM(kwh) AS kw_sum, SUM(kwh__) AS kwh_sum
+        FROM `tabPower Consumption`
+        WHERE docstatus = 1 AND customer IN %(customers)s AND date IS NOT NULL {_date_conditions(start, end)}
+        GROUP BY customer, YEAR(date), MONTH(date), IFNULL(tarriff, '')
+        """,
+        {"customers": tuple(customers), "start": start, "end": end},
+        as_dict=True,
+    )
+
+    month_totals = {}
+    for row in [*rows, *block_days]:
+        year, month = (row.period.year, row.period.month) if row.get("period") else (row.year, row.month)
+        totals = month_totals.setdefault(
+            (row.customer, year, month),
+            frappe._dict(reading_count=0, kw_sum=0.0, kwh_sum=0.0, tariffs={}),
+        )
+        totals.reading_count += row.reading_count
+        totals.kw_sum += row.kw_sum or 0
+        totals.kwh_sum += row.kwh_sum or 0
+        tariff = totals.tariffs.setdefault(row.tariff, frappe._dict(reading_count=0, kwh_sum=0.0))
+        tariff.reading_count += row.reading_count
+        tariff.kwh_sum += row.kwh_sum or 0
+
+    return month_totals
+
+
+def get_month_demand_by_customer(customers, start, end):
+    """
+    Peak demand figures of a batch per customer and month. Each customer's readings in
+    the range are streamed once into a `ConsumptionSeries` and all its months are
+    evaluated in one vectorized pass. Months archived without a readings file keep the
+    figures stored on their Consumption Block.
+
+    Returns:
+        dict: `(customer, year, month)` -> values of `DEMAND_FIELDS`.
+    """
+    to_date = get_datetime(end) - timedelta(seconds=1) if end else None
+    demand = get_archived_demand(customers, start, end)
+    for customer in customers:
+        for (year, month), values in ConsumptionSeries.load(customer, start, to_date).month_demand().items():
+            demand[(customer, year, month)] = values
+    return demand
+
+
+def get_existing_rois(customers, start, end):
+    """
+    Loads the ROI Calculations of a batch within the range, with their tariff bands.
+
+    Returns:
+        dict: `(customer, year, month)` -> ROI Calculation values and `bands`.
+    """
+    rois = frappe.db.sql(
+        f"""
+        SELECT name, customer, month, year, {", ".join(ROI_FIELDS)}
+        FROM `tabROI Calculation`
+        WHERE customer IN %(customers)s AND docstatus = 1
+        """,
+        {"customers": tuple(customers)},
+        as_dict=True,
+    )
+
+    existing = {}
+    for roi in rois:
+        month = MONTH_NUMBERS.get(roi.month)
+        if not month or not _in_range(roi.year, month, start, end):
+            continue
+        roi.bands = []
+        existing[(roi.customer, roi.year, month)] = roi
+
+    if existing:
+        by_name = {roi.name: roi for roi in existing.values()}
+        for band in frappe.db.sql(
+            f"""
+            SELECT parent, {", ".join(BAND_FIELDS)}
+            FROM `tabROI Tariff Band`
+            WHERE parenttype = 'ROI Calculation' AND parent IN %(names)s
+            ORDER BY parent, idx
+            """,
+            {"names": tuple(by_name)},
+            as_dict=True,
+        ):
+            by_name[band.parent].bands.append(band)
+
+    return existing
+
+
+def upsert_roi_calculations(upserts):
+    """
+    Writes new and changed ROI Calculations with one `INSERT ... ON DUPLICATE KEY UPDATE`.
+    New rows are created submitted and named from the customer's ROI naming series; if a
+    concurrent submit created the month first, its row is updated instead.
+
+    Args:
+        upserts (list): `((customer, year, month), existing name or None, values)` tuples.
+
+    Returns:
+        dict: `(customer, year, month)` -> ROI Calculation name.
+    """
+    if not upserts:
+        return {}
+
+    new_counts = {}
+    for (customer, _, _), name, _ in upserts:
+        if not name:
+            new_counts[customer] = new_counts.get(customer, 0) + 1
+
+    # Reserve in a fixed order so concurrent workers lock series rows consistently
+    next_index = {}
+    for customer, count in sorted(new_counts.items()):
+        next_index[customer] = reserve_series(get_series_key(customer), count)
+
+    customer_names = dict(frappe.db.sql(
+        "SELECT name, full_name FROM `tabCustomer` WHERE name IN %s",
+        (tuple({customer for (customer, _, _), _, _ in upserts}),),
+    ))
+
+    now = now_datetime()
+    user = frappe.session.user
+    names, rows = {}, []
+    for (customer, year, month), name, values in upserts:
+        if not name:
+            name = f"{customer}-{month_dict[str(month)]}-{year}-{next_index[customer]}"
+            next_index[customer] += 1
+        names[(customer, year, month)] = name
+        rows.append((
+            name, get_roi_key(customer, year, month), customer, customer_names.get(customer),
+            month_dict[str(month)], year,
+            *(values[field] for field in ROI_FIELDS), 1, now, now, user, user,
+        ))
+
+    fields = ("name", "roi_key", "customer", "customer_name", "month", "year", *ROI_FIELDS,
+        "docstatus", "creation", "modified", "owner", "modified_by")
+    updated = (*ROI_FIELDS, "modified", "modified_by")
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabROI Calculation` ({", ".join(f"`{field}`" for field in fields)})
+        VALUES {", ".join(["(" + ", ".join(["%s"] * len(fields)) + ")"] * len(rows))}
+        ON DUPLICATE KEY UPDATE {", ".join(f"`{field}` = VALUES(`{field}`)" for field in updated)}
+        """,
+        [value for row in rows for value in row],
+    )
+
+    if new_counts:
+        # Current read, so rows inserted by concurrent submits are seen by their key
+        actual_names = dict(frappe.db.sql(
+            "SELECT roi_key, name FROM `tabROI Calculation` WHERE roi_key IN %s FOR UPDATE",
+            (tuple(get_roi_key(*key) for key in names),),
+        ))
+        names = {key: actual_names.get(get_roi_key(*key), name) for key, name in names.items()}
+    return names
+
+
+def delete_roi_calculations(names):
+    """Removes ROI Calculations whose month has no submitted readings left."""
+    if not names:
+        return
+    frappe.db.delete("ROI Tariff Band", {"parent": ("in", names), "parenttype": "ROI Calculation"})
+    frappe.db.delete("ROI Calculation", {"name": ("in", names)})
+
+
+def rebuild_aggregates(customers, start, end, block_days=()):
+    """
+    Recomputes the daily and monthly rollups of a batch within the range with set-based
+    queries, adding the per-day totals of its packed Consumption Blocks.
+    """
+    values = {"customers": tuple(customers), "start": start, "end": end, "user": frappe.session.user}
+    period_conditions = "customer IN %(customers)s" + _date_conditions(start, end, "period")
+
+    for doctype in ("Daily Consumption Aggregate", "Monthly Consumption Aggregate"):
+        frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE {period_conditions}", values)
+
+    rollup_days("customer IN %(customers)s AND date IS NOT NULL" + _date_conditions(start, end), values)
+    insert_day_totals(block_days)
+    rollup_months(period_conditions, values)
+
+
+def _date_conditions(start, end, column="date"):
+    conditions = ""
+    if start:
+        conditions += f" AND {column} >= %(start)s"
+    if end:
+        conditions += f" AND {column} < %(end)s"
+    return conditions
+
+
+def _in_range(year, month, start, end):
+    period = getdate(f"{year}-{str(month).zfill(2)}-01")
+    return (not start or period >= getdate(start)) and (not end or period < getdate(end))
+
+
+def _diff(current, values, bands):
+    """Returns `field -> (current, expected)` for the values of an ROI Calculation that differ."""
+    if not current:
+        return {field: (None, values[field]) for field in ROI_FIELDS}
+
+    changes = {}
+    for field in ROI_FIELDS:
+        if _normalize(current.get(field)) != _normalize(values[field]):
+            changes[field] = (current.get(field), values[field])
+
+    current_bands = [tuple(_normalize(row.get(field)) for field in BAND_FIELDS) for row in current.bands]
+    expected_bands = [tuple(_normalize(row[field]) for field in BAND_FIELDS) for row in bands]
+    if current_bands != expected_bands:
+        changes["tariff_bands"] = (len(current.bands), len(bands))
+
+    return changes
+
+
+def _normalize(value):
+    if value is None or isinstance(value, str):
+        return value or ""
+    if isinstance(value, datetime):
+        return str(value)
+    return flt(value, PRECISION)
+
+
+def _add_difference(result, key, action, changes):
+    if len(result.differences) < MAX_REPORTED_DIFFERENCES:
+        customer, year, month = key
+        result.differences.append({
+            "customer": customer, "year": year, "month": month, "action": action, "changes": changes,
+        })
+
+
+def _merge_result(summary, result, progress):
+    for field in (
+        "customers", "months", "readings", "reclassified", "created", "updated", "removed", "averages_updated",
+    ):
+        summary[field] += result[field]
+    summary.differences.extend(result.differences[:MAX_REPORTED_DIFFERENCES - len(summary.differences)])
+    if progress:
+        progress(summary)
@@ -1,5 +1,7 @@
 import frappe
 
+from test_abraham.solar_cell_company.doctype.customer.customer import get_user_customer
+
 def response(message, status_code, data=None, error=None):
     """This method generates a response for an API call with appropriate data and status code.
 
@@ -22,18 +24,66 @@ def response(message, status_code, data=None, error=None):
         frappe.log_error(title="API Response", message=frappe.get_traceback())
 
 
-@frappe.whitelist
+# Doctypes scoped to the portal user's own Customer, with the field holding the Customer
+CUSTOMER_SCOPED_DOCTYPES = {
+    "Customer": "name",
+    "Power Consumption": "customer",
+    "ROI Calculation": "customer",
+    "Daily Consumption Aggregate": "customer",
+    "Monthly Consumption Aggregate": "customer",
+    "Consumption Block": "customer",
+    "Consumption Quality Summary": "customer",
+    "Meter Reading Batch": "customer",
+}
+
+
+def get_customer_permission_query_conditions(user=None, doctype=None):
+    """
+    `permission_query_conditions` hook restricting list queries of a user linked to a
+    Customer to that customer's records. Users without a Customer are not restricted.
+
+    The user -> Customer mapping comes from the cache, so no query is added per request.
+    """
+    user = user or frappe.session.user
+    if user == "Administrator" or doctype not in CUSTOMER_SCOPED_DOCTYPES:
+        return ""
+
+    customer = get_user_customer(user)
+    if not customer:
+        return ""
+
+    return f"`tab{doctype}`.`{CUSTOMER_SCOPED_DOCTYPES[doctype]}` = {frappe.db.escape(customer)}"
+
+
+@frappe.whitelist()
 def filtered_get_list(doctype, *args, **kwargs):
-    """Modify queries to restrict access based on the logged-in user."""
-    
-    if frappe.session.user != "Administrator":
-        # Get the customer linked to the logged-in user
-        customer = frappe.get_value("Customer", {"user": frappe.session.user}, "name")
-        
-        if customer:
-            # Ensure only records belonging to the customer are returned
-            if not kwargs.get("filters"):
-                kwargs["filters"] = {}
-            kwargs["filters"]["customer"] = customer
-
-    return frappe.desk.reportview.get(doctype, *args, **kwargs)
\ No newline at end of file
+    """
+    List records of a doctype. Restricting a Customer's user to its own records is done by
+    `get_customer_permission_query_conditions`, which applies to every list query.
+    """
+    return frappe.desk.reportview.get(doctype, *args, **kwargs)
+
+def reserve_series(key, count=1):
+    """Atomically reserves `count` consecutive numbers of a naming series.
+
+    The counter lives in `tabSeries` and is incremented with a single upsert, so naming
+    costs one round trip regardless of how many documents exist, and concurrent workers
+    can never receive the same number. Unlike counting existing rows, numbers freed by
+    deleted documents are never reused.
+
+    Args:
+        key (str): Name of the series row, e.g. `Power Consumption::CUST-0001`.
+        count (int, optional): How many numbers to reserve. Defaults to 1.
+
+    Returns:
+        int: The first reserved number.
+    """
+    frappe.db.sql(
+        """
+        INSERT INTO `tabSeries` (`name`, `current`)
+        VALUES (%(key)s, LAST_INSERT_ID(%(count)s))
+        ON DUPLICATE KEY UPDATE `current` = LAST_INSERT_ID(`current` + %(count)s)
+        """,
+        {"key": key, "count": count},
+    )
+    return frappe.db.sql("SELECT LAST_INSERT_ID()")[0][0] - count + 1
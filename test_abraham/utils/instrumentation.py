@@ -0,0 +1,219 @@
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import frappe
+from frappe.utils import flt, now, now_datetime
+
+from test_abraham.solar_cell_company.doctype.solar_cell_settings.solar_cell_settings import get_settings
+
+
+METRIC_NAMES_KEY = "test_abraham:metric_names"
+METRIC_KEY = "test_abraham:metrics:{0}"
+
+# Upper bounds of the wall time histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf"))
+
+HANDLER_READ_QUERY = "SHOW SESSION STATUS LIKE 'Handler_read%'"
+
+
+def instrument(metric):
+    """
+    Records the wall time, SQL queries and rows examined of each call of the decorated
+    function under `metric`, when instrumentation is enabled in Solar Cell Settings.
+
+    When it is disabled the only overhead is reading the cached settings.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not get_settings().enable_instrumentation:
+                return function(*args, **kwargs)
+
+            with measure(metric):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def measure(metric):
+    """
+    Measures the block and adds it to the metric's histogram. Failed calls are not recorded.
+
+    Measurements can be nested, e.g. an instrumented hook calling instrumented helpers.
+    The counter reads of every measurement are tallied per request, and an enclosing
+    measurement subtracts those made inside it, so it only reports the measured code.
+    """
+    read_overhead = get_rows_examined_overhead()
+    rows_before = get_rows_examined()
+    add_measurement_overhead(1, read_overhead)
+    nested = get_measurement_overhead()
+    nested_queries, nested_rows = nested.queries, nested.rows
+    with count_queries() as counter:
+        started = time.perf_counter()
+        yield
+        milliseconds = (time.perf_counter() - started) * 1000
+
+    rows = get_rows_examined() - rows_before - read_overhead - (nested.rows - nested_rows)
+    queries = counter.count - (nested.queries - nested_queries)
+    add_measurement_overhead(1, read_overhead)
+    record(metric, milliseconds, queries, max(rows, 0))
+
+
+@contextmanager
+def count_queries():
+    """Counts the statements sent through `frappe.db.sql` inside the block. Blocks can be nested."""
+    counter = frappe._dict(count=0)
+    previous = frappe.db.__dict__.get("sql")
+    sql = frappe.db.sql
+
+    def counted_sql(*args, **kwargs):
+        counter.count += 1
+        return sql(*args, **kwargs)
+
+    frappe.db.sql = counted_sql
+    try:
+        yield counter
+    finally:
+        if previous:
+            frappe.db.sql = previous
+        else:
+            # Drops the instance attribute so the class method applies again
+            del frappe.db.sql
+
+
+def get_rows_examined():
+    """Rows read by the storage engine on this connection so far, from the session's Handler_read counters."""
+    return sum(int(value) for _, value in frappe.db.sql(HANDLER_READ_QUERY))
+
+
+def get_rows_examined_overhead():
+    """
+    Handler reads caused by reading the counters themselves, measured once per request
+    and subtracted from every measurement.
+    """
+    if frappe.flags.rows_examined_overhead is None:
+        first = get_rows_examined()
+        frappe.flags.rows_examined_overhead = get_rows_examined() - first
+        add_measurement_overhead(2, frappe.flags.rows_examined_overhead)
+    return frappe.flags.rows_examined_overhead
+
+
+def get_measurement_overhead():
+    """Queries and handler reads spent on reading the counters in this request so far."""
+    if frappe.flags.measurement_overhead is None:
+        frappe.flags.measurement_overhead = frappe._dict(queries=0, rows=0)
+    return frappe.flags.measurement_overhead
+
+
+def add_measurement_overhead(reads, read_overhead):
+    """Tallies `reads` counter reads, each costing one query and `read_overhead` handler reads."""
+    overhead = get_measurement_overhead()
+    overhead.queries += reads
+    overhead.rows += reads * read_overhead
+
+
+def record(metric, milliseconds, queries, rows):
+    """Adds one call to the metric's histogram in the cache, in one round trip."""
+    key = get_metric_key(metric)
+    bucket = next(bound for bound in BUCKETS if milliseconds <= bound)
+
+    pipeline = frappe.cache.pipeline(transaction=False)
+    pipeline.hsetnx(key, "since", now())
+    pipeline.hincrby(key, "count", 1)
+    pipeline.hincrbyfloat(key, "milliseconds", milliseconds)
+    pipeline.hincrby(key, "queries", queries)
+    pipeline.hincrby(key, "rows", rows)
+    pipeline.hincrby(key, f"le:{bucket}", 1)
+    pipeline.sadd(frappe.cache.make_key(METRIC_NAMES_KEY), metric)
+    pipeline.execute()
+
+
+def get_metric_key(metric):
+    return frappe.cache.make_key(METRIC_KEY.format(metric))
+
+
+def get_metric_names():
+    return sorted(name.decode() for name in frappe.cache.smembers(METRIC_NAMES_KEY))
+
+
+def read_histogram(metric, reset=False):
+    """Raw hash of a metric, optionally reset in the same transaction so no call is lost or counted twice."""
+    pipeline = frappe.cache.pipeline()
+    pipeline.hgetall(get_metric_key(metric))
+    if reset:
+        pipeline.delete(get_metric_key(metric))
+    return pipeline.execute()[0]
+
+
+def summarize_histogram(metric, values):
+    """
+    Turns the raw hash of a metric into averages and percentiles.
+
+    Percentiles are the upper bound of the bucket they fall into, the largest finite bound
+    for calls slower than all buckets.
+
+    Returns:
+        frappe._dict: Fields of a Performance Metric Log.
+    """
+    values = {key.decode(): value.decode() for key, value in values.items()}
+    count = int(values.get("count", 0))
+    histogram = {str(bound): int(values.get(f"le:{bound}", 0)) for bound in BUCKETS}
+
+    def percentile(fraction):
+        cumulative = 0
+        for bound in BUCKETS:
+            cumulative += histogram[str(bound)]
+            if cumulative >= fraction * count:
+                return bound if bound != float("inf") else BUCKETS[-2]
+        return BUCKETS[-2]
+
+    return frappe._dict(
+        metric=metric,
+        period_start=values.get("since"),
+        count=count,
+        average_ms=flt(float(values.get("milliseconds", 0)) / count, 3) if count else 0,
+        p50_ms=percentile(0.5) if count else 0,
+        p95_ms=percentile(0.95) if count else 0,
+        p99_ms=percentile(0.99) if count else 0,
+        average_queries=flt(int(values.get("queries", 0)) / count, 2) if count else 0,
+        average_rows_examined=flt(int(values.get("rows", 0)) / count, 2) if count else 0,
+        histogram=json.dumps(histogram),
+    )
+
+
+def flush_metrics():
+    """
+    Moves the histograms collected in the cache into Performance Metric Log, one log per
+    metric, and resets them.
+    """
+    period_end = now_datetime()
+    for metric in get_metric_names():
+        summary = summarize_histogram(metric, read_histogram(metric, reset=True))
+        if not summary.count:
+            continue
+
+        frappe.get_doc({"doctype": "Performance Metric Log", "period_end": period_end, **summary}).insert(
+            ignore_permissions=True
+        )
+
+
+@frappe.whitelist()
+def get_metrics():
+    """
+    Returns the histograms collected since the last flush.
+
+    Returns:
+        list: One summary per metric, see `summarize_histogram`.
+    """
+    frappe.only_for("System Manager")
+    return [
+        summary
+        for metric in get_metric_names()
+        if (summary := summarize_histogram(metric, read_histogram(metric))).count
+    ]
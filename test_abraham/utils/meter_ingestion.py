@@ -0,0 +1,253 @@
+import base64
+import binascii
+import hashlib
+from datetime import timedelta
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import cint, get_datetime, now_datetime
+
+from test_abraham.solar_cell_company.doctype.power_consumption.power_consumption import (
+    DEFAULT_METER_CHANNEL,
+    get_series_key,
+    make_reading_keys,
+)
+from test_abraham.utils.bulk_import import INSERT_FIELDS
+from test_abraham.utils.consumption_blocks import validate_not_packed
+from test_abraham.utils.helper_functions import reserve_series
+from test_abraham.utils.instrumentation import instrument
+from test_abraham.utils.recalculation import defer_recalculation, refresh_consumption_summaries
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+
+# A leap year of 15-minute readings
+MAX_BATCH_READINGS = 366 * 96
+DEFAULT_INTERVAL = 15 * 60
+# Little-endian float buffers accepted as base64 strings
+ENCODINGS = {"float32": "<f4", "float64": "<f8"}
+RECEIPT_FIELDS = ("batch_id", "reading_count", "inserted", "duplicates", "gaps")
+
+
+def decode_values(values, encoding="float64"):
+    """
+    Decodes KW or KWH values sent as a JSON array or as a base64 string of packed
+    little-endian floats, straight into a float64 array. Empty values (null or NaN) become NaN.
+    """
+    if not isinstance(values, str):
+        return np.asarray(values if values is not None else [], dtype=np.float64)
+
+    if encoding not in ENCODINGS:
+        frappe.throw(_("Encoding must be one of {0}").format(", ".join(ENCODINGS)))
+
+    dtype = np.dtype(ENCODINGS[encoding])
+    try:
+        buffer = base64.b64decode(values, validate=True)
+    except (binascii.Error, ValueError):
+        frappe.throw(_("Values must be a JSON array or a base64 encoded float buffer"))
+
+    if len(buffer) % dtype.itemsize:
+        frappe.throw(_("The {0} buffer has a partial value at the end").format(encoding))
+    return np.frombuffer(buffer, dtype=dtype).astype(np.float64)
+
+
+def get_payload_hash(customer, meter_channel, start, interval, kw, kwh):
+    """Fingerprint of a batch, to tell a retry from a different batch that reuses the id."""
+    digest = hashlib.sha1(f"{customer}|{meter_channel}|{start}|{interval}|".encode(), usedforsecurity=False)
+    digest.update(kw.tobytes())
+    digest.update(kwh.tobytes())
+    return digest.hexdigest()
+
+
+def get_receipt(batch_id, payload_hash, for_update=False):
+    """
+    The stored result of an ingested batch, or None. A batch id that was used for
+    different readings is rejected.
+    """
+    receipt = frappe.db.get_value(
+        "Meter Reading Batch", batch_id, [*RECEIPT_FIELDS, "payload_hash"], as_dict=True, for_update=for_update
+    )
+    if not receipt:
+        return None
+
+    if receipt.pop("payload_hash") != payload_hash:
+        frappe.throw(_("Batch {0} was already used for different readings").format(batch_id), frappe.DuplicateEntryError)
+    receipt.replayed = True
+    return receipt
+
+
+def ingest_batch(batch_id, customer, start, interval, kw, kwh, meter_channel=None):
+    """
+    Inserts a regular series of readings of one customer as submitted Power Consumption
+    records, in the caller's transaction.
+
+    The whole batch is checked at once: the last timestamp must not lie in the future
+    (`PowerConsumption.validate_future_dates`), no month may be packed into a Consumption
+    Block, and readings whose reading key is already taken are skipped with one indexed
+    query. NaN values are gaps and skipped. The receipt is inserted before the readings,
+    so a retry racing the first attempt waits for it and then returns its receipt.
+
+    Args:
+        batch_id (str): Id chosen by the gateway, unique per batch.
+        customer (str): The customer.
+        start (datetime): Time of the first reading.
+        interval (int): Seconds between consecutive readings.
+        kw (np.ndarray): KW of each reading.
+        kwh (np.ndarray): KWH of each reading.
+        meter_channel (str, optional): Meter channel of all readings.
+
+    Returns:
+        frappe._dict: The batch receipt, see `RECEIPT_FIELDS`, with `replayed` set for a retry.
+    """
+    meter_channel = meter_channel or DEFAULT_METER_CHANNEL
+    start = get_datetime(start).replace(microsecond=0)
+    payload_hash = get_payload_hash(customer, meter_channel, start, interval, kw, kwh)
+    if receipt := get_receipt(batch_id, payload_hash):
+        return receipt
+
+    validate_batch(start, interval, kw, kwh)
+    customer_doc = frappe.db.get_value("Customer", customer, ["name", "full_name"], as_dict=True)
+    if not customer_doc:
+        frappe.throw(_("Customer {0} does not exist").format(customer), frappe.DoesNotExistError)
+
+    timestamps = np.datetime64(start, "s") + np.arange(len(kw)) * np.timedelta64(interval, "s")
+    months = np.unique(timestamps.astype("datetime64[M]")).astype(object)
+    for month in months:
+        validate_not_packed(customer, month)
+
+    present = np.isfinite(kw) & np.isfinite(kwh)
+    dates = np.char.replace(np.datetime_as_string(timestamps[present], unit="s"), "T", " ")
+    reading_keys = np.asarray(make_reading_keys(customer, dates.tolist(), meter_channel), dtype=object)
+    existing = set(frappe.db.sql_list(
+        "SELECT reading_key FROM `tabPower Consumption` WHERE reading_key IN %s", (tuple(reading_keys),)
+    )) if len(reading_keys) else set()
+    new = ~np.isin(reading_keys, list(existing)) if existing else np.ones(len(reading_keys), bool)
+
+    receipt = frappe._dict(
+        batch_id=batch_id,
+        reading_count=len(kw),
+        inserted=int(new.sum()),
+        duplicates=len(reading_keys) - int(new.sum()),
+        gaps=len(kw) - len(reading_keys),
+        replayed=False,
+    )
+    try:
+        frappe.get_doc({
+            "doctype": "Meter Reading Batch",
+            "customer": customer,
+            "meter_channel": meter_channel,
+            "start": start,
+            "interval_seconds": interval,
+            "payload_hash": payload_hash,
+            **{field: receipt[field] for field in RECEIPT_FIELDS},
+        }).insert(ignore_permissions=True)
+    except frappe.DuplicateEntryError:
+        # A concurrent attempt committed the batch first; read its receipt with a current read.
+        # The failed insert queued an "already exists" message that must not reach the gateway.
+        frappe.clear_messages()
+        return get_receipt(batch_id, payload_hash, for_update=True)
+
+    insert_batch_readings(
+        customer, customer_doc.full_name, meter_channel, timestamps[present][new], dates[new],
+        np.round(kw[present][new], 2), np.round(kwh[present][new], 2), reading_keys[new],
+    )
+    refresh_batch_months(customer, timestamps[present][new], kw[present][new])
+    return receipt
+
+
+def validate_batch(start, interval, kw, kwh):
+    if interval <= 0:
+        frappe.throw(_("The interval must be a positive number of seconds"))
+    if len(kw) != len(kwh):
+        frappe.throw(_("KW and KWH must have the same number of values"))
+    if not len(kw) or len(kw) > MAX_BATCH_READINGS:
+        frappe.throw(_("A batch must contain between 1 and {0} readings").format(MAX_BATCH_READINGS))
+    if start + timedelta(seconds=interval * (len(kw) - 1)) > now_datetime():
+        frappe.throw(_("Power consumption can not be recorded for future dates"))
+
+
+def insert_batch_readings(customer, customer_name, meter_channel, timestamps, dates, kw, kwh, reading_keys):
+    """
+    Inserts the readings of a batch with multi-row INSERTs, building the rows straight
+    from the arrays. Names come from one reservation of the customer's series, like
+    `bulk_import.insert_readings`.
+    """
+    if not len(timestamps):
+        return
+
+    first_index = reserve_series(get_series_key(customer), len(timestamps))
+    years = timestamps.astype("datetime64[Y]").astype(np.int64) + 1970
+    tariffs = get_tariff_engine().classify_names(timestamps)
+
+    now = now_datetime()
+    user = frappe.session.user
+    values = [
+        (f"{customer}-{year}-{index}", customer, customer_name, date, kw_value, kwh_value, tariff,
+            meter_channel, reading_key, 1, now, now, user, user)
+        for index, year, date, kw_value, kwh_value, tariff, reading_key in zip(
+            range(first_index, first_index + len(timestamps)), years.tolist(), dates.tolist(), kw.tolist(),
+            kwh.tolist(), tariffs, reading_keys,
+        )
+    ]
+    frappe.db.bulk_insert("Power Consumption", INSERT_FIELDS, values)
+
+
+def refresh_batch_months(customer, timestamps, kw):
+    """
+    Brings the rollups, ROI Calculations and customer averages up to date with the
+    inserted readings, once per month, or marks the months for the deferred job. The
+    customer's totals move by the months' change only, so a batch costs the same however
+    long the customer's history is.
+    """
+    if not len(timestamps):
+        return
+
+    touched_months = set()
+    month_keys = timestamps.astype("datetime64[M]")
+    for month in np.unique(month_keys):
+        in_month = np.flatnonzero(month_keys == month)
+        peak = in_month[np.argmax(kw[in_month])]
+        if not defer_recalculation(customer, timestamps[peak].astype(object), kw=float(kw[peak])):
+            period = month.astype(object)
+            touched_months.add((customer, period.year, period.month))
+
+    refresh_consumption_summaries(touched_months)
+
+
+@frappe.whitelist(methods=["POST"])
+@instrument("Meter Reading Batch.ingest")
+def ingest_readings(batch_id, customer, start, kw, kwh, interval=DEFAULT_INTERVAL, meter_channel=None,
+        encoding="float64"):
+    """
+    Records a batch of readings from a meter gateway in one request and one transaction.
+
+    Args:
+        batch_id (str): Id chosen by the gateway. Posting the same batch again returns
+            the first receipt without inserting anything.
+        customer (str): The customer.
+        start (str): Time of the first reading.
+        kw (list | str): KW values, a JSON array or a base64 string of packed floats.
+        kwh (list | str): KWH values, in the same form as `kw`.
+        interval (int, optional): Seconds between consecutive readings, 15 minutes by default.
+        meter_channel (str, optional): Meter channel of all readings.
+        encoding (str, optional): `float64` or `float32`, for base64 values.
+
+    Returns:
+        dict: `batch_id`, `reading_count`, `inserted`, `duplicates` (already recorded),
+        `gaps` (NaN values) and `replayed`.
+    """
+    frappe.has_permission("Power Consumption", "create", throw=True)
+    frappe.has_permission("Power Consumption", "submit", throw=True)
+    frappe.has_permission("Customer", "read", customer, throw=True)
+    if not batch_id:
+        frappe.throw(_("A batch id is required"))
+
+    return ingest_batch(
+        batch_id,
+        customer,
+        start,
+        cint(interval),
+        decode_values(frappe.parse_json(kw) if isinstance(kw, str) and kw.startswith("[") else kw, encoding),
+        decode_values(frappe.parse_json(kwh) if isinstance(kwh, str) and kwh.startswith("[") else kwh, encoding),
+        meter_channel,
+    )
@@ -0,0 +1,182 @@
+import time
+from functools import partial
+
+import frappe
+from frappe.utils import get_datetime, getdate
+
+from test_abraham.solar_cell_company.doctype.customer.customer import (
+    apply_customer_totals,
+    reconcile_customer_totals,
+)
+from test_abraham.solar_cell_company.doctype.roi_calculation.roi_calculation import (
+    get_roi_key,
+    update_roi_calculation,
+)
+from test_abraham.solar_cell_company.doctype.solar_cell_settings.solar_cell_settings import get_settings
+from test_abraham.utils.consumption_aggregates import get_month_totals, lock_customer_month, rebuild_month
+from test_abraham.utils.summary_cache import invalidate_summaries
+
+
+DIRTY_MONTHS_KEY = "test_abraham:dirty_consumption_months"
+RECALCULATION_JOB_ID = "test_abraham:recalculate_dirty_months"
+RECONCILIATION_BATCH_SIZE = 200
+MAX_LOGGED_MISMATCHES = 50
+
+
+def refresh_consumption_summaries(touched_months):
+    """
+    Recomputes each affected monthly aggregate and ROI Calculation exactly once, and
+    moves each affected customer's running totals by the change of those months'
+    aggregates, so the cost follows the touched months rather than the customer's history.
+    `reconcile_all_customer_totals` remains the nightly check against the readings.
+
+    Args:
+        touched_months (set): `(customer, year, month)` tuples written by a bulk operation.
+    """
+    changes = {}
+    for customer, year, month in sorted(touched_months):
+        lock_customer_month(customer, f"{year}-{month:02d}-01")
+        before = get_month_totals(customer, year, month, for_update=True)
+        rebuild_month(customer, year, month)
+        after = get_month_totals(customer, year, month)
+        update_roi_calculation(customer, year, month)
+
+        change = changes.setdefault(customer, [0, 0.0, 0.0])
+        change[0] += after.reading_count - before.reading_count
+        change[1] += after.kw_sum - before.kw_sum
+        change[2] += after.kwh_sum - before.kwh_sum
+
+    for customer, (reading_count, kw_sum, kwh_sum) in sorted(changes.items()):
+        if reading_count or kw_sum or kwh_sum:
+            apply_customer_totals(customer, reading_count, kw_sum, kwh_sum)
+
+
+def defer_recalculation(customer, date, kw=None):
+    """
+    Marks a customer-month for deferred recalculation when the app is configured for it.
+
+    Returns:
+        bool: True if the recalculation was deferred, False if it should run synchronously.
+    """
+    if not get_settings().defer_roi_recalculation:
+        return False
+
+    mark_month_stale(customer, date, kw)
+    return True
+
+
+def mark_month_stale(customer, date, kw=None):
+    """
+    Flags a customer-month's ROI Calculation as stale and queues the month for the
+    recalculation job, which recomputes it with the full vectorized demand pass.
+
+    For a new reading (`kw` given) the peak is widened in the same statement, since the
+    peak can only grow on insert. The month is queued only after the surrounding
+    transaction commits, so the background job always sees the reading.
+    """
+    timestamp = get_datetime(date)
+    values = {"roi_key": get_roi_key(customer, timestamp.year, timestamp.month), "kw": kw, "date": timestamp}
+    # A single-row update through the unique key, locking only that row. The peak time is
+    # assigned before the peak, so it still compares against the previous peak.
+    if kw is None:
+        frappe.db.sql("UPDATE `tabROI Calculation` SET is_stale = 1 WHERE roi_key = %(roi_key)s", values)
+    else:
+        frappe.db.sql(
+            """
+            UPDATE `tabROI Calculation`
+            SET is_stale = 1,
+                peak_time = IF(
+                    %(kw)s > IFNULL(peak_kw, 0) OR (%(kw)s = peak_kw AND %(date)s < peak_time), %(date)s, peak_time
+                ),
+                peak_kw = GREATEST(IFNULL(peak_kw, 0), %(kw)s)
+            WHERE roi_key = %(roi_key)s
+            """,
+            values,
+        )
+
+    invalidate_summaries(customer, timestamp.year, timestamp.month)
+    date = getdate(date)
+    frappe.db.after_commit.add(partial(queue_dirty_month, customer, date.year, date.month))
+
+
+def queue_dirty_month(customer, year, month):
+    """Adds a month to the dirty set and makes sure a single recalculation job is queued."""
+    frappe.cache.sadd(DIRTY_MONTHS_KEY, f"{customer}|{year}|{month}")
+    frappe.enqueue(
+        "test_abraham.utils.recalculation.process_dirty_months",
+        queue="short",
+        job_id=RECALCULATION_JOB_ID,
+        deduplicate=True,
+        debounce=True,
+    )
+
+
+def get_dirty_customers():
+    """Customers with months queued for the recalculation job."""
+    return {frappe.safe_decode(member).rsplit("|", 2)[0] for member in frappe.cache.smembers(DIRTY_MONTHS_KEY)}
+
+
+def process_dirty_months(debounce=False):
+    """
+    Recalculates every dirty customer-month once.
+
+    When queued after a submit the job first waits for the debounce window so a burst
+    of readings collapses into a single recalculation per month. It also runs from the
+    scheduler without waiting to pick up months marked while a job was finishing.
+
+    Each month is refreshed and committed on its own. A month that fails, e.g. because a
+    rebuild batch holds its lock, is logged and marked dirty again once the run ends, so
+    the next run retries it and its ROI Calculation does not stay stale.
+    """
+    if debounce:
+        time.sleep(get_settings().recalculation_debounce or 0)
+
+    failed = set()
+    while members := frappe.cache.smembers(DIRTY_MONTHS_KEY):
+        # Remove exactly what is processed; months marked again meanwhile stay queued
+        frappe.cache.srem(DIRTY_MONTHS_KEY, *members)
+        # Start a fresh snapshot so readings committed before they were marked are visible
+        frappe.db.commit()
+
+        for member in sorted(members):
+            customer, year, month = frappe.safe_decode(member).rsplit("|", 2)
+            try:
+                refresh_consumption_summaries({(customer, int(year), int(month))})
+                frappe.db.commit()
+            except Exception:
+                frappe.db.rollback()
+                failed.add(member)
+                frappe.log_error(title=f"Recalculation of {customer} for {year}-{month} failed")
+
+    if failed:
+        frappe.cache.sadd(DIRTY_MONTHS_KEY, *failed)
+
+
+def reconcile_all_customer_totals(batch_size=RECONCILIATION_BATCH_SIZE, log_mismatches=True):
+    """
+    Nightly check of every customer's running totals and averages against the submitted
+    readings. Customers are walked in name order in small batches, each repaired and
+    committed on its own; any drift found is logged in one Error Log. Customers with
+    months still queued for the recalculation job are left to the next run.
+
+    Returns:
+        int: Number of customers that were repaired.
+    """
+    mismatches = []
+    last_customer = ""
+    while customers := frappe.db.sql_list(
+        "SELECT name FROM `tabCustomer` WHERE name > %s ORDER BY name LIMIT %s",
+        (last_customer, batch_size),
+    ):
+        # Start a fresh snapshot so the readings are counted after the customers are locked
+        frappe.db.commit()
+        mismatches.extend(reconcile_customer_totals(customers))
+        frappe.db.commit()
+        last_customer = customers[-1]
+
+    if mismatches and log_mismatches:
+        frappe.log_error(
+            title="Customer consumption totals drifted",
+            message=frappe.as_json(mismatches[:MAX_LOGGED_MISMATCHES], indent=1),
+        )
+    return len(mismatches)
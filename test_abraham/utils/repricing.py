@@ -0,0 +1,196 @@
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate, now_datetime
+
+from test_abraham.base.constants import TarriffChoices
+from test_abraham.solar_cell_company.doctype.roi_calculation.roi_calculation import MONTH_NUMBERS
+from test_abraham.utils.summary_cache import invalidate_all_summaries
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+
+REPRICING_JOB_ID = "test_abraham:reprice_roi_calculations"
+
+
+def get_month_rates(overrides=None, effective_from=None):
+    """
+    Rate and Tariff Schedule of every band of every month that has submitted ROI
+    Calculations, priced like `get_roi_values` from the schedule in effect at the start
+    of the month.
+
+    Args:
+        overrides (dict, optional): Band -> rate replacing the schedule rates.
+        effective_from (str, optional): First month the overrides apply to, all months by default.
+
+    Returns:
+        list: `(year, month, band, rate, tariff_schedule)` tuples.
+    """
+    engine = get_tariff_engine()
+    overrides = overrides or {}
+    effective_from = getdate(effective_from) if effective_from else None
+
+    rates = []
+    for year, month, band in frappe.db.sql(
+        """
+        SELECT DISTINCT roi.year, roi.month, band.band
+        FROM `tabROI Tariff Band` band
+        JOIN `tabROI Calculation` roi ON roi.name = band.parent
+        WHERE band.parenttype = 'ROI Calculation' AND roi.docstatus = 1
+        """
+    ):
+        period = getdate(f"{year}-{MONTH_NUMBERS[month]:02d}-01")
+        rate = engine.get_rate(band, period)
+        if band in overrides and (not effective_from or period >= effective_from):
+            rate = overrides[band]
+        rates.append((year, month, band, rate, engine.get_schedule(period)))
+    return rates
+
+
+def reprice_roi_calculations():
+    """
+    Re-prices the tariff bands of every submitted ROI Calculation with the current Tariff
+    Schedule rates.
+
+    Band averages are stored on the ROI Tariff Band rows, so this is two set-based UPDATEs
+    joined to the rates of each month and never reads Power Consumption. Only rates are
+    applied: after changing a schedule's rules or effective dates, the readings have to be
+    classified again with `rebuild-roi-calculations`.
+
+    Returns:
+        frappe._dict: Number of re-priced `bands` and `roi_calculations`.
+    """
+    rates = get_month_rates()
+    if not rates:
+        return frappe._dict(bands=0, roi_calculations=0)
+
+    now = now_datetime()
+    rates_table, rates_values = _values_table(("year", "month", "band", "rate"), [row[:4] for row in rates])
+    frappe.db.sql(
+        f"""
+        UPDATE `tabROI Tariff Band` band
+        JOIN `tabROI Calculation` roi ON roi.name = band.parent
+        JOIN ({rates_table}) rates ON rates.year = roi.year AND rates.month = roi.month AND rates.band = band.band
+        SET band.rate = rates.rate, band.tariff = rates.rate * band.average_kwh, band.modified = %s
+        WHERE band.parenttype = 'ROI Calculation' AND roi.docstatus = 1 AND band.rate <> rates.rate
+        """,
+        (*rates_values, now),
+    )
+    bands = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+    months = sorted({(year, month, schedule) for year, month, _, _, schedule in rates})
+    months_table, months_values = _values_table(("year", "month", "tariff_schedule"), months)
+    frappe.db.sql(
+        f"""
+        UPDATE `tabROI Calculation` roi
+        JOIN ({months_table}) months ON months.year = roi.year AND months.month = roi.month
+        LEFT JOIN `tabROI Tariff Band` low
+            ON low.parent = roi.name AND low.parenttype = 'ROI Calculation' AND low.band = %s
+        LEFT JOIN `tabROI Tariff Band` high
+            ON high.parent = roi.name AND high.parenttype = 'ROI Calculation' AND high.band = %s
+        SET roi.low_tariff = COALESCE(low.tariff, 0),
+            roi.high_tarriff = COALESCE(high.tariff, 0),
+            roi.tariff_schedule = months.tariff_schedule,
+            roi.modified = %s
+        WHERE roi.docstatus = 1 AND (
+            roi.low_tariff <> COALESCE(low.tariff, 0)
+            OR roi.high_tarriff <> COALESCE(high.tariff, 0)
+            OR NOT roi.tariff_schedule <=> months.tariff_schedule
+        )
+        """,
+        (*months_values, TarriffChoices.LOW, TarriffChoices.HIGH, now),
+    )
+    roi_calculations = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+    if bands or roi_calculations:
+        invalidate_all_summaries()
+    return frappe._dict(bands=bands, roi_calculations=roi_calculations)
+
+
+def get_repriced_totals(overrides=None, effective_from=None):
+    """
+    Tariff totals of every customer's submitted ROI Calculations at their stored rates and
+    re-priced, in one grouped query. Nothing is written.
+
+    Returns:
+        list: `{customer, customer_name, months, current_tariff, repriced_tariff, difference}` per customer.
+    """
+    rates = get_month_rates(overrides, effective_from)
+    if not rates:
+        return []
+
+    rates_table, rates_values = _values_table(("year", "month", "band", "rate"), [row[:4] for row in rates])
+    totals = frappe.db.sql(
+        f"""
+        SELECT
+            roi.customer,
+            roi.customer_name,
+            COUNT(DISTINCT roi.name) AS months,
+            SUM(band.tariff) AS current_tariff,
+            SUM(rates.rate * band.average_kwh) AS repriced_tariff
+        FROM `tabROI Tariff Band` band
+        JOIN `tabROI Calculation` roi ON roi.name = band.parent
+        JOIN ({rates_table}) rates ON rates.year = roi.year AND rates.month = roi.month AND rates.band = band.band
+        WHERE band.parenttype = 'ROI Calculation' AND roi.docstatus = 1
+        GROUP BY roi.customer, roi.customer_name
+        ORDER BY roi.customer
+        """,
+        rates_values,
+        as_dict=True,
+    )
+    for row in totals:
+        row.current_tariff = flt(row.current_tariff, 5)
+        row.repriced_tariff = flt(row.repriced_tariff, 5)
+        row.difference = flt(row.repriced_tariff - row.current_tariff, 5)
+    return totals
+
+
+def _values_table(columns, rows):
+    """A derived table of literal rows, `SELECT %s AS a, %s AS b UNION ALL SELECT %s, %s ...`, with its values."""
+    first = ", ".join(f"%s AS `{column}`" for column in columns)
+    rest = ", ".join("%s" for _ in columns)
+    sql = " UNION ALL ".join([f"SELECT {first}", *(f"SELECT {rest}" for _ in rows[1:])])
+    return sql, [value for row in rows for value in row]
+
+
+@frappe.whitelist()
+def start_repricing():
+    """
+    Queues a re-pricing of all ROI Calculations with the current Tariff Schedule rates.
+    A re-pricing that is already queued is not queued again.
+
+    Returns:
+        dict: The id of the background job.
+    """
+    frappe.only_for("System Manager")
+    queue_repricing()
+    return {"job_id": REPRICING_JOB_ID}
+
+
+def queue_repricing():
+    frappe.enqueue(
+        "test_abraham.utils.repricing.reprice_roi_calculations",
+        queue="long",
+        job_id=REPRICING_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+@frappe.whitelist()
+def get_what_if_totals(rates, effective_from=None):
+    """
+    Re-priced tariff totals of all customers for hypothetical band rates, without writing
+    anything.
+
+    Args:
+        rates (dict): Band -> rate, e.g. `{"High": 0.35}`. Other bands keep their schedule rates.
+        effective_from (str, optional): First month the rates apply to, all months by default.
+
+    Returns:
+        list: Current and re-priced tariff totals per customer, see `get_repriced_totals`.
+    """
+    frappe.only_for(("System Manager", "Sales Manager", "Accounts Manager"))
+    rates = frappe.parse_json(rates)
+    if not isinstance(rates, dict) or any(flt(rate) < 0 for rate in rates.values()):
+        frappe.throw(_("Rates must map each band to a rate of at least 0"))
+
+    return get_repriced_totals({band: flt(rate) for band, rate in rates.items()}, effective_from)
@@ -0,0 +1,211 @@
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import add_days, flt, now_datetime
+
+from test_abraham.solar_cell_company.doctype.power_consumption.power_consumption import DEFAULT_METER_CHANNEL
+from test_abraham.solar_cell_company.doctype.solar_cell_settings.solar_cell_settings import get_settings
+from test_abraham.utils.consumption_blocks import validate_readings_kept
+from test_abraham.utils.consumption_series import ConsumptionSeries
+from test_abraham.utils.tariff_engine import get_tariff_engine
+
+
+HOURS_PER_YEAR = 8760
+DEFAULT_PANEL_SIZES = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+DEFAULT_BATTERY_SIZES = (0, 5, 10, 15, 20)
+MAX_CONFIGURATIONS = 500
+
+
+def get_hourly_profile(customer, from_date=None, to_date=None, meter_channel=DEFAULT_METER_CHANNEL):
+    """
+    Hourly consumption of a customer: the mean KW of each hour with readings, which is
+    the energy used in that hour in KWH. Defaults to the last year of readings, and
+    throws over months archived with their summaries only.
+
+    Only one meter channel is read, the main meter by default: other channels such as
+    export or sub-meters overlap with it, and averaging them in would distort the load.
+
+    Returns:
+        tuple: Hour start datetimes (datetime64[s]) and KWH per hour.
+    """
+    if not from_date and not to_date:
+        from_date = add_days(now_datetime(), -365)
+
+    validate_readings_kept([customer], from_date, to_date)
+    hours, _, kw, _ = ConsumptionSeries.load(customer, from_date, to_date, meter_channel=meter_channel).resample(3600)
+    return hours, kw
+
+
+def get_pv_profile(hours, latitude, specific_yield):
+    """
+    Modelled PV generation per installed kWp for each hour, in KWH.
+
+    The shape follows the sun's elevation at mid-hour for the site's latitude and the day
+    of the year, attenuated towards the horizon. It is scaled so that a full year yields
+    `specific_yield`, which carries the local weather.
+    """
+    days = hours.astype("datetime64[D]")
+    day_of_year = (days - hours.astype("datetime64[Y]")).astype(np.int64) + 1
+    hour_of_day = (hours - days).astype("timedelta64[s]").astype(np.int64) / 3600
+
+    year = np.arange(HOURS_PER_YEAR)
+    annual = _sun_shape(year // 24 + 1, year % 24, latitude).sum()
+    return _sun_shape(day_of_year, hour_of_day, latitude) * specific_yield / annual
+
+
+def _sun_shape(day_of_year, hour_of_day, latitude):
+    declination = np.radians(23.44) * np.sin(2 * np.pi * (284 + day_of_year) / 365)
+    hour_angle = np.radians(15 * (hour_of_day + 0.5 - 12))
+    latitude = np.radians(latitude)
+    elevation = np.sin(latitude) * np.sin(declination) + np.cos(latitude) * np.cos(declination) * np.cos(hour_angle)
+    return np.clip(elevation, 0, None) ** 1.2
+
+
+def simulate(load, pv, rates, panel_kw, battery_kwh, export_rate=0, battery_efficiency=1):
+    """
+    Simulates every system configuration over the same hourly profile at once.
+
+    Generation, direct self-consumption, surplus and deficit are broadcast over a
+    `(configurations, hours)` grid. The battery charges from surplus and discharges into
+    deficit greedily, hour by hour, for all configurations in each step.
+
+    Args:
+        load (np.ndarray): KWH consumed per hour.
+        pv (np.ndarray): KWH generated per hour and installed kWp.
+        rates (np.ndarray): Tariff rate of each hour.
+        panel_kw (np.ndarray): Panel size of each configuration.
+        battery_kwh (np.ndarray): Battery capacity of each configuration.
+        export_rate (float, optional): Paid per exported KWH.
+        battery_efficiency (float, optional): Round-trip efficiency, applied on discharge.
+
+    Returns:
+        frappe._dict: Per-configuration arrays of `generation`, `self_consumption`, `export`,
+        `grid_import` (all KWH over the profile) and `savings`.
+    """
+    load, pv, rates = (np.asarray(values, dtype=np.float64) for values in (load, pv, rates))
+    panel_kw = np.asarray(panel_kw, dtype=np.float64)
+    battery_kwh = np.asarray(battery_kwh, dtype=np.float64)
+
+    generation = panel_kw[:, None] * pv[None, :]
+    direct = np.minimum(generation, load[None, :])
+    surplus = generation - direct
+    deficit = load[None, :] - direct
+
+    charged = np.zeros_like(surplus)
+    discharged = np.zeros_like(deficit)
+    if battery_kwh.any():
+        state = np.zeros(len(battery_kwh))
+        for hour in range(len(load)):
+            charged[:, hour] = np.minimum(surplus[:, hour], battery_kwh - state)
+            state += charged[:, hour]
+            discharged[:, hour] = np.minimum(deficit[:, hour], state * battery_efficiency)
+            state -= discharged[:, hour] / battery_efficiency
+
+    self_consumption = direct + discharged
+    export = surplus - charged
+    return frappe._dict(
+        generation=generation.sum(axis=1),
+        self_consumption=self_consumption.sum(axis=1),
+        export=export.sum(axis=1),
+        grid_import=(load[None, :] - self_consumption).sum(axis=1),
+        savings=(self_consumption * rates[None, :]).sum(axis=1) + export.sum(axis=1) * export_rate,
+    )
+
+
+def evaluate(annual_savings, cost, lifetime, discount_rate=0, degradation=0):
+    """
+    Payback years and net present value of each configuration, broadcast over a
+    `(configurations, years)` grid of savings that shrink with panel degradation.
+
+    Returns:
+        tuple: Payback years (NaN when never paid back within the lifetime) and NPV.
+    """
+    years = np.arange(1, lifetime + 1)
+    yearly = annual_savings[:, None] * (1 - degradation) ** (years - 1)[None, :]
+    npv = (yearly / (1 + discount_rate) ** years[None, :]).sum(axis=1) - cost
+
+    cumulative = np.cumsum(yearly, axis=1)
+    reached = cumulative >= cost[:, None]
+    year = np.argmax(reached, axis=1)
+    rows = np.arange(len(cost))
+    before = np.where(year > 0, cumulative[rows, year - 1], 0)
+    fraction = (cost - before) / np.where(yearly[rows, year] > 0, yearly[rows, year], np.inf)
+    payback = np.where(reached.any(axis=1), year + fraction, np.nan)
+    return payback, npv
+
+
+def simulate_configurations(hours, load, panel_sizes=DEFAULT_PANEL_SIZES, battery_sizes=DEFAULT_BATTERY_SIZES):
+    """
+    Sizes a grid of panel and battery combinations for an hourly consumption profile with
+    the simulation settings and tariff schedules of the site.
+
+    Returns:
+        list: One dict per configuration, best net present value first.
+    """
+    settings = get_settings()
+    panel_kw, battery_kwh = (grid.ravel() for grid in np.meshgrid(
+        np.asarray(panel_sizes, dtype=np.float64), np.asarray(battery_sizes, dtype=np.float64)
+    ))
+    if len(panel_kw) > MAX_CONFIGURATIONS:
+        frappe.throw(_("At most {0} configurations can be simulated at once").format(MAX_CONFIGURATIONS))
+    if not len(hours):
+        return []
+
+    pv = get_pv_profile(hours, flt(settings.latitude), flt(settings.specific_yield))
+    result = simulate(
+        load, pv, get_tariff_engine().get_rates(hours), panel_kw, battery_kwh,
+        export_rate=flt(settings.export_rate),
+        battery_efficiency=flt(settings.battery_efficiency) / 100 or 1,
+    )
+
+    # The profile may cover more or less than a year, or have hours without readings
+    scale = HOURS_PER_YEAR / len(hours)
+    cost = panel_kw * flt(settings.panel_cost_per_kw) + battery_kwh * flt(settings.battery_cost_per_kwh)
+    payback, npv = evaluate(
+        result.savings * scale, cost, settings.system_lifetime or 1,
+        discount_rate=flt(settings.discount_rate) / 100, degradation=flt(settings.panel_degradation) / 100,
+    )
+    consumption = load.sum()
+
+    configurations = [
+        {
+            "panel_kw": float(panel_kw[index]),
+            "battery_kwh": float(battery_kwh[index]),
+            "cost": flt(cost[index], 2),
+            "annual_generation": flt(result.generation[index] * scale, 2),
+            "annual_self_consumption": flt(result.self_consumption[index] * scale, 2),
+            "annual_export": flt(result.export[index] * scale, 2),
+            "annual_grid_import": flt(result.grid_import[index] * scale, 2),
+            "self_sufficiency": flt(100 * result.self_consumption[index] / consumption, 2) if consumption else 0,
+            "annual_savings": flt(result.savings[index] * scale, 2),
+            "payback_years": None if np.isnan(payback[index]) else flt(payback[index], 2),
+            "npv": flt(npv[index], 2),
+        }
+        for index in range(len(panel_kw))
+    ]
+    return sorted(configurations, key=lambda configuration: -configuration["npv"])
+
+
+@frappe.whitelist()
+def simulate_solar(customer, panel_sizes=None, battery_sizes=None, from_date=None, to_date=None, meter_channel=None):
+    """
+    Compares solar and battery system sizes for a customer from its consumption profile.
+
+    Args:
+        customer (str): The customer.
+        panel_sizes (list, optional): Panel sizes in kWp, 1-10 by default.
+        battery_sizes (list, optional): Battery capacities in KWH, 0-20 by default.
+        from_date (str, optional): Start of the consumption profile, a year ago by default.
+        to_date (str, optional): End of the consumption profile.
+        meter_channel (str, optional): Meter channel of the consumption profile, the main meter by default.
+
+    Returns:
+        list: Savings, payback years and NPV per configuration, best NPV first.
+    """
+    frappe.has_permission("Customer", "read", customer, throw=True)
+    hours, load = get_hourly_profile(customer, from_date, to_date, meter_channel or DEFAULT_METER_CHANNEL)
+    return simulate_configurations(
+        hours, load,
+        frappe.parse_json(panel_sizes) if panel_sizes else DEFAULT_PANEL_SIZES,
+        frappe.parse_json(battery_sizes) if battery_sizes else DEFAULT_BATTERY_SIZES,
+    )
@@ -0,0 +1,236 @@
+import json
+from functools import partial
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+from test_abraham.base.constants import month_dict
+
+
+# Cached summaries, by kind and id, stored with the versions they were built against
+SUMMARY_KEY = "test_abraham:summary:{0}:{1}"
+# Version token of a scope: everything, a customer, or one customer-month
+VERSION_KEY = "test_abraham:summary_version:{0}"
+STATS_KEY = "test_abraham:summary_cache_stats"
+SUMMARY_TTL = 24 * 60 * 60
+SUMMARY_KINDS = ("customer", "month")
+CUSTOMER_FIELDS = (
+    "name", "full_name", "email", "country", "reading_count", "kw_sum", "kwh_sum", "average_kw", "average_kwh",
+)
+MONTH_FIELDS = (
+    "name", "customer", "customer_name", "year", "month", "average_kw", "average_kwh", "low_tariff",
+    "high_tarriff", "tariff_schedule", "is_stale", "peak_kw", "peak_time", "load_factor", "p95_kw",
+)
+MONTH_NUMBERS = {name: int(number) for number, name in month_dict.items()}
+
+
+def get_scopes(customer, year=None, month=None):
+    """Scopes whose version a summary depends on. A month summary does not change with other months."""
+    return ["all", f"month:{customer}|{year}|{month}" if year else f"customer:{customer}"]
+
+
+def get_version_key(scope):
+    return frappe.cache.make_key(VERSION_KEY.format(scope))
+
+
+def read_through(kind, entry_id, scopes, build):
+    """
+    Returns a cached summary, or builds and caches it.
+
+    The entry and the current version tokens of its scopes are read in one round trip,
+    and the entry is only served if it was built against exactly those tokens, so an
+    invalidated entry is never served. The tokens are read before `build` runs: an entry
+    built from data that changes meanwhile carries the old tokens and is never served.
+    """
+    entry_key = frappe.cache.make_key(SUMMARY_KEY.format(kind, entry_id))
+    version_keys = [get_version_key(scope) for scope in scopes]
+    pipeline = frappe.cache.pipeline(transaction=False)
+    pipeline.mget([entry_key, *version_keys])
+    entry, *versions = pipeline.execute()[0]
+    if None in versions:
+        versions = init_versions(version_keys, versions)
+    versions = [version.decode() if isinstance(version, bytes) else version for version in versions]
+
+    if entry and (cached := json.loads(entry))["versions"] == versions:
+        frappe.cache.hincrby(frappe.cache.make_key(STATS_KEY), f"{kind}:hits", 1)
+        return cached["value"]
+
+    value = build()
+    if value is None:
+        return None
+
+    serialized = frappe.as_json({"versions": versions, "value": value}, indent=None)
+    pipeline = frappe.cache.pipeline(transaction=False)
+    pipeline.set(entry_key, serialized, ex=SUMMARY_TTL)
+    pipeline.hincrby(frappe.cache.make_key(STATS_KEY), f"{kind}:misses", 1)
+    pipeline.execute()
+    # Served in the same form as a cache hit
+    return json.loads(serialized)["value"]
+
+
+def init_versions(version_keys, versions):
+    """
+    Gives the scopes without a version a fresh random token. Tokens are never reused,
+    so an entry built before its version key was evicted cannot match again.
+    """
+    pipeline = frappe.cache.pipeline(transaction=False)
+    for version_key, version in zip(version_keys, versions):
+        if version is None:
+            pipeline.set(version_key, frappe.generate_hash(length=12), nx=True)
+    pipeline.mget(version_keys)
+    return pipeline.execute()[-1]
+
+
+def bump_versions(scopes):
+    pipeline = frappe.cache.pipeline(transaction=False)
+    for scope in scopes:
+        pipeline.set(get_version_key(scope), frappe.generate_hash(length=12))
+    pipeline.execute()
+
+
+def invalidate_summaries(customer, year=None, month=None):
+    """
+    Invalidates the cached summary of a customer and, with `year` and `month`, of that
+    customer-month.
+    """
+    scopes = [f"customer:{customer}"]
+    if year:
+        scopes.append(f"month:{customer}|{cint(year)}|{cint(month)}")
+    invalidate_scopes(scopes)
+
+
+def invalidate_months(months):
+    """Invalidates the summaries of several `(customer, year, month)` at once, e.g. after a rebuild."""
+    scopes = {f"customer:{customer}" for customer, _, _ in months}
+    scopes.update(f"month:{customer}|{year}|{month}" for customer, year, month in months)
+    if scopes:
+        invalidate_scopes(sorted(scopes))
+
+
+def invalidate_all_summaries():
+    """Invalidates every cached summary, after set-based writes across customers."""
+    invalidate_scopes(["all"])
+
+
+def invalidate_scopes(scopes):
+    """
+    Bumps the versions right away and again after the transaction commits: readers that
+    rebuild an entry before the commit still see the old rows, and the second bump keeps
+    those entries from being served.
+    """
+    bump_versions(scopes)
+    frappe.db.after_commit.add(partial(bump_versions, scopes))
+
+
+def check_customer_permission(customer):
+    """
+    Checks read access to a customer's summaries from cached metadata only: role
+    permissions on Customer and the user's Customer User Permissions.
+    """
+    frappe.has_permission("Customer", "read", throw=True)
+    allowed = frappe.permissions.get_user_permissions().get("Customer")
+    if allowed and customer not in {permission.get("doc") for permission in allowed}:
+        frappe.throw(_("Not permitted to read the summary of {0}").format(customer), frappe.PermissionError)
+
+
+def build_customer_summary(customer):
+    """A customer's running totals and averages with a line per submitted ROI Calculation."""
+    summary = frappe.db.get_value("Customer", customer, CUSTOMER_FIELDS, as_dict=True)
+    if not summary:
+        return None
+
+    months = frappe.get_all(
+        "ROI Calculation",
+        filters={"customer": customer, "docstatus": 1},
+        fields=["year", "month", "average_kw", "average_kwh", "low_tariff", "high_tarriff", "peak_kw", "is_stale"],
+    )
+    summary.months = sorted(months, key=lambda row: (row.year, MONTH_NUMBERS[row.month]))
+    summary.total_tariff = flt(sum((row.low_tariff or 0) + (row.high_tarriff or 0) for row in months), 5)
+    return summary
+
+
+def build_month_summary(customer, year, month):
+    """The submitted ROI Calculation of a customer-month with its tariff bands."""
+    summary = frappe.db.get_value(
+        "ROI Calculation",
+        {"customer": customer, "year": year, "month": month_dict[str(month)], "docstatus": 1},
+        MONTH_FIELDS,
+        as_dict=True,
+    )
+    if not summary:
+        return None
+
+    summary.tariff_bands = frappe.get_all(
+        "ROI Tariff Band",
+        filters={"parent": summary.name, "parenttype": "ROI Calculation"},
+        fields=["band", "reading_count", "average_kwh", "rate", "tariff"],
+        order_by="idx asc",
+    )
+    return summary
+
+
+@frappe.whitelist()
+def get_customer_summary(customer):
+    """
+    A customer's consumption averages and the ROI of each month, read through the cache.
+    A cached summary is served without any database query.
+
+    Returns:
+        dict: The Customer totals and averages, `months` and `total_tariff`.
+    """
+    check_customer_permission(customer)
+    summary = read_through("customer", customer, get_scopes(customer), partial(build_customer_summary, customer))
+    if summary is None:
+        frappe.throw(_("Customer {0} does not exist").format(customer), frappe.DoesNotExistError)
+    return summary
+
+
+@frappe.whitelist()
+def get_month_summary(customer, year, month):
+    """
+    The ROI Calculation of a customer-month with its tariff bands, read through the cache.
+
+    Args:
+        customer (str): The customer.
+        year (int): Year of the month.
+        month (int): Month number (1-12).
+    """
+    check_customer_permission(customer)
+    year, month = cint(year), cint(month)
+    if not 1 <= month <= 12:
+        frappe.throw(_("Month must be a number between 1 and 12"))
+
+    summary = read_through(
+        "month", f"{customer}|{year}|{month}", get_scopes(customer, year, month),
+        partial(build_month_summary, customer, year, month),
+    )
+    if summary is None:
+        frappe.throw(
+            _("There is no ROI Calculation of {0} for {1} {2}").format(customer, month_dict[str(month)], year),
+            frappe.DoesNotExistError,
+        )
+    return summary
+
+
+@frappe.whitelist()
+def get_summary_cache_stats(reset=False):
+    """
+    Hits and misses of the summary cache per kind since the last reset.
+
+    Returns:
+        dict: kind -> `{hits, misses, hit_rate}`.
+    """
+    frappe.only_for("System Manager")
+    pipeline = frappe.cache.pipeline()
+    pipeline.hgetall(frappe.cache.make_key(STATS_KEY))
+    if cint(reset):
+        pipeline.delete(frappe.cache.make_key(STATS_KEY))
+    counters = {key.decode(): int(value) for key, value in pipeline.execute()[0].items()}
+
+    stats = {}
+    for kind in SUMMARY_KINDS:
+        hits, misses = counters.get(f"{kind}:hits", 0), counters.get(f"{kind}:misses", 0)
+        total = hits + misses
+        stats[kind] = {"hits": hits, "misses": misses, "hit_rate": round(hits / total, 4) if total else 0}
+    return stats
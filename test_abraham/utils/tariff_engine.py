@@ -0,0 +1,203 @@
+import numpy as np
+
+import frappe
+from frappe.utils import getdate
+
+from test_abraham.base.constants import TarriffChoices
+
+
+CACHE_KEY = "test_abraham:tariff_engine"
+HOURS_PER_WEEK = 168
+
+# Offset keeping holiday keys positive for dates before 1970
+HOLIDAY_DAY_OFFSET = 1_000_000
+
+DAY_GROUPS = {
+    "All Days": range(7),
+    "Weekdays": range(5),
+    "Weekends": (5, 6),
+    "Monday": (0,),
+    "Tuesday": (1,),
+    "Wednesday": (2,),
+    "Thursday": (3,),
+    "Friday": (4,),
+    "Saturday": (5,),
+    "Sunday": (6,),
+}
+
+# The original LOW (23:00-05:59, 10%) / HIGH (30%) split. It always applies before the
+# first Tariff Schedule takes effect so historic months keep their pricing.
+DEFAULT_SCHEDULE = frappe._dict(
+    name=None,
+    effective_from="1900-01-01",
+    default_band=TarriffChoices.HIGH,
+    bands=[(TarriffChoices.LOW, 0.1), (TarriffChoices.HIGH, 0.3)],
+    rules=[(TarriffChoices.LOW, "All Days", 23, 6)],
+    holidays=[],
+)
+
+
+def get_rule_slots(day, from_hour, to_hour):
+    """
+    Hour-of-week slots covered by a rule on a weekday. A window such as 23 -> 6 wraps
+    past midnight, so its early hours fall on the following day (Sunday into Monday).
+    """
+    if from_hour < to_hour:
+        return [day * 24 + hour for hour in range(from_hour, to_hour)]
+    next_day = (day + 1) % 7
+    return [day * 24 + hour for hour in range(from_hour, 24)] + [next_day * 24 + hour for hour in range(to_hour)]
+
+
+class TariffEngine:
+    """
+    Compiled form of the Tariff Schedules.
+
+    Every schedule becomes a 168-slot (hour-of-week, Monday 00:00 first) table of band
+    indices plus a sorted array of holiday overrides, so classifying any number of
+    timestamps is a handful of NumPy array lookups with no per-record branching.
+    """
+
+    __slots__ = ("schedules", "effective_from", "band_names", "slots", "rates", "holiday_keys", "holiday_bands")
+
+    def __init__(self, schedules):
+        schedules = sorted(schedules, key=lambda schedule: getdate(schedule.effective_from))
+        self.schedules = [schedule.name for schedule in schedules]
+        self.effective_from = np.array([getdate(schedule.effective_from) for schedule in schedules], dtype="datetime64[D]")
+        self.band_names = sorted({band for schedule in schedules for band, _ in schedule.bands})
+
+        band_index = {band: index for index, band in enumerate(self.band_names)}
+        self.slots = np.empty((len(schedules), HOURS_PER_WEEK), dtype=np.int16)
+        self.rates = np.full((len(schedules), len(self.band_names)), np.nan)
+        holiday_keys, holiday_bands = [], []
+
+        for position, schedule in enumerate(schedules):
+            self.slots[position, :] = band_index[schedule.default_band]
+            for band, rate in schedule.bands:
+                self.rates[position, band_index[band]] = rate
+
+            # Later rules override earlier ones
+            for band, days, from_hour, to_hour in schedule.rules:
+                for day in DAY_GROUPS[days]:
+                    self.slots[position, get_rule_slots(day, from_hour, to_hour)] = band_index[band]
+
+            for holiday_date, band in schedule.holidays:
+                day = np.datetime64(getdate(holiday_date), "D").astype(np.int64)
+                holiday_keys.append(self._holiday_key(position, day))
+                holiday_bands.append(band_index[band])
+
+        order = np.argsort(np.array(holiday_keys, dtype=np.int64), kind="stable")
+        self.holiday_keys = np.array(holiday_keys, dtype=np.int64)[order]
+        self.holiday_bands = np.array(holiday_bands, dtype=np.int16)[order]
+
+    @staticmethod
+    def _holiday_key(schedule_index, day):
+        return schedule_index * 10_000_000 + day + HOLIDAY_DAY_OFFSET
+
+    def schedule_index(self, days):
+        """Index of the schedule in effect for each day (datetime64[D] array)."""
+        return np.clip(np.searchsorted(self.effective_from, days, side="right") - 1, 0, None)
+
+    def classify(self, timestamps):
+        """
+        Returns the band index of every timestamp.
+
+        Args:
+            timestamps: A sequence or array of datetimes.
+
+        Returns:
+            np.ndarray: Indices into `band_names`.
+        """
+        timestamps = np.asarray(timestamps, dtype="datetime64[s]")
+        days = timestamps.astype("datetime64[D]")
+        hours = (timestamps - days).astype("timedelta64[h]").astype(np.int64)
+        day_numbers = days.astype(np.int64)
+        # 1970-01-01 was a Thursday, shift so Monday is 0
+        weekdays = (day_numbers + 3) % 7
+
+        schedule_index = self.schedule_index(days)
+        bands = self.slots[schedule_index, weekdays * 24 + hours]
+
+        if self.holiday_keys.size:
+            keys = self._holiday_key(schedule_index, day_numbers)
+            positions = np.minimum(np.searchsorted(self.holiday_keys, keys), self.holiday_keys.size - 1)
+            is_holiday = self.holiday_keys[positions] == keys
+            bands = np.where(is_holiday, self.holiday_bands[positions], bands)
+
+        return bands
+
+    def classify_names(self, timestamps):
+        """Returns the band name of every timestamp."""
+        return np.asarray(self.band_names, dtype=object)[self.classify(timestamps)]
+
+    def get_rates(self, timestamps):
+        """
+        Returns the rate of every timestamp's band, each from the latest schedule in effect
+        that defines the band, like `get_rate`.
+        """
+        timestamps = np.asarray(timestamps, dtype="datetime64[s]")
+        rates = self.rates.copy()
+        for position in range(1, len(rates)):
+            rates[position] = np.where(np.isnan(rates[position]), rates[position - 1], rates[position])
+
+        schedule_index = self.schedule_index(timestamps.astype("datetime64[D]"))
+        return np.nan_to_num(rates[schedule_index, self.classify(timestamps)])
+
+    def get_band(self, timestamp):
+        """Returns the band name of a single timestamp."""
+        return self.band_names[self.classify([timestamp])[0]]
+
+    def get_schedule(self, date):
+        """Name of the Tariff Schedule in effect on a date (None for the built-in schedule)."""
+        return self.schedules[self.schedule_index(np.datetime64(getdate(date), "D"))]
+
+    def get_rate(self, band, date):
+        """
+        Rate of a band on a date, taken from the latest schedule in effect that defines
+        the band. Bands that were never priced have a rate of 0.
+        """
+        if band not in self.band_names:
+            return 0
+
+        rates = self.rates[: self.schedule_index(np.datetime64(getdate(date), "D")) + 1, self.band_names.index(band)]
+        defined = rates[~np.isnan(rates)]
+        return float(defined[-1]) if defined.size else 0
+
+
+def load_schedules():
+    """Reads the enabled Tariff Schedules with their bands, rules and holidays."""
+    schedules = frappe.db.sql(
+        """
+        SELECT name, effective_from, default_band
+        FROM `tabTariff Schedule`
+        WHERE disabled = 0
+        """,
+        as_dict=True,
+    )
+
+    def child_rows(doctype, fields):
+        rows = frappe._dict()
+        for row in frappe.db.sql(
+            f"SELECT parent, {', '.join(fields)} FROM `tab{doctype}` WHERE parenttype = 'Tariff Schedule' ORDER BY idx",
+        ):
+            rows.setdefault(row[0], []).append(tuple(row[1:]))
+        return rows
+
+    bands = child_rows("Tariff Schedule Band", ["band", "rate"])
+    rules = child_rows("Tariff Schedule Rule", ["band", "days", "from_hour", "to_hour"])
+    holidays = child_rows("Tariff Schedule Holiday", ["holiday_date", "band"])
+
+    for schedule in schedules:
+        schedule.bands = bands.get(schedule.name, [])
+        schedule.rules = rules.get(schedule.name, [])
+        schedule.holidays = holidays.get(schedule.name, [])
+
+    return [DEFAULT_SCHEDULE, *schedules]
+
+
+def get_tariff_engine():
+    """Returns the compiled TariffEngine, building and caching it on first use."""
+    return frappe.cache.get_value(CACHE_KEY, generator=lambda: TariffEngine(load_schedules()))
+
+
+def clear_tariff_engine_cache():
+    frappe.cache.delete_value(CACHE_KEY)
@@ -0,0 +1,44 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+    make_power_consumption,
+    make_test_customer,
+)
+from test_abraham.utils.consumption_export import EXPORT_COLUMNS, iter_csv, iter_reading_chunks
+
+
+class TestConsumptionExport(FrappeTestCase):
+
+    def setUp(self):
+        self.customer = make_test_customer()
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+    def test_export(self):
+        """Keyset pages follow (date, name) across equal timestamps and encode to importable CSV"""
+        make_power_consumption(self.customer, "2024-10-01 00:15:00", 2, 0)
+        frappe.get_doc({
+            "doctype": "Power Consumption",
+            "customer": self.customer,
+            "date": "2024-10-01 00:00:00",
+            "meter_channel": "export",
+            "kwh": 1,
+            "kwh__": 0,
+        }).insert(ignore_permissions=True).submit()
+        make_power_consumption(self.customer, "2024-10-01 00:00:00", 3, 3)
+
+        filters = {"from_date": "2024-10-01 00:00:00", "to_date": "2024-10-01 23:59:59"}
+        chunks = list(iter_reading_chunks([self.customer], chunk_size=2, **filters))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        rows = [row for chunk in chunks for row in chunk]
+        self.assertEqual([str(row[1]) for row in rows], ["2024-10-01 00:00:00"] * 2 + ["2024-10-01 00:15:00"])
+        self.assertEqual(sorted(row[5] for row in rows[:2]), ["export", "main"])
+
+        lines = "".join(iter_csv(chunks)).splitlines()
+        self.assertEqual(lines[0], ",".join(EXPORT_COLUMNS))
+        self.assertEqual(len(lines), 4)
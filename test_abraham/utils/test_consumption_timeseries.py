@@ -0,0 +1,65 @@
+# Copyright (c) 2025, NoBoneZ and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from test_abraham.base.constants import TarriffChoices
+from test_abraham.solar_cell_company.doctype.power_consumption.test_power_consumption import (
+    make_power_consumption,
+    make_test_customer,
+)
+from test_abraham.utils.consumption_blocks import pack_month
+from test_abraham.utils.consumption_timeseries import choose_resolution, get_consumption_timeseries
+
+
+class TestConsumptionTimeseries(FrappeTestCase):
+
+    def setUp(self):
+        self.customer = make_test_customer()
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+    def test_timeseries(self):
+        """Raw pages follow the keyset cursor; buckets carry mean, max and the tariff split"""
+        make_power_consumption(self.customer, "2024-11-01 00:00:00", 2, 2)
+        make_power_consumption(self.customer, "2024-11-01 00:15:00", 4, 0)
+        make_power_consumption(self.customer, "2024-11-01 23:00:00", 1, 1)
+        day = {"from_date": "2024-11-01 00:00:00", "to_date": "2024-11-01 23:59:59"}
+
+        page = get_consumption_timeseries(self.customer, **day, resolution="raw", max_points=2)
+        self.assertEqual(page["kw"], [2, 4])
+        self.assertEqual(page["next_cursor"], "2024-11-01 00:15:00")
+        page = get_consumption_timeseries(
+            self.customer, **day, resolution="raw", max_points=2, cursor=page["next_cursor"]
+        )
+        self.assertEqual((page["timestamps"], page["tariff"]), (["2024-11-01T23:00:00"], [TarriffChoices.LOW]))
+        self.assertIsNone(page["next_cursor"])
+
+        hourly = get_consumption_timeseries(self.customer, **day, resolution="1h")
+        self.assertEqual(hourly["timestamps"], ["2024-11-01T00:00:00", "2024-11-01T23:00:00"])
+        self.assertEqual((hourly["mean_kw"], hourly["max_kw"]), ([3, 1], [4, 1]))
+
+        daily = get_consumption_timeseries(self.customer, **day, resolution="1d")
+        self.assertEqual(daily["reading_count"], [3])
+        self.assertEqual(daily["tariffs"], {TarriffChoices.HIGH: [2], TarriffChoices.LOW: [1]})
+        self.assertEqual(choose_resolution("2024-01-01", "2025-01-01"), "12h")
+
+    def test_raw_pages_across_blocks(self):
+        """Raw pages end after `max_points` readings whether they come from blocks or records"""
+        make_power_consumption(self.customer, "2024-04-30 10:00:00", 1, 1)
+        make_power_consumption(self.customer, "2024-05-01 08:00:00", 2, 2)
+        make_power_consumption(self.customer, "2024-05-02 09:00:00", 3, 3)
+        make_power_consumption(self.customer, "2024-05-02 23:30:00", 4, 4)
+        make_power_consumption(self.customer, "2024-06-03 10:00:00", 5, 5)
+        pack_month(self.customer, 2024, 5)
+        period = {"from_date": "2024-04-01 00:00:00", "to_date": "2024-06-30 23:59:59"}
+
+        pages, cursor = [], None
+        while True:
+            page = get_consumption_timeseries(self.customer, **period, resolution="raw", max_points=2, cursor=cursor)
+            pages.append(page["kw"])
+            if not (cursor := page["next_cursor"]):
+                break
+        self.assertEqual(pages, [[1, 2], [3, 4], [5]])